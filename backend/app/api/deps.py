@@ -1,5 +1,5 @@
 from typing import Generator, Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from jwt.exceptions import PyJWTError
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core import security
 from app.core.config import settings
 from app.core.database import get_session
+from app.core.api_key_cache import ResolvedApiKey, resolve_api_key
 from app.models.all_models import User
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -32,3 +33,15 @@ async def get_current_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
+
+
+async def get_ingest_api_key(
+    x_api_key: str = Header(...),
+    session: AsyncSession = Depends(get_session),
+) -> ResolvedApiKey:
+    api_key_obj = await resolve_api_key(session, x_api_key)
+    if not api_key_obj:
+        raise HTTPException(status_code=403, detail="Invalid API Key")
+    if not api_key_obj.is_active:
+        raise HTTPException(status_code=403, detail="API Key is inactive")
+    return api_key_obj
@@ -0,0 +1,233 @@
+import json
+import zlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, Tuple
+
+import msgspec
+import zstandard
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+
+# Upper bound on the output produced by a single decompress call
+DECODE_OUTPUT_CHUNK = 256 * 1024
+# zstd has no output limit on push-style decompression, so it is pulled from
+# a stream_reader. The reader treats an empty read of its source as the end
+# of input, so it is only read while this much compressed input is buffered:
+# more than one read can consume (its output, a partly decoded 128 KiB block
+# and a source read).
+ZSTD_READ_SIZE = 16 * 1024
+ZSTD_MIN_BUFFERED_INPUT = 1024 * 1024
+
+
+class IdentityDecoder:
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        if data:
+            yield data
+
+    def flush(self) -> Iterator[bytes]:
+        return iter(())
+
+
+class GzipDecoder:
+    def __init__(self):
+        self._obj = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        while data:
+            out = self._obj.decompress(data, DECODE_OUTPUT_CHUNK)
+            if out:
+                yield out
+            if self._obj.eof:
+                # Concatenated gzip members are valid; start a new stream
+                data = self._obj.unused_data
+                self._obj = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            else:
+                data = self._obj.unconsumed_tail
+
+    def flush(self) -> Iterator[bytes]:
+        out = self._obj.flush()
+        if out:
+            yield out
+
+
+class ZstdInputStarved(ValueError):
+    """
+    The zstd reader needed more input than was buffered, e.g. to skip a
+    huge skippable frame.
+    """
+
+
+class ZstdInput:
+    """
+    Source of a stream_reader: the compressed input received so far.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.complete = False
+
+    def read(self, size: int) -> bytes:
+        if not self.buffer and not self.complete:
+            raise ZstdInputStarved("zstd frame needs more input than is buffered")
+        out = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return out
+
+
+class ZstdDecoder:
+    def __init__(self):
+        self._input = ZstdInput()
+        self._reader = zstandard.ZstdDecompressor().stream_reader(
+            self._input, read_size=ZSTD_READ_SIZE, read_across_frames=True
+        )
+
+    def _read(self, min_buffered: int) -> Iterator[bytes]:
+        while len(self._input.buffer) >= min_buffered:
+            out = self._reader.read(DECODE_OUTPUT_CHUNK)
+            if not out:
+                break
+            yield out
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        self._input.buffer += data
+        return self._read(ZSTD_MIN_BUFFERED_INPUT)
+
+    def flush(self) -> Iterator[bytes]:
+        self._input.complete = True
+        return self._read(0)
+
+
+DECODERS = {
+    "identity": IdentityDecoder,
+    "gzip": GzipDecoder,
+    "x-gzip": GzipDecoder,
+    "zstd": ZstdDecoder,
+}
+
+
+def get_decoder(content_encoding: Optional[str]):
+    encoding = (content_encoding or "identity").strip().lower()
+    decoder_cls = DECODERS.get(encoding)
+    if decoder_cls is None:
+        raise HTTPException(
+            status_code=415, detail=f"Unsupported Content-Encoding: {encoding}"
+        )
+    return decoder_cls()
+
+
+def content_length(request: Request) -> int:
+    """
+    The declared size of the (compressed) body, 0 when there is none.
+    """
+    value = request.headers.get("content-length")
+    return int(value) if value and value.isdigit() else 0
+
+
+async def iter_request_body(
+    request: Request, max_size: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yield the request body as it arrives, decompressing according to
+    Content-Encoding. Aborts with 413 once the decompressed size passes
+    `max_size`, so a small compressed upload can't expand without bound.
+    """
+    max_size = max_size or settings.INGEST_MAX_BODY_BYTES
+    decoder = get_decoder(request.headers.get("content-encoding"))
+
+    if content_length(request) > max_size:
+        raise HTTPException(status_code=413, detail="Request body too large")
+
+    total = 0
+
+    def check(out: bytes):
+        nonlocal total
+        total += len(out)
+        if total > max_size:
+            raise HTTPException(status_code=413, detail="Request body too large")
+
+    try:
+        async for chunk in request.stream():
+            for out in decoder.feed(chunk):
+                check(out)
+                yield out
+        for out in decoder.flush():
+            check(out)
+            yield out
+    except (zlib.error, zstandard.ZstdError, ZstdInputStarved) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid compressed body: {e}")
+
+
+async def read_request_body(request: Request) -> bytes:
+    """
+    Dependency returning the full decompressed request body.
+    """
+    return b"".join([chunk async for chunk in iter_request_body(request)])
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in NDJSON_CONTENT_TYPES
+
+
+async def iter_ndjson_records(
+    request: Request,
+    decode: Callable[[bytes], Any] = json.loads,
+    reject: Optional[Callable[[bytes, str], Awaitable[None]]] = None,
+) -> AsyncIterator[Tuple[Any, int]]:
+    """
+    Yield (decoded record, line size in bytes) for each non-empty line of the
+    request body. `decode` may be a typed msgspec decoder.
+
+    A line that fails to decode aborts the stream with a 400, unless an
+    async `reject(line, reason)` callback is given; the line is then passed
+    to it and skipped (its size is not counted).
+
+    Only the current partial line is held in memory. A single line may not
+    exceed INGEST_MAX_BODY_BYTES; the stream as a whole is capped by
+    INGEST_NDJSON_MAX_BODY_BYTES.
+    """
+    pending = bytearray()
+    line_no = 0
+
+    def decode_line(line: bytes) -> Tuple[Any, Optional[str]]:
+        """
+        (record, None), or (None, reason) for a line to pass to `reject`.
+        """
+        try:
+            return decode(line), None
+        except (ValueError, msgspec.DecodeError) as e:
+            if reject is None:
+                raise HTTPException(status_code=400, detail=f"Invalid record on line {line_no}: {e}")
+            return None, f"Line {line_no}: {e}"
+
+    async for chunk in iter_request_body(request, max_size=settings.INGEST_NDJSON_MAX_BODY_BYTES):
+        pending += chunk
+        start = 0
+        while True:
+            end = pending.find(b"\n", start)
+            if end == -1:
+                break
+            line_no += 1
+            line = bytes(pending[start:end]).strip()
+            start = end + 1
+            if line:
+                record, error = decode_line(line)
+                if error is not None:
+                    await reject(line, error)
+                elif record is not None:
+                    yield record, len(line)
+        del pending[:start]
+        if len(pending) > settings.INGEST_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {line_no + 1} too large")
+
+    line_no += 1
+    line = bytes(pending).strip()
+    if line:
+        record, error = decode_line(line)
+        if error is not None:
+            await reject(line, error)
+        elif record is not None:
+            yield record, len(line)
@@ -10,6 +10,7 @@ from app.api.v1.endpoints import (
     rules,
     admin,
     roles,
+    model_prices,
 )
 
 api_router = APIRouter()
@@ -27,3 +28,6 @@ api_router.include_router(roles.router, prefix="/roles", tags=["roles"])
 api_router.include_router(
     providers.router, prefix="/management/providers", tags=["providers"]
 )
+api_router.include_router(
+    model_prices.router, prefix="/management/model-prices", tags=["model-prices"]
+)
@@ -1,10 +1,17 @@
-from typing import List, Any
+from typing import List, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, Body
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.api import deps
 from app.core.database import get_session
 from app.models.all_models import User, OrganizationUserLink, Role, Organization
+from app.core.api_key_cache import api_key_cache
+from app.core.ingest_buffer import ingest_buffer
+from app.core.rate_limit import ingest_rate_limiter
+from app.core.dedup import idempotency_cache, observation_seen, span_seen
+from app.core.evaluation_sampling import evaluation_sampling
+from app.core.dead_letter import dead_letter_summary, replay_dead_letters
+from app.core.payload_blobs import blob_seen
 from pydantic import BaseModel
 import uuid
 
@@ -125,3 +132,66 @@ async def assign_user_role(
 
     await session.commit()
     return {"status": "success"}
+
+
+@router.get("/ingest/stats")
+async def ingest_stats(
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Ingest pipeline counters for this worker process: rows pending in the
+    buffer, spool depth and replay progress, API key cache hit rate,
+    admitted and rate-limited requests, dropped duplicates, observations
+    sampled in and out per evaluation rule.
+    Only superuser.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    return {
+        "buffer": ingest_buffer.stats(),
+        "api_key_cache": api_key_cache.stats(),
+        "rate_limiter": ingest_rate_limiter.stats(),
+        "dedup": {
+            "spans": span_seen.stats(),
+            "observations": observation_seen.stats(),
+            "idempotency_keys": idempotency_cache.stats(),
+            "payload_blobs": blob_seen.stats(),
+        },
+        "evaluation_sampling": evaluation_sampling.stats(),
+    }
+
+
+@router.get("/ingest/dead-letters")
+async def list_dead_letters(
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    Records rejected at ingest, counted per project and target table, with
+    an example reason. Only superuser.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    return await dead_letter_summary()
+
+
+@router.post("/ingest/dead-letters/replay")
+async def replay_ingest_dead_letters(
+    target_table: Optional[str] = None,
+    project_id: Optional[uuid.UUID] = None,
+    limit: int = 100000,
+    current_user: User = Depends(deps.get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> Any:
+    """
+    Re-ingest dead letters, oldest first, e.g. after a fix to the ingest
+    code. Records that now pass are inserted and removed from the dead
+    letter table; the others stay. Only superuser.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if target_table is not None and target_table not in ("traces", "observations"):
+        raise HTTPException(status_code=400, detail="target_table must be traces or observations")
+
+    return await replay_dead_letters(session, target_table, project_id, limit)
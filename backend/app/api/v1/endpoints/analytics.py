@@ -1,6 +1,14 @@
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
-from app.core.clickhouse import get_clickhouse_client
+from app.core.clickhouse import (
+    OBSERVATION_ROLLUP_TABLE,
+    TRACE_ROLLUP_TABLE,
+    TRACE_USER_ROLLUP_TABLE,
+    get_clickhouse,
+)
+from app.core.payload_blobs import resolve_payload_refs
+from app.core.config import settings
+from clickhouse_connect.driver.client import Client
 from app.core.database import get_session
 from app.api.deps import get_current_user
 from app.models.all_models import User
@@ -8,6 +16,7 @@ from app.models.evaluation_result import EvaluationResult
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, case
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -28,23 +37,32 @@ async def get_traces(
     from_ts: Optional[float] = None,
     to_ts: Optional[float] = None,
     current_user: User = Depends(get_current_user),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get list of traces for a project with input/output preview.
-    """
-    client = get_clickhouse_client()
 
-    where_clause = f"t.project_id = '{project_id}' AND t.parent_span_id IS NULL"
+    Reads the trace_summary table (one pre-aggregated row per trace and
+    day), so listing doesn't touch the observations table.
+    """
+    # Rows of a trace are merged in the background, so every filter on a
+    # trace field goes in HAVING, after the rows are combined
+    where_clause = f"project_id = '{project_id}'"
+    having_clause = "start_time IS NOT NULL"  # traces whose root span has arrived
 
     if from_ts:
-        where_clause += f" AND t.start_time >= toDateTime64({from_ts}, 9)"
+        # A trace's rows are keyed by the day of each span/observation;
+        # widen by a day so traces crossing midnight are kept whole
+        where_clause += f" AND day >= toDate(toDateTime64({from_ts}, 9)) - 1"
+        having_clause += f" AND start_time >= toDateTime64({from_ts}, 9)"
     if to_ts:
-        where_clause += f" AND t.start_time <= toDateTime64({to_ts}, 9)"
+        where_clause += f" AND day <= toDate(toDateTime64({to_ts}, 9)) + 1"
+        having_clause += f" AND start_time <= toDateTime64({to_ts}, 9)"
 
     if search:
         # Simple search on name or trace_id for now
-        where_clause += (
-            f" AND (t.name ILIKE '%{search}%' OR t.trace_id ILIKE '%{search}%')"
+        having_clause += (
+            f" AND (name ILIKE '%{search}%' OR trace_id ILIKE '%{search}%')"
         )
 
     if status:
@@ -60,27 +78,27 @@ async def get_traces(
         # Remove duplicates
         mapped_status = list(set(mapped_status))
         status_list = "', '".join(mapped_status)
-        where_clause += f" AND t.status_code IN ('{status_list}')"
+        having_clause += f" AND status_code IN ('{status_list}')"
 
     if name:
         name_list = "', '".join(name)
-        where_clause += f" AND t.name IN ('{name_list}')"
+        having_clause += f" AND name IN ('{name_list}')"
 
     if application:
         app_list = "', '".join(application)
-        where_clause += f" AND t.application_name IN ('{app_list}')"
+        having_clause += f" AND application_name IN ('{app_list}')"
 
     # Sorting Logic
     sort_column_map = {
-        "timestamp": "t.start_time",
-        "start_time": "t.start_time",
-        "name": "t.name",
-        "latency": "t.duration_ms",
-        "duration": "t.duration_ms",
-        "tokens": "o_metrics.total_tokens",
+        "timestamp": "start_time",
+        "start_time": "start_time",
+        "name": "name",
+        "latency": "duration_ms",
+        "duration": "duration_ms",
+        "tokens": "tokens",
     }
 
-    order_clause = "t.start_time DESC"
+    order_clause = "start_time DESC"
     if sort_by and sort_by in sort_column_map:
         col = sort_column_map[sort_by]
         direction = "ASC" if order and order.lower() == "asc" else "DESC"
@@ -88,49 +106,23 @@ async def get_traces(
 
     query = f"""
     SELECT 
-        t.trace_id, 
-        t.name, 
-        t.start_time, 
-        t.end_time, 
-        t.duration_ms, 
-        t.status_code, 
-        t.user_id,
-        o_first.input_text,
-        o_last.output_text,
-        o_metrics.total_tokens,
-        0.0 as total_cost, -- Placeholder for cost calculation
-        t.attributes, -- Metadata
-        t.application_name
-    FROM traces t
-    LEFT JOIN (
-        SELECT trace_id, input_text
-        FROM observations
-        WHERE project_id = '{project_id}'
-        ORDER BY start_time ASC
-        LIMIT 1 BY trace_id
-    ) o_first ON t.trace_id = o_first.trace_id
-    LEFT JOIN (
-        SELECT trace_id, output_text
-        FROM observations
-        WHERE project_id = '{project_id}'
-        ORDER BY start_time DESC
-        LIMIT 1 BY trace_id
-    ) o_last ON t.trace_id = o_last.trace_id
-    LEFT JOIN (
-        SELECT 
-            trace_id, 
-            sum(
-                CASE 
-                    WHEN isValidJSON(token_usage) THEN 
-                    COALESCE(JSONExtractInt(token_usage, 'total_tokens'), 0)
-                    ELSE 0 
-                END
-            ) as total_tokens
-        FROM observations
-        WHERE project_id = '{project_id}'
-        GROUP BY trace_id
-    ) o_metrics ON t.trace_id = o_metrics.trace_id
-    WHERE {where_clause} AND (t.parent_span_id IS NULL OR t.parent_span_id = '')
+        trace_id, 
+        anyLast(root_name) AS name, 
+        min(root_start_time) AS start_time, 
+        max(root_end_time) AS end_time, 
+        max(root_duration_ms) AS duration_ms, 
+        anyLast(root_status_code) AS status_code, 
+        anyLast(root_user_id) AS user_id,
+        argMinMerge(first_input) AS input,
+        argMaxMerge(last_output) AS output,
+        sum(total_tokens) AS tokens,
+        sum(total_cost) AS cost,
+        argMaxMerge(root_attributes) AS metadata,
+        anyLast(root_application_name) AS application_name
+    FROM trace_summary
+    WHERE {where_clause}
+    GROUP BY trace_id
+    HAVING {having_clause}
     ORDER BY {order_clause}
     LIMIT {limit} OFFSET {offset}
     """
@@ -139,9 +131,7 @@ async def get_traces(
         result = client.query(query)
         traces = []
         for row in result.result_rows:
-            # Estimate cost based on tokens (very rough mock: $0.000002 per token)
             tokens = row[9] or 0
-            est_cost = tokens * 0.000002
 
             traces.append(
                 {
@@ -155,7 +145,7 @@ async def get_traces(
                     "input": row[7],
                     "output": row[8],
                     "total_tokens": tokens,
-                    "total_cost": est_cost,
+                    "total_cost": row[10] or 0.0,
                     "metadata": row[11],  # Map
                     "application_name": row[12],
                 }
@@ -167,16 +157,17 @@ async def get_traces(
 
 @router.get("/traces/applications")
 async def get_application_names(
-    project_id: str, current_user: User = Depends(get_current_user)
+    project_id: str,
+    current_user: User = Depends(get_current_user),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get unique application names for a project to populate filters.
     """
-    client = get_clickhouse_client()
     query = f"""
     SELECT DISTINCT application_name 
     FROM traces 
-    WHERE project_id = '{project_id}' AND parent_span_id IS NULL AND application_name IS NOT NULL
+    WHERE project_id = '{project_id}' AND is_root = 1 AND application_name != ''
     ORDER BY application_name ASC
     """
     try:
@@ -189,16 +180,17 @@ async def get_application_names(
 
 @router.get("/traces/names")
 async def get_trace_names(
-    project_id: str, current_user: User = Depends(get_current_user)
+    project_id: str,
+    current_user: User = Depends(get_current_user),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get unique trace names for a project to populate filters.
     """
-    client = get_clickhouse_client()
     query = f"""
     SELECT DISTINCT name 
     FROM traces 
-    WHERE project_id = '{project_id}' AND parent_span_id IS NULL
+    WHERE project_id = '{project_id}' AND is_root = 1
     ORDER BY name ASC
     """
     try:
@@ -211,12 +203,28 @@ async def get_trace_names(
 
 @router.get("/traces/{trace_id}")
 async def get_trace_details(
-    trace_id: str, current_user: User = Depends(get_current_user)
+    trace_id: str,
+    project_id: Optional[uuid.UUID] = None,
+    start_ts: Optional[float] = None,  # Start time of the trace, if known
+    current_user: User = Depends(get_current_user),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get full trace details including all spans and observations.
+
+    Callers that know the trace's project and start time should pass them:
+    the tables are sorted by (project_id, start_time), so they let ClickHouse
+    skip most of the table instead of relying on the trace_id index alone.
     """
-    client = get_clickhouse_client()
+    where_clause = f"trace_id = '{trace_id}'"
+    if project_id:
+        where_clause += f" AND project_id = '{project_id}'"
+    if start_ts:
+        window = settings.TRACE_DETAIL_WINDOW_SECONDS
+        where_clause += (
+            f" AND start_time BETWEEN toDateTime64({start_ts - window}, 9)"
+            f" AND toDateTime64({start_ts + window}, 9)"
+        )
 
     # Fetch all spans for this trace
     spans_query = f"""
@@ -224,7 +232,7 @@ async def get_trace_details(
         trace_id, span_id, parent_span_id, name, kind, start_time, end_time, 
         status_code, status_message, attributes, events, links, duration_ms, application_name
     FROM traces 
-    WHERE trace_id = '{trace_id}'
+    WHERE {where_clause}
     ORDER BY start_time ASC
     """
 
@@ -234,9 +242,9 @@ async def get_trace_details(
     SELECT 
         id, parent_observation_id, name, type, model, start_time, end_time, 
         input_text, output_text, token_usage, model_parameters, metadata_json, 
-        extra, observation_type, error, total_cost
+        extra, observation_type, error, total_cost, project_id, input_ref, output_ref
     FROM observations
-    WHERE trace_id = '{trace_id}'
+    WHERE {where_clause}
     ORDER BY start_time ASC
     """
 
@@ -267,6 +275,12 @@ async def get_trace_details(
                 }
             )
 
+        # Full texts of inputs/outputs stored as payload blobs
+        blobs = {}
+        if obs_res.result_rows:
+            refs = [ref for row in obs_res.result_rows for ref in (row[17], row[18]) if ref]
+            blobs = resolve_payload_refs(client, obs_res.result_rows[0][16], refs)
+
         observations = []
         for row in obs_res.result_rows:
             # Handle potential None for parent_observation_id string conversion
@@ -281,8 +295,8 @@ async def get_trace_details(
                     "model": row[4],
                     "start_time": row[5],
                     "end_time": row[6],
-                    "input": row[7],
-                    "output": row[8],
+                    "input": blobs.get(row[17], row[7]),
+                    "output": blobs.get(row[18], row[8]),
                     "usage": row[9],
                     "metadata_json": row[11],
                     "error": row[14],
@@ -303,41 +317,37 @@ async def get_dashboard_stats(
     to_ts: Optional[float] = None,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get aggregated dashboard statistics for a project.
-    """
-    client = get_clickhouse_client()
 
-    # Defaults to last 7 days if not provided
-    # For now we query everything for simplicity in demo
+    Reads the hourly rollup tables, so the cost depends on the number of
+    hours shown rather than on the number of spans ingested.
+    """
     where_clause = f"project_id = '{project_id}'"
+    if from_ts:
+        where_clause += f" AND hour >= toStartOfHour(toDateTime({from_ts}))"
+    if to_ts:
+        where_clause += f" AND hour <= toDateTime({to_ts})"
 
-    # 1. Total Traces
-    # 1. Total Traces & Tokens over Time
-    # We want two series: Traces count and Token usage
+    # 1. Traces over Time
     traces_query = f"""
     SELECT 
-        count() as trace_count, 
-        toStartOfHour(start_time) as time,
-        sum(duration_ms) as total_latency
-    FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+        sum(trace_count) as traces, 
+        hour as time,
+        sum(duration_sum) as total_latency
+    FROM {TRACE_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY time
     ORDER BY time ASC
     """
 
     tokens_series_query = f"""
     SELECT 
-        toStartOfHour(start_time) as time,
-        sum(
-            CASE 
-                WHEN isValidJSON(token_usage) THEN 
-                COALESCE(JSONExtractInt(token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_tokens
-    FROM observations
+        hour as time,
+        sum(total_tokens) as tokens
+    FROM {OBSERVATION_ROLLUP_TABLE}
     WHERE {where_clause}
     GROUP BY time
     ORDER BY time ASC
@@ -345,57 +355,49 @@ async def get_dashboard_stats(
 
     # 2. Total Observations (Scores, Generations)
     scores_query = f"""
-    SELECT name, count(), avg(toFloat64OrZero(output_text))
-    FROM observations
+    SELECT score_name, sum(observation_count) as count, sum(score_sum) / count
+    FROM {OBSERVATION_ROLLUP_TABLE}
     WHERE {where_clause} AND type = 'score'
-    GROUP BY name
+    GROUP BY score_name
     """
 
     # 3. Model Usage & Cost
     models_query = f"""
     SELECT 
-        if(model = '' OR model IS NULL, 'Unknown', model) as model_name, 
-        count() as call_count,
-        sum(
-            CASE 
-                WHEN isValidJSON(token_usage) THEN 
-                COALESCE(JSONExtractInt(token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_tokens,
-        sum(total_cost) as total_cost
-    FROM observations
+        if(model_name = '', 'Unknown', model_name) as model, 
+        sum(observation_count) as call_count,
+        sum(total_tokens) as tokens,
+        sum(total_cost) as cost
+    FROM {OBSERVATION_ROLLUP_TABLE}
     WHERE {where_clause}
-    GROUP BY model_name
+    GROUP BY model
     """
 
-    # ... (lat queries) ...
-
-    # 4. Latency Percentiles
+    # 4. Latency Percentiles (p50, p90, p95, p99)
     # Traces
     trace_lat_query = f"""
-    SELECT name, 
-           quantile(0.50)(duration_ms) as p50, 
-           quantile(0.90)(duration_ms) as p90, 
-           quantile(0.95)(duration_ms) as p95, 
-           quantile(0.99)(duration_ms) as p99
-    FROM traces
-    WHERE {where_clause} AND parent_span_id IS NULL
+    SELECT name, quantilesMerge(0.5, 0.9, 0.95, 0.99)(duration_quantiles)
+    FROM {TRACE_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY name
     """
 
-    # Traces (Time Series) - Apps
-    # We want requests over time grouped by application
-    # This might be heavy if many apps. Let's do top 5 apps or just simple aggregation.
-    # For stacked bar, we need time buckets and counts per app.
-    # ClickHouse can do: group by time, application_name
+    # Generations
+    gen_lat_query = f"""
+    SELECT model_name, quantilesMerge(0.5, 0.9, 0.95, 0.99)(duration_quantiles)
+    FROM {OBSERVATION_ROLLUP_TABLE}
+    WHERE {where_clause} AND model_name != ''
+    GROUP BY model_name
+    """
+
+    # Traces (Time Series) - Apps, for the stacked bar
     app_series_query = f"""
     SELECT 
-        toStartOfHour(start_time) as time,
-        if(application_name = '' OR application_name IS NULL, 'Unknown', application_name) as app,
-        count() as count
-    FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+        hour as time,
+        if(application = '', 'Unknown', application) as app,
+        sum(trace_count) as count
+    FROM {TRACE_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY time, app
     ORDER BY time ASC
     """
@@ -403,114 +405,68 @@ async def get_dashboard_stats(
     # 5. Application Metrics (Requests, Latency, Errors)
     apps_query = f"""
     SELECT 
-        if(application_name = '' OR application_name IS NULL, 'Unknown', application_name) as app,
-        count() as request_count,
-        avg(duration_ms) as avg_latency,
-        countIf(status_code = 'ERROR') as error_count,
-        count() as total_count
-    FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+        if(application = '', 'Unknown', application) as app,
+        sum(trace_count) as request_count,
+        sum(duration_sum) / request_count as avg_latency,
+        sumIf(trace_count, status_code = 'ERROR') as error_count,
+        request_count as total_count
+    FROM {TRACE_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY app
     """
 
-    # 6. App Cost & Tokens (Need to join with observations)
-    # Note: ClickHouse JOINs can be tricky. We can try to aggregate obs by trace_id first, then join traces.
-    # Or simplified: if trace has app_name, all its obs belong to that app.
-    # But obs table doesn't have app_name usually (unless denormalized).
-    # Traces table has app_name.
-    # Let's try a strict join or IN clause if performance allows.
-    # Actually, we can just join ON trace_id.
+    # 6. App Cost & Tokens
     app_cost_query = f"""
     SELECT 
-        if(t.application_name = '' OR t.application_name IS NULL, 'Unknown', t.application_name) as app,
-        sum(o.total_cost) as total_cost,
-        sum(
-             CASE 
-                WHEN isValidJSON(o.token_usage) THEN 
-                COALESCE(JSONExtractInt(o.token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_tokens
-    FROM traces t
-    INNER JOIN observations o ON t.trace_id = o.trace_id
-    WHERE {where_clause.replace("project_id", "t.project_id")} 
-      AND (t.parent_span_id IS NULL OR t.parent_span_id = '')
-    GROUP BY app
+        if(application = '', 'Unknown', application) as app_name,
+        sum(total_cost) as total_cost,
+        sum(total_tokens) as total_tokens
+    FROM {OBSERVATION_ROLLUP_TABLE}
+    WHERE {where_clause}
+    GROUP BY app_name
     """
 
     # 7. Global Status Distribution
     status_dist_query = f"""
     SELECT 
         status_code,
-        count()
-    FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+        sum(trace_count)
+    FROM {TRACE_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY status_code
     """
 
     # 8. Token Split (Prompt vs Completion)
     token_split_query = f"""
     SELECT 
-        sum(
-             CASE 
-                WHEN isValidJSON(token_usage) THEN 
-                COALESCE(JSONExtractInt(token_usage, 'prompt_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_prompt,
-        sum(
-             CASE 
-                WHEN isValidJSON(token_usage) THEN 
-                COALESCE(JSONExtractInt(token_usage, 'completion_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_completion
-    FROM observations
+        sum(prompt_tokens) as total_prompt,
+        sum(completion_tokens) as total_completion
+    FROM {OBSERVATION_ROLLUP_TABLE}
     WHERE {where_clause}
     """
 
     # 9. Top Users
     user_vol_query = f"""
     SELECT 
-        if(user_id = '' OR user_id IS NULL, 'Unknown', user_id) as user,
-        count() as count
-    FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '') AND user_id != ''
+        user,
+        sum(trace_count) as count
+    FROM {TRACE_USER_ROLLUP_TABLE}
+    WHERE {where_clause}
     GROUP BY user
     ORDER BY count DESC
     LIMIT 10
     """
 
     # 10. Generation Speed
-    # tokens / duration(s)
+    # tokens / duration(s), averaged over generations that reported tokens
     gen_speed_query = f"""
     SELECT
-        if(model = '' OR model IS NULL, 'Unknown', model) as model_name,
-        avg(
-            CASE 
-                WHEN (isValidJSON(token_usage) OR token_usage LIKE '{{%') THEN
-                     COALESCE(JSONExtractInt(token_usage, 'total_tokens'), 0) / 
-                     (GREATEST(dateDiff('millisecond', start_time, end_time), 1) / 1000)
-                ELSE 0
-            END
-        ) as tokens_per_sec
-    FROM observations
-    WHERE {where_clause} 
-      AND (isValidJSON(token_usage) OR token_usage LIKE '{{%')
-      AND model != '' AND model IS NOT NULL
+        model_name,
+        sum(tokens_per_sec_sum) / sum(tokens_per_sec_count) as tokens_per_sec
+    FROM {OBSERVATION_ROLLUP_TABLE}
+    WHERE {where_clause} AND model_name != ''
     GROUP BY model_name
-    """
-
-    # Generations (observations type='generation')
-    gen_lat_query = f"""
-    SELECT model, 
-           quantile(0.50)(dateDiff('millisecond', start_time, end_time)) as p50, 
-           quantile(0.90)(dateDiff('millisecond', start_time, end_time)) as p90, 
-           quantile(0.95)(dateDiff('millisecond', start_time, end_time)) as p95, 
-           quantile(0.99)(dateDiff('millisecond', start_time, end_time)) as p99
-    FROM observations
-    WHERE {where_clause} AND model IS NOT NULL AND model != ''
-    GROUP BY model
+    HAVING sum(tokens_per_sec_count) > 0
     """
 
     try:
@@ -596,11 +552,7 @@ async def get_dashboard_stats(
             model_name = row[0] or "unknown"
             call_count = row[1]
             total_tokens = row[2]
-            model_cost = row[3] or 0.0  # Use stored cost
-
-            # Fallback if stored cost is 0 but we have tokens
-            if model_cost == 0 and total_tokens > 0:
-                model_cost = total_tokens * 0.000002
+            model_cost = row[3] or 0.0
 
             total_cost += model_cost
             total_tokens_sum += total_tokens
@@ -636,10 +588,6 @@ async def get_dashboard_stats(
             cost = row[1] or 0.0
             tokens = row[2] or 0
 
-            # Fallback estimation
-            if cost == 0 and tokens > 0:
-                cost = tokens * 0.000002
-
             if app in apps_metrics_map:
                 apps_metrics_map[app]["total_cost"] = round(cost, 4)
                 apps_metrics_map[app]["total_tokens"] = tokens
@@ -676,14 +624,14 @@ async def get_dashboard_stats(
         # Process Latencies
         def process_latencies(rows):
             stats = []
-            for row in rows:
+            for name, (p50, p90, p95, p99) in rows:
                 stats.append(
                     {
-                        "name": row[0],
-                        "p50": round(row[1], 2),
-                        "p90": round(row[2], 2),
-                        "p95": round(row[3], 2),
-                        "p99": round(row[4], 2),
+                        "name": name,
+                        "p50": round(p50, 2),
+                        "p90": round(p90, 2),
+                        "p95": round(p95, 2),
+                        "p99": round(p99, 2),
                     }
                 )
             return stats
@@ -860,12 +808,11 @@ async def get_application_stats(
     to_ts: Optional[float] = None,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
+    client: Client = Depends(get_clickhouse),
 ):
     """
     Get detailed statistics for a specific application.
     """
-    client = get_clickhouse_client()
-
     where_clause = f"project_id = '{project_id}' AND application_name = '{app_name}'"
 
     if from_ts:
@@ -882,24 +829,16 @@ async def get_application_stats(
         quantile(0.95)(duration_ms) as p95_latency,
         countIf(status_code = 'ERROR') as error_count
     FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+    WHERE {where_clause} AND is_root = 1
     """
 
-    # 2. Token & Cost (Joined)
+    # 2. Token & Cost (observations carry the application themselves)
     cost_tokens_query = f"""
     SELECT 
-        sum(o.total_cost),
-        sum(
-             CASE 
-                WHEN isValidJSON(o.token_usage) THEN 
-                COALESCE(JSONExtractInt(o.token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        )
-    FROM traces t
-    INNER JOIN observations o ON t.trace_id = o.trace_id
-    WHERE {where_clause.replace("project_id", "t.project_id").replace("application_name", "t.application_name")}
-      AND (t.parent_span_id IS NULL OR t.parent_span_id = '')
+        sum(total_cost),
+        sum(total_tokens)
+    FROM observations
+    WHERE {where_clause}
     """
 
     # 3. Requests & Latency Over Time (Chart 1 & 2)
@@ -909,7 +848,7 @@ async def get_application_stats(
         count() as count,
         avg(duration_ms) as avg_lat
     FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+    WHERE {where_clause} AND is_root = 1
     GROUP BY time
     ORDER BY time ASC
     """
@@ -920,18 +859,17 @@ async def get_application_stats(
         if(status_code = '' OR status_code IS NULL OR status_code = 'UNSET', 'OK', status_code) as status, 
         count()
     FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+    WHERE {where_clause} AND is_root = 1
     GROUP BY status
     """
 
     # 5. Top Models
     models_query = f"""
     SELECT 
-        if(o.model = '' OR o.model IS NULL, 'Unknown', o.model) as model_name,
+        if(model = '' OR model IS NULL, 'Unknown', model) as model_name,
         count() as count
-    FROM traces t
-    INNER JOIN observations o ON t.trace_id = o.trace_id
-    WHERE {where_clause.replace("project_id", "t.project_id").replace("application_name", "t.application_name")}
+    FROM observations
+    WHERE {where_clause}
     GROUP BY model_name
     ORDER BY count DESC
     LIMIT 10
@@ -943,7 +881,7 @@ async def get_application_stats(
         if(user_id = '' OR user_id IS NULL, 'Unknown', user_id) as user,
         count()
     FROM traces
-    WHERE {where_clause} AND (parent_span_id IS NULL OR parent_span_id = '')
+    WHERE {where_clause} AND is_root = 1
     GROUP BY user
     ORDER BY count() DESC
     LIMIT 10
@@ -954,18 +892,10 @@ async def get_application_stats(
     # 7. Token Usage Over Time
     token_series_query = f"""
     SELECT 
-        toStartOfHour(t.start_time) as time,
-        sum(
-             CASE 
-                WHEN isValidJSON(o.token_usage) THEN 
-                COALESCE(JSONExtractInt(o.token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_tokens
-    FROM traces t
-    LEFT JOIN observations o ON t.trace_id = o.trace_id
-    WHERE {where_clause.replace("project_id", "t.project_id").replace("application_name", "t.application_name")}
-      AND (t.parent_span_id IS NULL OR t.parent_span_id = '')
+        toStartOfHour(start_time) as time,
+        sum(total_tokens) as tokens
+    FROM observations
+    WHERE {where_clause}
     GROUP BY time
     ORDER BY time ASC
     """
@@ -973,19 +903,10 @@ async def get_application_stats(
     # 8. Cost Over Time
     cost_series_query = f"""
     SELECT 
-        toStartOfHour(t.start_time) as time,
-        sum(o.total_cost) as total_cost,
-        sum(
-             CASE 
-                WHEN isValidJSON(o.token_usage) THEN 
-                COALESCE(JSONExtractInt(o.token_usage, 'total_tokens'), 0)
-                ELSE 0 
-            END
-        ) as total_tokens
-    FROM traces t
-    LEFT JOIN observations o ON t.trace_id = o.trace_id
-    WHERE {where_clause.replace("project_id", "t.project_id").replace("application_name", "t.application_name")}
-      AND (t.parent_span_id IS NULL OR t.parent_span_id = '')
+        toStartOfHour(start_time) as time,
+        sum(total_cost) as cost
+    FROM observations
+    WHERE {where_clause}
     GROUP BY time
     ORDER BY time ASC
     """
@@ -1014,9 +935,6 @@ async def get_application_stats(
         total_cost = c_row[0] or 0.0
         total_tokens = c_row[1] or 0
 
-        if total_cost == 0 and total_tokens > 0:
-            total_cost = total_tokens * 0.000002
-
         # Helper for date formatting
         def fmt_time(dt):
             return dt.strftime("%b %d, %I:%M %p")
@@ -1036,10 +954,7 @@ async def get_application_stats(
 
         cost_series = []
         for r in cost_series_res.result_rows:
-            # If cost is 0, estimate
             val = r[1] or 0.0
-            if val == 0 and r[2] > 0:
-                val = r[2] * 0.000002
             cost_series.append({"time": fmt_time(r[0]), "cost": round(val, 5)})
 
         # Parse Status
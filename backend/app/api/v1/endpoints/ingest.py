@@ -1,209 +1,494 @@
-from typing import Any, Dict, List
-from fastapi import APIRouter, Header, HTTPException, Depends, Body, BackgroundTasks
-from app.core.evaluation_runner import run_triggered_evaluation
-from app.models.evaluation_rule import EvaluationRule
-from sqlalchemy.future import select
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceResponse
+from app.api.deps import get_ingest_api_key
+from app.api.ingest_body import content_length, is_ndjson, iter_ndjson_records, read_request_body
+from app.core.evaluation_queue import enqueue_evaluation_jobs
+from app.core.evaluation_sampling import evaluation_sampling, is_sampled, trace_sample_bucket
+from app.core.rule_cache import ActiveRule, get_active_rules
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_session
-from app.models.all_models import ApiKey
-from app.core.clickhouse import get_clickhouse_client
-import json
-from datetime import datetime
-from sqlalchemy.orm import selectinload
+from app.core.config import settings
+from app.core.api_key_cache import ResolvedApiKey
+from app.core.otlp import decode_export_trace_request
+from app.core.ingest_buffer import IngestUnavailable, ingest_buffer
+from app.core.clickhouse import observation_batch, trace_batch
+from app.core.columnar import ColumnarBatch
+from app.core.dead_letter import DeadLetters
+from app.core.model_prices import get_price_catalog
+from app.core.ingest_rows import RejectedRow, append_observation, append_span
+from app.core.payload_blobs import PayloadBlobs
+from app.core.ingest_schema import (
+    ObservationPayload,
+    SpanPayload,
+    decode_observation_records,
+    decode_span_records,
+    observation_decoder,
+    raw_value,
+)
+from app.core.rate_limit import ingest_rate_limiter, project_usage, seconds_until_utc_midnight
+from app.core.dedup import IN_PROGRESS, idempotency_cache, observation_seen, span_seen
+import logging
+import math
+import msgspec
+from functools import partial
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+def decode_body(decode, body: bytes):
+    try:
+        return decode(body)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+
+def reject_over_quota(api_key_obj: ResolvedApiKey):
+    if project_usage.quota_exceeded(api_key_obj.project_id):
+        raise HTTPException(
+            status_code=429,
+            detail="Daily ingest quota exceeded for this project",
+            headers={"Retry-After": str(math.ceil(seconds_until_utc_midnight()))},
+        )
+
+
+def reject_rate_limited(retry_after: float):
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Ingest rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def admitted_api_key(
+    request: Request, api_key_obj: ResolvedApiKey = Depends(get_ingest_api_key)
+) -> ResolvedApiKey:
+    """
+    Dependency resolving the ingest API key, then turning the request away
+    if its project is over quota or its Content-Length can't pass the rate
+    limits. Runs before the body is read, so requests that admit would
+    refuse anyway don't get decompressed and decoded first.
+    """
+    reject_over_quota(api_key_obj)
+    if settings.INGEST_RATE_LIMIT_ENABLED:
+        reject_rate_limited(ingest_rate_limiter.precheck(api_key_obj, content_length(request)))
+    return api_key_obj
+
+
+def admit(api_key_obj: ResolvedApiKey, spans: int, nbytes: int):
+    """
+    Admission control for an ingest request: the project's daily quota, then
+    the per-key and per-project token buckets. Raises 429 with Retry-After
+    when the request must be retried later; otherwise counts it as usage.
+    """
+    reject_over_quota(api_key_obj)
+    if settings.INGEST_RATE_LIMIT_ENABLED:
+        reject_rate_limited(ingest_rate_limiter.check(api_key_obj, spans, nbytes))
+    project_usage.record(api_key_obj.project_id, spans, nbytes)
+
+
+async def run_ingest(process: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run an ingest request, answering 503 with Retry-After when the ingest
+    buffer can't take more rows (ClickHouse down and no spool configured).
+    """
+    try:
+        return await process()
+    except IngestUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+
+
+async def run_idempotent(
+    api_key_obj: ResolvedApiKey,
+    endpoint: str,
+    idempotency_key: Optional[str],
+    process: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    Run an ingest request at most once per Idempotency-Key. A repeated key
+    gets the first response back without re-ingesting anything; one that
+    arrives while the first is still running gets a 409. Failed requests
+    are forgotten so they can be retried. Keys are remembered per worker
+    for INGEST_IDEMPOTENCY_TTL_SECONDS.
+    """
+    if not idempotency_key:
+        return await run_ingest(process)
+
+    cache_key = (api_key_obj.project_id, endpoint, idempotency_key)
+    cached = idempotency_cache.get(cache_key)
+    if cached is IN_PROGRESS:
+        raise HTTPException(
+            status_code=409, detail="A request with this Idempotency-Key is still in progress"
+        )
+    if cached is not None:
+        return cached
+
+    idempotency_cache.set(cache_key, IN_PROGRESS)
+    try:
+        result = await run_ingest(process)
+    except BaseException:
+        idempotency_cache.delete(cache_key)
+        raise
+    idempotency_cache.set(cache_key, result)
+    return result
+
+
+def remember_spans(batch: ColumnarBatch, project_id):
+    columns = batch.insert_columns()
+    span_seen.add_many((project_id, trace_id, span_id) for trace_id, span_id in zip(columns[0], columns[1]))
+
+
+def remember_observations(batch: ColumnarBatch, project_id):
+    observation_seen.add_many((project_id, obs_id) for obs_id in batch.insert_columns()[0])
+
+
 @router.post("/traces")
 async def ingest_traces(
-    payload: Any = Body(...),
-    x_api_key: str = Header(...),
-    session: AsyncSession = Depends(get_session)
+    # Resolved first, so bodies of unauthenticated or over-limit requests
+    # aren't decompressed
+    api_key_obj: ResolvedApiKey = Depends(admitted_api_key),
+    body: bytes = Depends(read_request_body),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """
     Ingest traces.
+    Accepts gzip or zstd compressed bodies via Content-Encoding, and an
+    optional Idempotency-Key header to make retries safe.
     """
+    return await run_idempotent(
+        api_key_obj, "traces", idempotency_key, partial(process_traces, body, api_key_obj)
+    )
+
+
+async def process_traces(body: bytes, api_key_obj: ResolvedApiKey):
+    """
+    Spans that can't be stored (wrong types, missing ids or timestamps) are
+    written to the dead letter table and counted as "rejected"; the rest of
+    the batch is ingested.
+    """
+    spans, rejected = decode_body(decode_span_records, body)
     try:
-        # 1. Validate API Key
-        result = await session.execute(
-            select(ApiKey).options(selectinload(ApiKey.application)).where(ApiKey.key == x_api_key)
-        )
-        api_key_obj = result.scalars().first()
-        
-        if not api_key_obj:
-            raise HTTPException(status_code=403, detail="Invalid API Key")
-        
-        if not api_key_obj.is_active:
-            raise HTTPException(status_code=403, detail="API Key is inactive")
-            
-        project_id = api_key_obj.application.project_id
-        application_name = api_key_obj.application.name
-        
-        # 2. Process data
-        spans = payload
-        if isinstance(payload, dict):
-            spans = payload.get("spans", [])
-            
-        if not isinstance(spans, list):
-            spans = [spans]
-
-        client = get_clickhouse_client()
-        data = []
-        
+        project_id = api_key_obj.project_id
+        application_id = api_key_obj.application_id
+        application_name = api_key_obj.application_name
+
+        batch = trace_batch(len(spans))
+        dead_letters = DeadLetters("traces", project_id, application_id, application_name)
+        for payload, reason in rejected:
+            dead_letters.add(payload, reason)
+        duplicates = 0
+        batch_keys = set()
         for span in spans:
-            start_str = span.get("start_time")
-            end_str = span.get("end_time")
-            if not start_str or not end_str:
+            if is_duplicate_span(span, project_id, batch_keys):
+                duplicates += 1
                 continue
+            try:
+                append_span(batch, span, project_id, application_name)
+            except RejectedRow as e:
+                dead_letters.add_record(span, str(e))
 
-            start_t = datetime.fromisoformat(start_str.replace("Z", "+00:00"))
-            end_t = datetime.fromisoformat(end_str.replace("Z", "+00:00"))
-            duration = (end_t - start_t).total_seconds() * 1000
-
-            row = [
-                span.get("trace_id"),
-                span.get("span_id"),
-                span.get("parent_span_id", ""),
-                span.get("name"),
-                span.get("kind", "INTERNAL"),
-                start_t,
-                end_t,
-                span.get("status", {}).get("code", "UNSET"),
-                span.get("status", {}).get("message", ""),
-                span.get("attributes", {}),
-                json.dumps(span.get("events", [])),
-                json.dumps(span.get("links", [])),
-                span.get("resource", {}).get("attributes", {}),
-                duration,
-                project_id,
-                span.get("attributes", {}).get("enduser.id", ""),
-                application_name
-            ]
-            data.append(row)
-            
-        if data:
-            client.insert("traces", data, column_names=[
-                "trace_id", "span_id", "parent_span_id", "name", "kind", 
-                "start_time", "end_time", "status_code", "status_message", 
-                "attributes", "events", "links", "resource_attributes", "duration_ms", "project_id", "user_id", "application_name"
-            ])
-        
-        return {"status": "success", "count": len(data)}
+        admit(api_key_obj, len(batch), len(body))
+        await ingest_buffer.add("traces", batch)
+        await dead_letters.flush()
+        remember_spans(batch, project_id)
+
+        return {
+            "status": "success",
+            "count": len(batch),
+            "duplicates": duplicates,
+            "rejected": len(dead_letters),
+        }
+    except (HTTPException, IngestUnavailable):
+        raise
     except Exception as e:
-        import traceback
-        error_msg = f"Traces Error: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
-        with open("ingest_error.log", "a") as f:
-            f.write(error_msg + "\n")
+        logger.exception(f"Failed to ingest traces for project {api_key_obj.project_id}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+async def trigger_evaluations(session: AsyncSession, rules: Sequence[ActiveRule], observations: List[ObservationPayload], application_name: str):
+    """
+    Queue an evaluation job per matching observation and active rule. The
+    jobs are run by the evaluation worker, not by this API process.
+
+    Each rule only evaluates `percentage` percent of traces; the decision is
+    made on a hash of the trace id, so all observations of a trace are
+    evaluated or skipped together, across requests and workers.
+    """
+    jobs = []
+    sampled = {rule.id: [0, 0] for rule in rules}
+    for obs in observations:
+        # Filter: Only evaluate "interesting" spans?
+        # For now: Any agent/chain execution or if it looks like a generation
+        if obs.type in ["agent", "chain", "llm"]:
+            bucket = trace_sample_bucket(obs.trace_id)
+            trace_data = {
+                "input": obs.input_text,
+                "output": obs.output_text,
+                "context": raw_value(obs.metadata_json), # simplified usage of metadata as context
+                "trace_id": obs.trace_id,
+                "observation_id": obs.id,
+                "observation_name": obs.name,
+                "application_name": application_name
+            }
+
+            # Trigger all active rules that sample this trace
+            for rule in rules:
+                if is_sampled(bucket, rule.percentage):
+                    jobs.append({"rule_id": rule.id, "trace_data": trace_data})
+                    sampled[rule.id][0] += 1
+                else:
+                    sampled[rule.id][1] += 1
+
+    for rule_id, (sampled_in, sampled_out) in sampled.items():
+        evaluation_sampling.record(rule_id, sampled_in, sampled_out)
+    await enqueue_evaluation_jobs(session, jobs)
+
+
+def is_duplicate_span(span: SpanPayload, project_id, batch_keys: set) -> bool:
+    """
+    Whether the span was already ingested by this worker (an SDK retry) or
+    came earlier in this batch; if not, its key is added to batch_keys.
+    """
+    if span.span_id is None:
+        return False
+    key = (project_id, span.trace_id, span.span_id)
+    if key in batch_keys or key in span_seen:
+        return True
+    batch_keys.add(key)
+    return False
+
+
+def is_duplicate_observation(obs: ObservationPayload, project_id, batch_keys: set) -> bool:
+    """
+    Like is_duplicate_span, for observations.
+    """
+    if obs.id is None:
+        return False
+    key = (project_id, obs.id)
+    if key in batch_keys or key in observation_seen:
+        return True
+    batch_keys.add(key)
+    return False
+
+
 @router.post("/observations")
 async def ingest_observations(
-    payload: Any = Body(...),
-    x_api_key: str = Header(...),
+    request: Request,
+    api_key_obj: ResolvedApiKey = Depends(admitted_api_key),
     session: AsyncSession = Depends(get_session),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    idempotency_key: Optional[str] = Header(None),
 ):
     """
     Ingest observations.
+    Accepts gzip or zstd compressed bodies via Content-Encoding, and an
+    optional Idempotency-Key header to make retries safe.
+    With `Content-Type: application/x-ndjson` the body is one observation
+    per line and is processed as a stream.
     """
+    process = ingest_observations_stream if is_ndjson(request) else process_observations
+    return await run_idempotent(
+        api_key_obj,
+        "observations",
+        idempotency_key,
+        partial(process, request, api_key_obj, session),
+    )
+
+
+async def process_observations(
+    request: Request,
+    api_key_obj: ResolvedApiKey,
+    session: AsyncSession,
+):
+    body = await read_request_body(request)
+    observations, rejected = decode_body(decode_observation_records, body)
     try:
-        # 1. Validate API Key
-        result = await session.execute(
-            select(ApiKey).options(selectinload(ApiKey.application)).where(ApiKey.key == x_api_key)
-        )
-        api_key_obj = result.scalars().first()
-        
-        if not api_key_obj:
-            raise HTTPException(status_code=403, detail="Invalid API Key")
-        
-        if not api_key_obj.is_active:
-            raise HTTPException(status_code=403, detail="API Key is inactive")
-            
-        project_id = api_key_obj.application.project_id
-        application_name = api_key_obj.application.name
-        
-        # 2. Process data
-        observations = payload
-        if isinstance(payload, dict):
-            observations = payload.get("observations", [])
-            
-        if not isinstance(observations, list):
-            observations = [observations]
-            
-        client = get_clickhouse_client()
-        data = []
-        
+        project_id = api_key_obj.project_id
+        application_id = api_key_obj.application_id
+        application_name = api_key_obj.application_name
+
+        batch = observation_batch(len(observations))
+        dead_letters = DeadLetters("observations", project_id, application_id, application_name)
+        blobs = PayloadBlobs()
+        prices = await get_price_catalog(session, project_id)
+        for payload, reason in rejected:
+            dead_letters.add(payload, reason)
+        new_observations = []
+        duplicates = 0
+        batch_keys = set()
         for obs in observations:
-            start_t = datetime.fromtimestamp(obs.get("start_time") / 1e9)
-            end_t = datetime.fromtimestamp(obs.get("end_time") / 1e9)
-            
-            row = [
-                obs.get("id"),
-                obs.get("trace_id"),
-                obs.get("parent_observation_id"),
-                obs.get("name"),
-                obs.get("type"),
-                obs.get("model"),
-                start_t,
-                end_t,
-                obs.get("input_text"),
-                obs.get("output_text"),
-                json.dumps(obs.get("token_usage")) if obs.get("token_usage") else None,
-                json.dumps(obs.get("model_parameters")) if obs.get("model_parameters") else None,
-                json.dumps(obs.get("metadata_json")) if not isinstance(obs.get("metadata_json"), str) and obs.get("metadata_json") else obs.get("metadata_json"),
-                obs.get("extra"),
-                obs.get("observation_type"),
-                obs.get("error"),
-                obs.get("total_cost"),
-                start_t, # created_at
-                project_id,
-                obs.get("user_id")
-            ]
-            data.append(row)
-            
-        if data:
-            client.insert("observations", data, column_names=[
-                "id", "trace_id", "parent_observation_id", "name", "type", "model",
-                "start_time", "end_time", "input_text", "output_text", "token_usage",
-                "model_parameters", "metadata_json", "extra", "observation_type", "error",
-                "total_cost", "created_at", "project_id", "user_id"
-            ])
+            if is_duplicate_observation(obs, project_id, batch_keys):
+                duplicates += 1
+                continue
+            try:
+                append_observation(batch, obs, project_id, application_id, application_name, blobs, prices)
+            except RejectedRow as e:
+                dead_letters.add_record(obs, str(e))
+                continue
+            new_observations.append(obs)
+
+        if len(batch):
+            admit(api_key_obj, len(batch), len(body))
+        await blobs.flush()
+        await ingest_buffer.add("observations", batch)
+        await dead_letters.flush()
+        if len(batch):
+            remember_observations(batch, project_id)
 
             # --- Auto-Evaluation Logic ---
             # We trigger eval on "agent" or "chain" type observations that are root-ish (no parent, or explicitly marked)
             # For simplicity, if we see an observation with valid input/output, we check for rules.
             # In a real system, we might wait for the full trace or use specific span kinds.
-            
+
             # Fetch Rules for this Application
-            app_id = api_key_obj.application_id
-            
-            rules_res = await session.execute(select(EvaluationRule).where(EvaluationRule.application_id == str(app_id)).where(EvaluationRule.active == True))
-            rules = rules_res.scalars().all()
-            
+            rules = await get_active_rules(session, api_key_obj.application_id)
+
             if rules:
-                for obs in observations:
-                    # Filter: Only evaluate "interesting" spans? 
-                    # For now: Any agent/chain execution or if it looks like a generation
-                    if obs.get("type") in ["agent", "chain", "llm"]: 
-                        trace_data = {
-                            "input": obs.get("input_text"),
-                            "output": obs.get("output_text"),
-                            "context": obs.get("metadata_json"), # simplified usage of metadata as context
-                            "trace_id": obs.get("trace_id"),
-                            "observation_id": obs.get("id"),
-                            "observation_name": obs.get("name"),
-                            "application_name": application_name
-                        }
-                        
-                        # Trigger all active rules
-                        for rule in rules:
-                            background_tasks.add_task(run_triggered_evaluation, rule.id, trace_data)
-
-        return {"status": "success", "count": len(data)}
+                await trigger_evaluations(session, rules, new_observations, application_name)
+
+        return {
+            "status": "success",
+            "count": len(batch),
+            "duplicates": duplicates,
+            "rejected": len(dead_letters),
+        }
+    except (HTTPException, IngestUnavailable):
+        raise
     except Exception as e:
-        import traceback
-        error_msg = f"Observations Error: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
-        with open("ingest_error.log", "a") as f:
-            f.write(error_msg + "\n")
+        logger.exception(f"Failed to ingest observations for project {api_key_obj.project_id}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def ingest_observations_stream(
+    request: Request,
+    api_key_obj: ResolvedApiKey,
+    session: AsyncSession,
+):
+    """
+    NDJSON variant of ingest_observations. Records are converted as they are
+    read and handed to the ingest buffer every INGEST_NDJSON_CHUNK_ROWS rows,
+    so memory stays bounded however large the upload is. Malformed lines and
+    records that can't be stored go to the dead letter table, flushed on
+    their own once a chunk's worth of them is pending; records read
+    before the upload hits a rate limit are kept.
+    """
+    project_id = api_key_obj.project_id
+    application_id = api_key_obj.application_id
+    application_name = api_key_obj.application_name
+    rules = await get_active_rules(session, application_id)
+    prices = await get_price_catalog(session, project_id)
+
+    count = 0
+    duplicates = 0
+    chunk_bytes = 0
+    batch = observation_batch(settings.INGEST_NDJSON_CHUNK_ROWS)
+    dead_letters = DeadLetters("observations", project_id, application_id, application_name)
+    blobs = PayloadBlobs()
+    chunk = []
+    batch_keys = set()
+
+    async def flush_chunk():
+        nonlocal count, chunk, chunk_bytes
+        try:
+            admit(api_key_obj, len(batch), chunk_bytes)
+        except HTTPException as e:
+            if count:
+                e.detail = f"{e.detail} after {count} records"
+            raise
+        await blobs.flush()
+        await ingest_buffer.add("observations", batch)
+        await dead_letters.flush()
+        remember_observations(batch, project_id)
+        if rules:
+            await trigger_evaluations(session, rules, chunk, application_name)
+        count += len(batch)
+        batch.reset()
+        # The flushed ids are in observation_seen now
+        batch_keys.clear()
+        chunk = []
+        chunk_bytes = 0
+
+    async def reject(payload: bytes, reason: str):
+        dead_letters.add(payload, reason)
+        if dead_letters.is_full():
+            await dead_letters.flush()
+
+    async for obs, size in iter_ndjson_records(request, observation_decoder.decode, reject):
+        chunk_bytes += size
+        if is_duplicate_observation(obs, project_id, batch_keys):
+            duplicates += 1
+            continue
+        try:
+            append_observation(batch, obs, project_id, application_id, application_name, blobs, prices)
+        except RejectedRow as e:
+            dead_letters.add_record(obs, str(e))
+            if dead_letters.is_full():
+                await dead_letters.flush()
+            continue
+        if rules:
+            chunk.append(obs)
+        if len(batch) >= settings.INGEST_NDJSON_CHUNK_ROWS:
+            await flush_chunk()
+
+    if len(batch):
+        await flush_chunk()
+    else:
+        await dead_letters.flush()
+
+    return {
+        "status": "success",
+        "count": count,
+        "duplicates": duplicates,
+        "rejected": len(dead_letters),
+    }
+
+
+OTLP_PROTOBUF_CONTENT_TYPES = ("application/x-protobuf", "application/protobuf")
+
+
+@router.post("/otlp/v1/traces")
+async def ingest_otlp_traces(
+    request: Request,
+    api_key_obj: ResolvedApiKey = Depends(admitted_api_key),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    OTLP/HTTP trace export (binary protobuf encoding, optionally gzip).
+    Point an OpenTelemetry exporter at `<api>/ingest/otlp` with an
+    `x-api-key` header.
+    """
+    return await run_idempotent(
+        api_key_obj, "otlp_traces", idempotency_key, partial(process_otlp_traces, request, api_key_obj)
+    )
+
+
+async def process_otlp_traces(request: Request, api_key_obj: ResolvedApiKey):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in OTLP_PROTOBUF_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=415, detail="Only application/x-protobuf OTLP payloads are supported"
+        )
+
+    body = await read_request_body(request)
+    try:
+        batch = decode_export_trace_request(
+            body, api_key_obj.project_id, api_key_obj.application_name, seen=span_seen
+        )
+    except DecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid OTLP payload: {e}")
+
+    admit(api_key_obj, len(batch), len(body))
+    await ingest_buffer.add("traces", batch)
+    remember_spans(batch, api_key_obj.project_id)
+
+    return Response(
+        content=ExportTraceServiceResponse().SerializeToString(),
+        media_type="application/x-protobuf",
+    )
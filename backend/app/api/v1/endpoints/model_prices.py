@@ -0,0 +1,158 @@
+from typing import List, Optional
+from datetime import datetime, timezone
+import uuid
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+
+from app.core.database import get_session
+from app.models.model_price import ModelPrice
+from app.models.all_models import User, Project
+from app.api import deps
+from app.core.permissions import Permissions
+from app.core.model_prices import invalidate_prices
+from app.api.v1.endpoints.projects import check_permission
+
+router = APIRouter()
+
+
+class CreateModelPriceRequest(BaseModel):
+    model: str
+    prompt_price_per_million: float = 0.0
+    completion_price_per_million: float = 0.0
+    effective_from: Optional[datetime] = None
+    # None for a default price (superuser only)
+    project_id: Optional[uuid.UUID] = None
+
+
+class UpdateModelPriceRequest(BaseModel):
+    model: Optional[str] = None
+    prompt_price_per_million: Optional[float] = None
+    completion_price_per_million: Optional[float] = None
+    effective_from: Optional[datetime] = None
+
+
+async def check_price_access(
+    db: AsyncSession, user: User, project_id: Optional[uuid.UUID], permission: str
+):
+    """
+    Default prices are managed by superusers; a project's prices by its
+    organization's members with `permission`.
+    """
+    if project_id is None:
+        if permission != Permissions.PROJECT_READ and not user.is_superuser:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+        return
+
+    project = await db.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    has_perm = await check_permission(db, user.id, project.organization_id, permission)
+    if not has_perm:
+        raise HTTPException(
+            status_code=403, detail="Not authorized to manage prices of this project"
+        )
+
+
+def naive_utc(dt: datetime) -> datetime:
+    # effective_from is stored as naive UTC, like every other timestamp here
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def validate_prices(prompt_price: Optional[float], completion_price: Optional[float]):
+    if (prompt_price or 0) < 0 or (completion_price or 0) < 0:
+        raise HTTPException(status_code=400, detail="Prices can't be negative")
+
+
+@router.get("/", response_model=List[ModelPrice])
+async def list_model_prices(
+    project_id: Optional[uuid.UUID] = None,
+    db: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user),
+):
+    """
+    Default prices, plus the project's own prices when project_id is given.
+    """
+    await check_price_access(db, current_user, project_id, Permissions.PROJECT_READ)
+
+    condition = ModelPrice.project_id == None
+    if project_id is not None:
+        condition = condition | (ModelPrice.project_id == project_id)
+    result = await db.execute(
+        select(ModelPrice)
+        .where(condition)
+        .order_by(ModelPrice.model, ModelPrice.effective_from)
+    )
+    return result.scalars().all()
+
+
+@router.post("/", response_model=ModelPrice)
+async def create_model_price(
+    price_in: CreateModelPriceRequest,
+    db: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user),
+):
+    """
+    Add a price. To change a model's price from a given date, add a row
+    with that effective_from rather than editing the current one.
+    """
+    await check_price_access(db, current_user, price_in.project_id, Permissions.PROJECT_UPDATE)
+    validate_prices(price_in.prompt_price_per_million, price_in.completion_price_per_million)
+
+    price_data = price_in.dict(exclude_none=True)
+    if "effective_from" in price_data:
+        price_data["effective_from"] = naive_utc(price_data["effective_from"])
+    price = ModelPrice(**price_data)
+    db.add(price)
+    await db.commit()
+    await db.refresh(price)
+    invalidate_prices(price.project_id)
+    return price
+
+
+@router.patch("/{id}", response_model=ModelPrice)
+async def update_model_price(
+    id: uuid.UUID,
+    price_in: UpdateModelPriceRequest,
+    db: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user),
+):
+    price = await db.get(ModelPrice, id)
+    if not price:
+        raise HTTPException(status_code=404, detail="Model price not found")
+    await check_price_access(db, current_user, price.project_id, Permissions.PROJECT_UPDATE)
+    validate_prices(price_in.prompt_price_per_million, price_in.completion_price_per_million)
+
+    # None of the columns are nullable, so a null means "unchanged"
+    update_data = price_in.dict(exclude_unset=True, exclude_none=True)
+    if "effective_from" in update_data:
+        update_data["effective_from"] = naive_utc(update_data["effective_from"])
+    for key, value in update_data.items():
+        setattr(price, key, value)
+
+    db.add(price)
+    await db.commit()
+    await db.refresh(price)
+    invalidate_prices(price.project_id)
+    return price
+
+
+@router.delete("/{id}")
+async def delete_model_price(
+    id: uuid.UUID,
+    db: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user),
+):
+    price = await db.get(ModelPrice, id)
+    if not price:
+        raise HTTPException(status_code=404, detail="Model price not found")
+    await check_price_access(db, current_user, price.project_id, Permissions.PROJECT_UPDATE)
+
+    project_id = price.project_id
+    await db.delete(price)
+    await db.commit()
+    invalidate_prices(project_id)
+    return {"status": "success"}
@@ -1,5 +1,6 @@
 import secrets
 import uuid
+from datetime import date, datetime, timedelta
 from typing import Any, List
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -16,6 +17,16 @@ from app.models.all_models import (
     Role,
 )
 from app.core.permissions import Permissions
+from app.core.config import settings
+from app.models.project_usage import ProjectUsage
+from app.models.project_retention import ProjectRetention
+from app.core.rate_limit import utc_today
+from app.core.api_key_cache import (
+    api_key_cache,
+    invalidate_api_key,
+    invalidate_application,
+    invalidate_project,
+)
 from pydantic import BaseModel
 
 
@@ -62,11 +73,36 @@ class ProjectRead(BaseModel):
     organization_id: uuid.UUID
 
 
+class ProjectUsageRead(BaseModel):
+    day: date
+    span_count: int
+    byte_count: int
+
+
+class ProjectUsageSummary(BaseModel):
+    daily_span_quota: int | None = None
+    usage: List[ProjectUsageRead]
+
+
+class ProjectRetentionUpdate(BaseModel):
+    # None goes back to the default; 0 keeps traces forever
+    retention_days: int | None = None
+
+
+class ProjectRetentionRead(BaseModel):
+    retention_days: int | None = None
+    default_retention_days: int
+
+
 class ApiKeyCreate(BaseModel):
     name: str
     application_id: uuid.UUID
 
 
+class ApiKeyUpdate(BaseModel):
+    is_active: bool
+
+
 class ApiKeyRead(BaseModel):
     id: uuid.UUID
     key: str
@@ -193,6 +229,8 @@ async def delete_organization(
 
     await session.delete(organization)
     await session.commit()
+    # Keys of every application under the org are gone; cheaper to start over
+    api_key_cache.clear()
     return {"status": "deleted"}
 
 
@@ -243,6 +281,107 @@ async def read_projects(
     return projects
 
 
+@router.get("/projects/{project_id}/usage", response_model=ProjectUsageSummary)
+async def read_project_usage(
+    project_id: uuid.UUID,
+    days: int = 30,
+    current_user: User = Depends(deps.get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> Any:
+    """
+    Daily ingested volume for a project over the last `days` days.
+    Counts lag live traffic by up to PROJECT_USAGE_SYNC_INTERVAL_SECONDS.
+    """
+    project = await session.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    has_perm = await check_permission(
+        session, current_user.id, project.organization_id, Permissions.PROJECT_READ
+    )
+    if not has_perm:
+        raise HTTPException(status_code=403, detail="Not authorized to view this project")
+
+    since = utc_today() - timedelta(days=days)
+    result = await session.execute(
+        select(ProjectUsage)
+        .where(ProjectUsage.project_id == project_id, ProjectUsage.day >= since)
+        .order_by(ProjectUsage.day)
+    )
+    return ProjectUsageSummary(
+        daily_span_quota=settings.INGEST_PROJECT_DAILY_SPAN_QUOTA or None,
+        usage=result.scalars().all(),
+    )
+
+
+@router.get("/projects/{project_id}/retention", response_model=ProjectRetentionRead)
+async def read_project_retention(
+    project_id: uuid.UUID,
+    current_user: User = Depends(deps.get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> Any:
+    """
+    Days of traces the project keeps; retention_days is null when it uses
+    the default.
+    """
+    project = await session.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    has_perm = await check_permission(
+        session, current_user.id, project.organization_id, Permissions.PROJECT_READ
+    )
+    if not has_perm:
+        raise HTTPException(status_code=403, detail="Not authorized to view this project")
+
+    retention = await session.get(ProjectRetention, project_id)
+    return ProjectRetentionRead(
+        retention_days=retention.retention_days if retention else None,
+        default_retention_days=settings.DATA_RETENTION_DAYS,
+    )
+
+
+@router.put("/projects/{project_id}/retention", response_model=ProjectRetentionRead)
+async def update_project_retention(
+    project_id: uuid.UUID,
+    retention_in: ProjectRetentionUpdate,
+    current_user: User = Depends(deps.get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> Any:
+    """
+    Set how long the project keeps traces. Older data is removed by the
+    retention job within DATA_RETENTION_INTERVAL_SECONDS.
+    Requires 'project:update' permission.
+    """
+    project = await session.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    has_perm = await check_permission(
+        session, current_user.id, project.organization_id, Permissions.PROJECT_UPDATE
+    )
+    if not has_perm:
+        raise HTTPException(status_code=403, detail="Not authorized to update this project")
+    if retention_in.retention_days is not None and retention_in.retention_days < 0:
+        raise HTTPException(status_code=400, detail="Retention can't be negative")
+
+    retention = await session.get(ProjectRetention, project_id)
+    if retention_in.retention_days is None:
+        if retention:
+            await session.delete(retention)
+    elif retention:
+        retention.retention_days = retention_in.retention_days
+        retention.updated_at = datetime.utcnow()
+        session.add(retention)
+    else:
+        session.add(ProjectRetention(project_id=project_id, retention_days=retention_in.retention_days))
+    await session.commit()
+    return ProjectRetentionRead(
+        retention_days=retention_in.retention_days,
+        default_retention_days=settings.DATA_RETENTION_DAYS,
+    )
+
+
 @router.delete("/projects/{project_id}")
 async def delete_project(
     project_id: uuid.UUID,
@@ -267,6 +406,7 @@ async def delete_project(
 
     await session.delete(project)
     await session.commit()
+    invalidate_project(project_id)
     return {"status": "deleted"}
 
 
@@ -441,6 +581,8 @@ async def update_application(
     session.add(application)
     await session.commit()
     await session.refresh(application)
+    # Cached keys carry the application name that ingest stamps on traces
+    invalidate_application(application_id)
 
     # Reload keys for response
     # In a real scenario we might want another DB call or just pass empty if not needed
@@ -510,6 +652,7 @@ async def delete_application(
 
     await session.delete(application)
     await session.commit()
+    invalidate_application(application_id)
     return {"status": "deleted"}
 
 
@@ -545,6 +688,43 @@ async def create_api_key(
     session.add(api_key_obj)
     await session.commit()
     await session.refresh(api_key_obj)
+    # Drop a negative entry in case the SDK tried the key before it existed
+    invalidate_api_key(api_key_obj.key)
+    return api_key_obj
+
+
+@router.patch("/api-keys/{api_key_id}", response_model=ApiKeyRead)
+async def update_api_key(
+    api_key_id: uuid.UUID,
+    key_in: ApiKeyUpdate,
+    current_user: User = Depends(deps.get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> Any:
+    """
+    Activate or deactivate an API key.
+    """
+    api_key_obj = await session.get(ApiKey, api_key_id)
+    if not api_key_obj:
+        raise HTTPException(status_code=404, detail="API key not found")
+
+    application = await session.get(Application, api_key_obj.application_id)
+    project_res = await session.get(Project, application.project_id)
+    has_perm = await check_permission(
+        session,
+        current_user.id,
+        project_res.organization_id,
+        Permissions.APP_UPDATE,
+    )
+    if not has_perm:
+        raise HTTPException(
+            status_code=403, detail="Not authorized to update this API key"
+        )
+
+    api_key_obj.is_active = key_in.is_active
+    session.add(api_key_obj)
+    await session.commit()
+    await session.refresh(api_key_obj)
+    invalidate_api_key(api_key_obj.key)
     return api_key_obj
 
 
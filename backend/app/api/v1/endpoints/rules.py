@@ -8,6 +8,7 @@ from app.models.evaluation_rule import EvaluationRule
 from app.models.all_models import User, Application, Project
 from app.api import deps
 from app.core.permissions import Permissions
+from app.core.rule_cache import invalidate_rules
 from app.api.v1.endpoints.projects import check_permission
 
 router = APIRouter()
@@ -54,6 +55,7 @@ async def create_rule(
     db.add(rule)
     await db.commit()
     await db.refresh(rule)
+    invalidate_rules(rule.application_id)
     return rule
 
 
@@ -63,8 +65,10 @@ async def delete_rule(id: int, db: AsyncSession = Depends(get_session)):
     if not rule:
         raise HTTPException(status_code=404, detail="Rule not found")
 
+    application_id = rule.application_id
     await db.delete(rule)
     await db.commit()
+    invalidate_rules(application_id)
     return {"status": "success"}
 
 
@@ -77,4 +81,5 @@ async def toggle_rule(id: int, active: bool, db: AsyncSession = Depends(get_sess
     rule.active = active
     await db.commit()
     await db.refresh(rule)
+    invalidate_rules(rule.application_id)
     return rule
@@ -0,0 +1,81 @@
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.all_models import ApiKey
+
+
+@dataclass(frozen=True)
+class ResolvedApiKey:
+    """
+    What the ingest path needs to know about an API key, detached from the
+    SQLAlchemy session so it can be cached across requests.
+    """
+
+    api_key_id: uuid.UUID
+    application_id: uuid.UUID
+    application_name: str
+    project_id: uuid.UUID
+    is_active: bool
+
+
+# Unknown keys are cached as None so a client hammering us with a bad key
+# doesn't turn into one Postgres query per request
+_INVALID = None
+_NOT_CACHED = object()
+
+api_key_cache = TTLCache(
+    max_size=settings.API_KEY_CACHE_MAX_SIZE,
+    ttl_seconds=settings.API_KEY_CACHE_TTL_SECONDS,
+)
+
+
+async def resolve_api_key(session: AsyncSession, key: str) -> Optional[ResolvedApiKey]:
+    """
+    Map an x-api-key header value to its application and project.
+    Returns None for unknown keys.
+    """
+    cached = api_key_cache.get(key, default=_NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        return cached
+
+    result = await session.execute(
+        select(ApiKey).options(selectinload(ApiKey.application)).where(ApiKey.key == key)
+    )
+    api_key_obj = result.scalars().first()
+
+    if not api_key_obj:
+        api_key_cache.set(key, _INVALID, ttl_seconds=settings.API_KEY_CACHE_NEGATIVE_TTL_SECONDS)
+        return None
+
+    resolved = ResolvedApiKey(
+        api_key_id=api_key_obj.id,
+        application_id=api_key_obj.application_id,
+        application_name=api_key_obj.application.name,
+        project_id=api_key_obj.application.project_id,
+        is_active=api_key_obj.is_active,
+    )
+    api_key_cache.set(key, resolved)
+    return resolved
+
+
+def invalidate_api_key(key: str):
+    api_key_cache.delete(key)
+
+
+def invalidate_application(application_id: uuid.UUID):
+    api_key_cache.delete_where(
+        lambda _, v: v is not None and v.application_id == application_id
+    )
+
+
+def invalidate_project(project_id: uuid.UUID):
+    api_key_cache.delete_where(
+        lambda _, v: v is not None and v.project_id == project_id
+    )
@@ -1,66 +1,714 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
 import clickhouse_connect
+from clickhouse_connect.driver import httputil
+from clickhouse_connect.driver.client import Client
 from app.core.config import settings
+from app.core.columnar import ColumnarBatch
+
+logger = logging.getLogger(__name__)
+
+# Column order of the rows built by the ingest path
+TRACE_COLUMNS = [
+    "trace_id", "span_id", "parent_span_id", "name", "kind",
+    "start_time", "end_time", "status_code", "status_message",
+    "attributes", "events", "links", "resource_attributes", "duration_ms", "project_id", "user_id", "application_name"
+]
+
+OBSERVATION_COLUMNS = [
+    "id", "trace_id", "parent_observation_id", "name", "type", "model",
+    "start_time", "end_time", "input_text", "output_text", "token_usage",
+    "model_parameters", "metadata_json", "extra", "observation_type", "error",
+    "total_cost", "created_at", "project_id", "user_id", "input_ref", "output_ref",
+    "prompt_tokens", "completion_tokens", "total_tokens", "application_id", "application_name"
+]
 
-def get_clickhouse_client():
-    client = clickhouse_connect.get_client(
-        host=settings.CLICKHOUSE_HOST,
-        port=settings.CLICKHOUSE_PORT,
-        username=settings.CLICKHOUSE_USER,
-        password=settings.CLICKHOUSE_PASSWORD
+# Skipping index for trace detail reads, which filter on trace_id while both
+# tables are sorted by time. Materialized for existing parts by
+# migrate_trace_id_index.py.
+TRACE_ID_INDEX = "idx_trace_id"
+TRACE_ID_INDEX_DEFINITION = "trace_id TYPE bloom_filter(0.01) GRANULARITY 1"
+
+# Whether a span starts its trace. The ingest path writes a NULL
+# parent_span_id for roots; rows from before that may hold ''.
+IS_ROOT_COLUMN = "UInt8 MATERIALIZED (parent_span_id IS NULL OR parent_span_id = '')"
+
+# token_usage parsed at ingest. The DEFAULT computes the same value from the
+# JSON for rows written before these columns existed (on read, or on disk
+# after MATERIALIZE COLUMN, see migrate_token_columns.py).
+TOKEN_COLUMNS = {
+    column: (
+        f"UInt32 DEFAULT toUInt32(least(greatest("
+        f"JSONExtractInt(ifNull(token_usage, ''), '{column}'), 0), 4294967295))"
     )
-    return client
+    for column in ("prompt_tokens", "completion_tokens", "total_tokens")
+}
 
-def init_clickhouse():
-    print("[Backend] Initializing ClickHouse tables...")
-    client = get_clickhouse_client()
-    # Ensure tables exist with project_id
-    # We might want to do this more robustly with migration scripts, but for now:
-    client.command("""
-    CREATE TABLE IF NOT EXISTS traces (
+# Records the ingest path couldn't store, kept with the reason for replay
+DEAD_LETTER_TABLE = "ingest_dead_letter"
+DEAD_LETTER_COLUMNS = [
+    "received_at", "project_id", "application_id", "application_name", "target_table", "reason", "payload"
+]
+
+# Large input/output texts, stored once per project and content hash
+PAYLOAD_BLOB_TABLE = "payload_blobs"
+PAYLOAD_BLOB_COLUMNS = ["project_id", "hash", "content", "size"]
+
+# One row per (project, day, trace), merged in the background: the root
+# span's fields come from traces, the input/output previews and totals from
+# observations. Both views are plain GROUP BY selects so the backfill can
+# run the same query over existing rows ({where} narrows it down).
+TRACE_SUMMARY_TABLE = "trace_summary"
+
+TRACE_SUMMARY_FROM_TRACES = """
+    SELECT
+        project_id,
+        toDate(start_time) AS day,
+        trace_id,
+        CAST(anyLast(name) AS Nullable(String)) AS root_name,
+        CAST(min(start_time) AS Nullable(DateTime64(9))) AS root_start_time,
+        CAST(max(end_time) AS Nullable(DateTime64(9))) AS root_end_time,
+        CAST(max(duration_ms) AS Nullable(Float64)) AS root_duration_ms,
+        CAST(anyLast(status_code) AS Nullable(String)) AS root_status_code,
+        anyLast(user_id) AS root_user_id,
+        anyLast(application_name) AS root_application_name,
+        argMaxState(attributes, toUInt8(1)) AS root_attributes
+    FROM traces
+    WHERE is_root = 1 {where}
+    GROUP BY project_id, day, trace_id
+"""
+
+TRACE_SUMMARY_FROM_OBSERVATIONS = """
+    SELECT
+        project_id,
+        toDate(start_time) AS day,
+        trace_id,
+        argMinState(input_text, start_time) AS first_input,
+        argMaxState(output_text, start_time) AS last_output,
+        sum(observations.total_tokens) AS total_tokens,
+        sum(ifNull(total_cost, 0)) AS total_cost,
+        count() AS observation_count
+    FROM observations
+    WHERE 1 {where}
+    GROUP BY project_id, day, trace_id
+"""
+
+# Hourly rollups behind the dashboard, one row per project, hour and group
+# key, merged in the background. Like the trace summary they are filled by
+# plain GROUP BY selects, reused by backfill_hourly_rollups.py.
+TRACE_ROLLUP_TABLE = "trace_rollup_hourly"
+TRACE_USER_ROLLUP_TABLE = "trace_user_rollup_hourly"
+OBSERVATION_ROLLUP_TABLE = "observation_rollup_hourly"
+
+# Root spans only, the same ones the dashboard counted as traces
+TRACE_ROLLUP_FROM_TRACES = """
+    SELECT
+        project_id,
+        toStartOfHour(start_time) AS hour,
+        ifNull(application_name, '') AS application,
+        status_code,
+        name,
+        count() AS trace_count,
+        sum(duration_ms) AS duration_sum,
+        quantilesState(0.5, 0.9, 0.95, 0.99)(duration_ms) AS duration_quantiles
+    FROM traces
+    WHERE is_root = 1 {where}
+    GROUP BY project_id, hour, application, status_code, name
+"""
+
+# Kept apart from the rollup above so per-user rows don't multiply its
+# quantile states
+TRACE_USER_ROLLUP_FROM_TRACES = """
+    SELECT
+        project_id,
+        toStartOfHour(start_time) AS hour,
+        assumeNotNull(user_id) AS user,
+        count() AS trace_count
+    FROM traces
+    WHERE is_root = 1 AND user_id != '' {where}
+    GROUP BY project_id, hour, user
+"""
+
+# Score names are only kept for scores, other observation names would
+# blow up the number of rows
+OBSERVATION_ROLLUP_FROM_OBSERVATIONS = """
+    SELECT
+        project_id,
+        toStartOfHour(start_time) AS hour,
+        type,
+        ifNull(model, '') AS model_name,
+        if(type = 'score', ifNull(name, ''), '') AS score_name,
+        ifNull(application_name, '') AS application,
+        count() AS observation_count,
+        sum(observations.prompt_tokens) AS prompt_tokens,
+        sum(observations.completion_tokens) AS completion_tokens,
+        sum(observations.total_tokens) AS total_tokens,
+        sum(ifNull(observations.total_cost, 0)) AS total_cost,
+        quantilesState(0.5, 0.9, 0.95, 0.99)(dateDiff('millisecond', start_time, end_time)) AS duration_quantiles,
+        sumIf(toFloat64OrZero(ifNull(output_text, '')), type = 'score') AS score_sum,
+        sumIf(
+            observations.total_tokens / (greatest(dateDiff('millisecond', start_time, end_time), 1) / 1000),
+            observations.total_tokens > 0
+        ) AS tokens_per_sec_sum,
+        countIf(observations.total_tokens > 0) AS tokens_per_sec_count
+    FROM observations
+    WHERE 1 {where}
+    GROUP BY project_id, hour, type, model_name, score_name, application
+"""
+
+OBSERVATION_ROLLUP_ORDER_BY = "(project_id, hour, type, model_name, score_name, application)"
+
+# Rollup table -> the selects its views run on insert
+HOURLY_ROLLUPS = {
+    TRACE_ROLLUP_TABLE: {"traces": TRACE_ROLLUP_FROM_TRACES},
+    TRACE_USER_ROLLUP_TABLE: {"traces": TRACE_USER_ROLLUP_FROM_TRACES},
+    OBSERVATION_ROLLUP_TABLE: {"observations": OBSERVATION_ROLLUP_FROM_OBSERVATIONS},
+}
+
+# Per-project data that expires: the time column each table is partitioned
+# by month on, and the condition matching its rows from before a
+# {cutoff:UInt32} unix time. Rollup rows only match once their whole hour or
+# day is past it. Payload blobs go by when they were written; a text sent
+# again after the ingest dedup window is written again, so blobs still
+# referenced by recent observations have a recent row. Enforced by
+# app/core/retention.py.
+RETENTION_TABLES = {
+    "traces": ("start_time", "start_time < toDateTime({cutoff:UInt32})"),
+    "observations": ("start_time", "start_time < toDateTime({cutoff:UInt32})"),
+    TRACE_SUMMARY_TABLE: ("day", "day < toDate(toDateTime({cutoff:UInt32}))"),
+    TRACE_ROLLUP_TABLE: ("hour", "hour < toStartOfHour(toDateTime({cutoff:UInt32}))"),
+    TRACE_USER_ROLLUP_TABLE: ("hour", "hour < toStartOfHour(toDateTime({cutoff:UInt32}))"),
+    OBSERVATION_ROLLUP_TABLE: ("hour", "hour < toStartOfHour(toDateTime({cutoff:UInt32}))"),
+    PAYLOAD_BLOB_TABLE: ("created_at", "created_at < toDateTime({cutoff:UInt32})"),
+}
+
+
+def partition_by(table: str) -> str:
+    return f"PARTITION BY toYYYYMM({RETENTION_TABLES[table][0]})"
+
+
+def table_ttl(table: str) -> str:
+    """
+    TTL clause for a table in RETENTION_TABLES when CLICKHOUSE_TTL_DAYS is
+    set. Parts are only dropped once all their rows expired, never rewritten.
+    """
+    if not settings.CLICKHOUSE_TTL_DAYS:
+        return ""
+    column = RETENTION_TABLES[table][0]
+    return (
+        f"TTL toDateTime({column}) + INTERVAL {settings.CLICKHOUSE_TTL_DAYS} DAY "
+        "SETTINGS ttl_only_drop_parts = 1"
+    )
+
+
+def enable_insert_deduplication(client, table: str):
+    """
+    Make ClickHouse remember the insert_deduplication_token of the last
+    CLICKHOUSE_DEDUPLICATION_WINDOW blocks of a (non replicated) table, see
+    insert_columns in app/core/ingest_buffer.py. Also needed on the views'
+    target tables, which skip the block of a skipped insert by its token.
+    """
+    client.command(
+        f"ALTER TABLE {table} MODIFY SETTING "
+        f"non_replicated_deduplication_window = {settings.CLICKHOUSE_DEDUPLICATION_WINDOW}"
+    )
+
+
+# Columns the ingest path builds as typed arrays: DateTime64(9) columns as
+# nanosecond ticks ("q") and Float64 columns as doubles ("d")
+TRACE_COLUMN_TYPES = {"start_time": "q", "end_time": "q", "duration_ms": "d"}
+OBSERVATION_COLUMN_TYPES = {
+    "start_time": "q", "end_time": "q", "created_at": "q",
+    "prompt_tokens": "I", "completion_tokens": "I", "total_tokens": "I",
+}
+DEAD_LETTER_COLUMN_TYPES = {"received_at": "q"}
+
+
+class TraceBatch(ColumnarBatch):
+    """
+    Batch for the traces table. append takes the TRACE_COLUMNS values and
+    writes each into its column directly, about half the cost of the
+    generic loop on the span ingest path.
+    """
+
+    def append(
+        self, trace_id, span_id, parent_span_id, name, kind, start_time, end_time, status_code,
+        status_message, attributes, events, links, resource_attributes, duration_ms, project_id,
+        user_id, application_name,
+    ):
+        n = self._next_row()
+        (
+            trace_id_col, span_id_col, parent_span_id_col, name_col, kind_col, start_time_col,
+            end_time_col, status_code_col, status_message_col, attributes_col, events_col, links_col,
+            resource_attributes_col, duration_ms_col, project_id_col, user_id_col, application_name_col,
+        ) = self.columns
+        trace_id_col[n] = trace_id
+        span_id_col[n] = span_id
+        parent_span_id_col[n] = parent_span_id
+        name_col[n] = name
+        kind_col[n] = kind
+        start_time_col[n] = start_time
+        end_time_col[n] = end_time
+        status_code_col[n] = status_code
+        status_message_col[n] = status_message
+        attributes_col[n] = attributes
+        events_col[n] = events
+        links_col[n] = links
+        resource_attributes_col[n] = resource_attributes
+        duration_ms_col[n] = duration_ms
+        project_id_col[n] = project_id
+        user_id_col[n] = user_id
+        application_name_col[n] = application_name
+        self.num_rows = n + 1
+
+
+class ObservationBatch(ColumnarBatch):
+    """
+    Batch for the observations table, with append written out for the
+    OBSERVATION_COLUMNS like TraceBatch.
+    """
+
+    def append(
+        self, id, trace_id, parent_observation_id, name, type, model, start_time, end_time,
+        input_text, output_text, token_usage, model_parameters, metadata_json, extra,
+        observation_type, error, total_cost, created_at, project_id, user_id, input_ref, output_ref,
+        prompt_tokens, completion_tokens, total_tokens, application_id, application_name,
+    ):
+        n = self._next_row()
+        (
+            id_col, trace_id_col, parent_observation_id_col, name_col, type_col, model_col,
+            start_time_col, end_time_col, input_text_col, output_text_col, token_usage_col,
+            model_parameters_col, metadata_json_col, extra_col, observation_type_col, error_col,
+            total_cost_col, created_at_col, project_id_col, user_id_col, input_ref_col, output_ref_col,
+            prompt_tokens_col, completion_tokens_col, total_tokens_col, application_id_col,
+            application_name_col,
+        ) = self.columns
+        id_col[n] = id
+        trace_id_col[n] = trace_id
+        parent_observation_id_col[n] = parent_observation_id
+        name_col[n] = name
+        type_col[n] = type
+        model_col[n] = model
+        start_time_col[n] = start_time
+        end_time_col[n] = end_time
+        input_text_col[n] = input_text
+        output_text_col[n] = output_text
+        token_usage_col[n] = token_usage
+        model_parameters_col[n] = model_parameters
+        metadata_json_col[n] = metadata_json
+        extra_col[n] = extra
+        observation_type_col[n] = observation_type
+        error_col[n] = error
+        total_cost_col[n] = total_cost
+        created_at_col[n] = created_at
+        project_id_col[n] = project_id
+        user_id_col[n] = user_id
+        input_ref_col[n] = input_ref
+        output_ref_col[n] = output_ref
+        prompt_tokens_col[n] = prompt_tokens
+        completion_tokens_col[n] = completion_tokens
+        total_tokens_col[n] = total_tokens
+        application_id_col[n] = application_id
+        application_name_col[n] = application_name
+        self.num_rows = n + 1
+
+
+def trace_batch(capacity: int = 0) -> TraceBatch:
+    return TraceBatch(TRACE_COLUMNS, TRACE_COLUMN_TYPES, capacity)
+
+
+def observation_batch(capacity: int = 0) -> ObservationBatch:
+    return ObservationBatch(OBSERVATION_COLUMNS, OBSERVATION_COLUMN_TYPES, capacity)
+
+
+def dead_letter_batch(capacity: int = 0) -> ColumnarBatch:
+    return ColumnarBatch(DEAD_LETTER_COLUMNS, DEAD_LETTER_COLUMN_TYPES, capacity)
+
+
+def payload_blob_batch(capacity: int = 0) -> ColumnarBatch:
+    return ColumnarBatch(PAYLOAD_BLOB_COLUMNS, {}, capacity)
+
+
+class ClickHouseClientManager:
+    """
+    Process-wide ClickHouse client backed by a shared urllib3 connection pool.
+
+    clickhouse_connect clients are safe to share between threads as long as
+    they don't use a server-side session, so a single client is handed out to
+    every request and to the ingest flusher instead of opening a new HTTP
+    session per call.
+    """
+
+    def __init__(self):
+        self._client: Optional[Client] = None
+        self._lock = threading.Lock()
+        self._last_health_check = 0.0
+
+    def _create_client(self) -> Client:
+        pool_mgr = httputil.get_pool_manager(
+            maxsize=settings.CLICKHOUSE_POOL_SIZE,
+            num_pools=1,
+            keep_idle=settings.CLICKHOUSE_KEEPALIVE_SECONDS,
+            keep_interval=settings.CLICKHOUSE_KEEPALIVE_SECONDS,
+        )
+        return clickhouse_connect.get_client(
+            host=settings.CLICKHOUSE_HOST,
+            port=settings.CLICKHOUSE_PORT,
+            username=settings.CLICKHOUSE_USER,
+            password=settings.CLICKHOUSE_PASSWORD,
+            pool_mgr=pool_mgr,
+            # Sessions serialize queries per client, which would defeat sharing it
+            autogenerate_session_id=False,
+        )
+
+    def get_client(self) -> Client:
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+                    self._last_health_check = time.monotonic()
+                client = self._client
+        elif time.monotonic() - self._last_health_check > settings.CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS:
+            if not self.check_health():
+                client = self.get_client()
+        return client
+
+    def check_health(self) -> bool:
+        """
+        Ping the server. On failure the client is discarded so the next caller
+        gets a fresh one with new connections.
+        """
+        self._last_health_check = time.monotonic()
+        try:
+            client = self._client or self.get_client()
+            if client.ping():
+                return True
+        except Exception as e:
+            logger.warning(f"ClickHouse health check failed: {e}")
+        self.reset()
+        return False
+
+    def reset(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def query(self, query: str, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        """
+        Run a query with per-call ClickHouse settings (e.g. max_execution_time)
+        layered over the client defaults.
+        """
+        return self.get_client().query(query, settings=settings, **kwargs)
+
+    def command(self, cmd: str, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        return self.get_client().command(cmd, settings=settings, **kwargs)
+
+    def insert(self, table: str, data, settings: Optional[Dict[str, Any]] = None, **kwargs):
+        return self.get_client().insert(table, data, settings=settings, **kwargs)
+
+
+clickhouse_manager = ClickHouseClientManager()
+
+
+def get_clickhouse_client() -> Client:
+    return clickhouse_manager.get_client()
+
+
+def get_clickhouse() -> Client:
+    """
+    FastAPI dependency returning the shared ClickHouse client.
+    """
+    return clickhouse_manager.get_client()
+
+# Storage layout of traces and observations, recorded as the table comment.
+# Tables created with an older layout keep it until converted by
+# migrate_storage_schema.py.
+STORAGE_SCHEMA_VERSION = 4
+STORAGE_SCHEMA_COMMENT = f"storage schema v{STORAGE_SCHEMA_VERSION}"
+
+
+def table_engine(table: str) -> Tuple[str, str]:
+    """
+    (ENGINE, ORDER BY) of traces or observations.
+    """
+    # Root spans come first in a project's traces, so queries on traces
+    # only read those
+    if not settings.CLICKHOUSE_REPLACING_MERGE_TREE:
+        if table == "traces":
+            return "MergeTree()", "(project_id, is_root, start_time)"
+        return "MergeTree()", "(project_id, start_time)"
+    # Rows with the same sort key are collapsed on merge, keeping the
+    # highest ingest_version, so a span re-sent by an SDK retry is stored once.
+    # Only eventually: until the merge, queries without FINAL count it twice,
+    # and the trace_summary and rollup views have already aggregated both
+    # copies at insert time, for good. The ingest path keeps them exact by
+    # not writing a span twice: the seen-set and Idempotency-Key
+    # (app/core/dedup.py) drop SDK retries on a worker, and batches carry an
+    # insert_deduplication_token (enable_insert_deduplication), so one that
+    # is inserted again by the buffer or the spool is skipped along with its
+    # views. A retry that reaches another worker or comes after a restart is
+    # still counted twice.
+    if table == "traces":
+        return "ReplacingMergeTree(ingest_version)", "(project_id, is_root, start_time, trace_id, span_id)"
+    return "ReplacingMergeTree(ingest_version)", "(project_id, start_time, id)"
+
+
+# Columns with few distinct values are LowCardinality. Names, models, users
+# and applications are not Nullable: the ingest path writes '' for a missing
+# value (ingest_rows.py), which the API and the dashboard already show the
+# same as NULL, and LowCardinality works best without a null map. Sorted
+# timestamps compress best as DoubleDelta, the others as Delta, and JSON
+# and text bodies with a stronger ZSTD level.
+def traces_table_ddl(name: str = "traces") -> str:
+    engine, order_by = table_engine("traces")
+    return f"""
+    CREATE TABLE IF NOT EXISTS {name} (
         trace_id String,
         span_id String,
         parent_span_id Nullable(String),
-        name String,
-        kind String,
-        start_time DateTime64(9),
-        end_time DateTime64(9),
-        status_code String,
-        status_message Nullable(String),
-        attributes Map(String, String),
-        events String,
-        links String,
-        resource_attributes Map(String, String),
+        is_root {IS_ROOT_COLUMN},
+        name LowCardinality(String),
+        kind LowCardinality(String),
+        start_time DateTime64(9) CODEC(DoubleDelta, ZSTD(1)),
+        end_time DateTime64(9) CODEC(Delta, ZSTD(1)),
+        status_code LowCardinality(String),
+        status_message String CODEC(ZSTD(3)),
+        attributes Map(String, String) CODEC(ZSTD(3)),
+        events String CODEC(ZSTD(3)),
+        links String CODEC(ZSTD(3)),
+        resource_attributes Map(String, String) CODEC(ZSTD(3)),
         duration_ms Float64,
         project_id UUID,
-        user_id Nullable(String),
-        application_name Nullable(String)
-    ) ENGINE = MergeTree()
-    ORDER BY (project_id, start_time)
-    """)
+        user_id String,
+        application_name LowCardinality(String),
+        ingest_version UInt64 DEFAULT toUnixTimestamp64Nano(now64(9)) CODEC(Delta, ZSTD(1)),
+        INDEX {TRACE_ID_INDEX} {TRACE_ID_INDEX_DEFINITION}
+    ) ENGINE = {engine}
+    {partition_by("traces")}
+    ORDER BY {order_by}
+    {table_ttl("traces")}
+    COMMENT '{STORAGE_SCHEMA_COMMENT}'
+    """
+
 
-    client.command("""
-    CREATE TABLE IF NOT EXISTS observations (
+def observations_table_ddl(name: str = "observations") -> str:
+    engine, order_by = table_engine("observations")
+    return f"""
+    CREATE TABLE IF NOT EXISTS {name} (
         id UInt64,
         trace_id String,
         parent_observation_id Nullable(UInt64),
-        name Nullable(String),
-        type String,
-        model Nullable(String),
-        start_time DateTime64(9),
-        end_time DateTime64(9),
-        input_text Nullable(String),
-        output_text Nullable(String),
-        token_usage Nullable(String),
-        model_parameters Nullable(String),
-        metadata_json Nullable(String),
-        extra Nullable(String),
-        observation_type Nullable(String),
-        error Nullable(String),
+        name LowCardinality(String),
+        type LowCardinality(String),
+        model LowCardinality(String),
+        start_time DateTime64(9) CODEC(DoubleDelta, ZSTD(1)),
+        end_time DateTime64(9) CODEC(Delta, ZSTD(1)),
+        input_text Nullable(String) CODEC(ZSTD(3)),
+        output_text Nullable(String) CODEC(ZSTD(3)),
+        token_usage Nullable(String) CODEC(ZSTD(3)),
+        model_parameters Nullable(String) CODEC(ZSTD(3)),
+        metadata_json Nullable(String) CODEC(ZSTD(3)),
+        extra Nullable(String) CODEC(ZSTD(3)),
+        observation_type LowCardinality(String),
+        error Nullable(String) CODEC(ZSTD(3)),
         total_cost Nullable(Float64),
-        created_at DateTime64(9),
+        created_at DateTime64(9) CODEC(Delta, ZSTD(1)),
+        project_id UUID,
+        user_id String,
+        input_ref Nullable(String),
+        output_ref Nullable(String),
+        prompt_tokens {TOKEN_COLUMNS["prompt_tokens"]},
+        completion_tokens {TOKEN_COLUMNS["completion_tokens"]},
+        total_tokens {TOKEN_COLUMNS["total_tokens"]},
+        application_id Nullable(UUID),
+        application_name LowCardinality(String),
+        ingest_version UInt64 DEFAULT toUnixTimestamp64Nano(now64(9)) CODEC(Delta, ZSTD(1)),
+        INDEX {TRACE_ID_INDEX} {TRACE_ID_INDEX_DEFINITION}
+    ) ENGINE = {engine}
+    {partition_by("observations")}
+    ORDER BY {order_by}
+    {table_ttl("observations")}
+    COMMENT '{STORAGE_SCHEMA_COMMENT}'
+    """
+
+
+def init_clickhouse():
+    print("[Backend] Initializing ClickHouse tables...")
+    client = get_clickhouse_client()
+    client.command(traces_table_ddl())
+    client.command(observations_table_ddl())
+
+    # Columns added after the tables were first created. Existing tables keep
+    # their engine, partitioning and column types until converted by
+    # migrate_storage_schema.py.
+    # Done before the views below, which read some of these columns.
+    for table in ("traces", "observations"):
+        client.command(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "
+            "ingest_version UInt64 DEFAULT toUnixTimestamp64Nano(now64(9))"
+        )
+        client.command(
+            f"ALTER TABLE {table} ADD INDEX IF NOT EXISTS {TRACE_ID_INDEX} {TRACE_ID_INDEX_DEFINITION}"
+        )
+    # Only part of the sort key once the table is converted by
+    # migrate_storage_schema.py
+    client.command(f"ALTER TABLE traces ADD COLUMN IF NOT EXISTS is_root {IS_ROOT_COLUMN} AFTER parent_span_id")
+    for column in ("input_ref", "output_ref"):
+        client.command(f"ALTER TABLE observations ADD COLUMN IF NOT EXISTS {column} Nullable(String)")
+    for column, definition in TOKEN_COLUMNS.items():
+        client.command(f"ALTER TABLE observations ADD COLUMN IF NOT EXISTS {column} {definition}")
+    # The ingesting API key's application, see backfill_observation_applications.py
+    # for rows written before
+    client.command("ALTER TABLE observations ADD COLUMN IF NOT EXISTS application_id Nullable(UUID)")
+    client.command("ALTER TABLE observations ADD COLUMN IF NOT EXISTS application_name LowCardinality(String)")
+
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {DEAD_LETTER_TABLE} (
+        id UUID DEFAULT generateUUIDv4(),
+        received_at DateTime64(9),
         project_id UUID,
-        user_id Nullable(String)
+        application_id Nullable(UUID),
+        application_name Nullable(String),
+        target_table LowCardinality(String),
+        reason String,
+        payload String
     ) ENGINE = MergeTree()
-    ORDER BY (project_id, start_time)
+    ORDER BY (received_at, id)
+    TTL toDateTime(received_at) + INTERVAL {settings.INGEST_DEAD_LETTER_TTL_DAYS} DAY
+    """)
+    client.command(
+        f"ALTER TABLE {DEAD_LETTER_TABLE} ADD COLUMN IF NOT EXISTS application_id Nullable(UUID) AFTER project_id"
+    )
+
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {TRACE_SUMMARY_TABLE} (
+        project_id UUID,
+        day Date,
+        trace_id String,
+        root_name SimpleAggregateFunction(anyLast, Nullable(String)),
+        root_start_time SimpleAggregateFunction(min, Nullable(DateTime64(9))),
+        root_end_time SimpleAggregateFunction(max, Nullable(DateTime64(9))),
+        root_duration_ms SimpleAggregateFunction(max, Nullable(Float64)),
+        root_status_code SimpleAggregateFunction(anyLast, Nullable(String)),
+        root_user_id SimpleAggregateFunction(anyLast, Nullable(String)),
+        root_application_name SimpleAggregateFunction(anyLast, Nullable(String)),
+        root_attributes AggregateFunction(argMax, Map(String, String), UInt8),
+        first_input AggregateFunction(argMin, Nullable(String), DateTime64(9)),
+        last_output AggregateFunction(argMax, Nullable(String), DateTime64(9)),
+        total_tokens SimpleAggregateFunction(sum, Int64),
+        total_cost SimpleAggregateFunction(sum, Float64),
+        observation_count SimpleAggregateFunction(sum, UInt64)
+    ) ENGINE = AggregatingMergeTree()
+    {partition_by(TRACE_SUMMARY_TABLE)}
+    ORDER BY (project_id, day, trace_id)
+    {table_ttl(TRACE_SUMMARY_TABLE)}
+    """)
+    client.command(
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {TRACE_SUMMARY_TABLE}_traces_mv "
+        f"TO {TRACE_SUMMARY_TABLE} AS {TRACE_SUMMARY_FROM_TRACES.format(where='')}"
+    )
+    client.command(
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {TRACE_SUMMARY_TABLE}_observations_mv "
+        f"TO {TRACE_SUMMARY_TABLE} AS {TRACE_SUMMARY_FROM_OBSERVATIONS.format(where='')}"
+    )
+
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {TRACE_ROLLUP_TABLE} (
+        project_id UUID,
+        hour DateTime,
+        application String,
+        status_code String,
+        name String,
+        trace_count SimpleAggregateFunction(sum, UInt64),
+        duration_sum SimpleAggregateFunction(sum, Float64),
+        duration_quantiles AggregateFunction(quantiles(0.5, 0.9, 0.95, 0.99), Float64)
+    ) ENGINE = AggregatingMergeTree()
+    {partition_by(TRACE_ROLLUP_TABLE)}
+    ORDER BY (project_id, hour, application, status_code, name)
+    {table_ttl(TRACE_ROLLUP_TABLE)}
+    """)
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {TRACE_USER_ROLLUP_TABLE} (
+        project_id UUID,
+        hour DateTime,
+        user String,
+        trace_count SimpleAggregateFunction(sum, UInt64)
+    ) ENGINE = AggregatingMergeTree()
+    {partition_by(TRACE_USER_ROLLUP_TABLE)}
+    ORDER BY (project_id, hour, user)
+    {table_ttl(TRACE_USER_ROLLUP_TABLE)}
     """)
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {OBSERVATION_ROLLUP_TABLE} (
+        project_id UUID,
+        hour DateTime,
+        type String,
+        model_name String,
+        score_name String,
+        application String,
+        observation_count SimpleAggregateFunction(sum, UInt64),
+        prompt_tokens SimpleAggregateFunction(sum, UInt64),
+        completion_tokens SimpleAggregateFunction(sum, UInt64),
+        total_tokens SimpleAggregateFunction(sum, UInt64),
+        total_cost SimpleAggregateFunction(sum, Float64),
+        duration_quantiles AggregateFunction(quantiles(0.5, 0.9, 0.95, 0.99), Int64),
+        score_sum SimpleAggregateFunction(sum, Float64),
+        tokens_per_sec_sum SimpleAggregateFunction(sum, Float64),
+        tokens_per_sec_count SimpleAggregateFunction(sum, UInt64)
+    ) ENGINE = AggregatingMergeTree()
+    {partition_by(OBSERVATION_ROLLUP_TABLE)}
+    ORDER BY {OBSERVATION_ROLLUP_ORDER_BY}
+    {table_ttl(OBSERVATION_ROLLUP_TABLE)}
+    """)
+    # A new column can only join the sort key in the ALTER that adds it
+    client.command(
+        f"ALTER TABLE {OBSERVATION_ROLLUP_TABLE} ADD COLUMN IF NOT EXISTS application String "
+        f"AFTER score_name, MODIFY ORDER BY {OBSERVATION_ROLLUP_ORDER_BY}"
+    )
+    for table, sources in HOURLY_ROLLUPS.items():
+        for source, select in sources.items():
+            client.command(
+                f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_{source}_mv "
+                f"TO {table} AS {select.format(where='')}"
+            )
+    # Views created before the application column was added leave it empty
+    client.command(
+        f"ALTER TABLE {OBSERVATION_ROLLUP_TABLE}_observations_mv "
+        f"MODIFY QUERY {OBSERVATION_ROLLUP_FROM_OBSERVATIONS.format(where='')}"
+    )
+
+    # input_text/output_text of observations hold a preview when the full
+    # text is here; input_ref/output_ref point at it. Identical texts
+    # written in the same month collapse into one row on merge.
+    client.command(f"""
+    CREATE TABLE IF NOT EXISTS {PAYLOAD_BLOB_TABLE} (
+        project_id UUID,
+        hash String,
+        content String CODEC(ZSTD(3)),
+        size UInt32,
+        created_at DateTime DEFAULT now()
+    ) ENGINE = ReplacingMergeTree()
+    {partition_by(PAYLOAD_BLOB_TABLE)}
+    ORDER BY (project_id, hash)
+    {table_ttl(PAYLOAD_BLOB_TABLE)}
+    """)
+
+    for table in (
+        "traces",
+        "observations",
+        DEAD_LETTER_TABLE,
+        PAYLOAD_BLOB_TABLE,
+        TRACE_SUMMARY_TABLE,
+        *HOURLY_ROLLUPS,
+    ):
+        enable_insert_deduplication(client, table)
+
     print("[Backend] ClickHouse initialization complete.")
@@ -0,0 +1,121 @@
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_unix_nanos(dt: datetime) -> int:
+    """
+    Exact nanosecond timestamp for a datetime (naive values are taken as UTC).
+    DateTime64(9) columns accept these ticks as-is, which skips the per-value
+    datetime conversion clickhouse_connect would otherwise do on insert.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+class ColumnarBatch:
+    """
+    Rows for one ClickHouse table held column by column, ready for
+    `client.insert(..., column_oriented=True)`.
+
+    Columns listed in `column_types` are typed `array`s (e.g. "q" for
+    DateTime64 ticks, "d" for Float64); the rest are Python lists. All
+    columns are pre-sized to `capacity` and written by index, and a batch
+    can be reset and reused after it has been inserted.
+    """
+
+    def __init__(self, column_names: Sequence[str], column_types: Dict[str, str], capacity: int = 0):
+        self.column_names = list(column_names)
+        self.column_types = column_types
+        self.typecodes: List[Optional[str]] = [column_types.get(name) for name in self.column_names]
+        self.capacity = 0
+        self.num_rows = 0
+        self.columns: List[Any] = [array(code) if code else [] for code in self.typecodes]
+        self._grow(capacity)
+
+    def _grow(self, min_capacity: int):
+        new_capacity = max(min_capacity, self.capacity * 2, 16)
+        extra = new_capacity - self.capacity
+        for col, code in zip(self.columns, self.typecodes):
+            if code:
+                col.extend(array(code, [0]) * extra)
+            else:
+                col.extend([None] * extra)
+        self.capacity = new_capacity
+
+    def _next_row(self) -> int:
+        """
+        Index the next row is written at. It only counts once the writer
+        bumps num_rows, so a row that fails halfway is overwritten by the
+        next one.
+        """
+        n = self.num_rows
+        if n >= self.capacity:
+            self._grow(n + 1)
+        return n
+
+    def append(self, *values):
+        """
+        Write one row, values in column order. Batches of the busiest
+        tables override this with the columns written out (see
+        app/core/clickhouse.py).
+        """
+        n = self._next_row()
+        for col, value in zip(self.columns, values):
+            col[n] = value
+        self.num_rows = n + 1
+
+    def extend(self, other: "ColumnarBatch"):
+        if other.column_names != self.column_names:
+            raise ValueError("Cannot merge batches with different columns")
+        n, m = self.num_rows, other.num_rows
+        if n + m > self.capacity:
+            self._grow(n + m)
+        for col, src in zip(self.columns, other.columns):
+            col[n:n + m] = src[:m]
+        self.num_rows = n + m
+
+    def insert_columns(self) -> List[Any]:
+        """
+        Columns trimmed to the rows actually written.
+        """
+        n = self.num_rows
+        if n == self.capacity:
+            return self.columns
+        return [col[:n] for col in self.columns]
+
+    def estimate_size(self) -> int:
+        """
+        Rough byte size used to decide when to flush. String bodies dominate
+        our payloads, so list columns are sized by len() of their values
+        (entry count for maps) and anything unsized counts 8 bytes per row.
+        """
+        n = self.num_rows
+        size = 0
+        for col, code in zip(self.columns, self.typecodes):
+            if code:
+                size += col.itemsize * n
+                continue
+            try:
+                size += sum(map(len, filter(None, col[:n])))
+            except TypeError:
+                size += 8 * n
+        return size
+
+    def reset(self):
+        """
+        Forget written rows but keep the allocated columns. String slots are
+        cleared so large prompt bodies aren't kept alive until overwritten.
+        """
+        n = self.num_rows
+        for col, code in zip(self.columns, self.typecodes):
+            if not code:
+                col[:n] = [None] * n
+        self.num_rows = 0
+
+    def __len__(self) -> int:
+        return self.num_rows
@@ -18,6 +18,114 @@ class Settings(BaseSettings):
     CLICKHOUSE_PORT: int = 8123
     CLICKHOUSE_USER: str = "clickhouse"
     CLICKHOUSE_PASSWORD: str = "clickhouse"
+    CLICKHOUSE_POOL_SIZE: int = 16
+    CLICKHOUSE_KEEPALIVE_SECONDS: int = 30
+    CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS: float = 30.0
+    # Create traces/observations as ReplacingMergeTree(ingest_version) keyed
+    # on the span id, so re-sent spans collapse on merge. Only applies to
+    # newly created tables.
+    CLICKHOUSE_REPLACING_MERGE_TREE: bool = True
+    # TTL ClickHouse enforces on merges for traces, observations and their
+    # rollups, whatever the project's retention (0 = none). Only applies to
+    # newly created tables.
+    CLICKHOUSE_TTL_DAYS: int = 0
+    # Blocks per table whose insert_deduplication_token ClickHouse remembers,
+    # so an ingest batch inserted again (a retry after a timeout that was
+    # committed after all, a spool replay) is skipped. Ingest writes a few
+    # blocks per table and worker every INGEST_BUFFER_MAX_AGE_SECONDS.
+    CLICKHOUSE_DEDUPLICATION_WINDOW: int = 10000
+    # Trace detail reads given the trace's start time only look at spans
+    # starting this long before or after it
+    TRACE_DETAIL_WINDOW_SECONDS: int = 24 * 60 * 60
+
+    # API key resolution cache for the ingest path. Entries are per process,
+    # so the TTL bounds how long other workers keep using a revoked key.
+    API_KEY_CACHE_MAX_SIZE: int = 10000
+    API_KEY_CACHE_TTL_SECONDS: float = 60.0
+    API_KEY_CACHE_NEGATIVE_TTL_SECONDS: float = 10.0
+
+    # Largest ingest body accepted after decompression (guards against zip bombs)
+    INGEST_MAX_BODY_BYTES: int = 64 * 1024 * 1024
+    # NDJSON uploads are streamed, so they only need a much looser total cap
+    INGEST_NDJSON_MAX_BODY_BYTES: int = 4 * 1024 * 1024 * 1024
+    INGEST_NDJSON_CHUNK_ROWS: int = 1000
+
+    # Active evaluation rules per application, cached for the ingest path.
+    # Rule changes invalidate the local worker at once, others within the TTL.
+    RULE_CACHE_MAX_SIZE: int = 10000
+    RULE_CACHE_TTL_SECONDS: float = 60.0
+
+    # Model price catalog per project, used at ingest to fill total_cost
+    # when the SDK didn't send one
+    MODEL_PRICE_CACHE_MAX_SIZE: int = 10000
+    MODEL_PRICE_CACHE_TTL_SECONDS: float = 60.0
+
+    # Ingest buffering: rows are batched across requests and flushed to
+    # ClickHouse when any of these limits is reached
+    INGEST_BUFFER_MAX_ROWS: int = 50000
+    INGEST_BUFFER_MAX_BYTES: int = 32 * 1024 * 1024
+    INGEST_BUFFER_MAX_AGE_SECONDS: float = 2.0
+    # After a failed insert, flushes go straight to the spool for this long
+    # instead of waiting on ClickHouse again
+    INGEST_BUFFER_RETRY_AFTER_SECONDS: float = 5.0
+
+    # Ingest admission control, per API key and per project (0 disables a
+    # limit). Buckets hold `burst seconds` worth of the rate, and limits are
+    # per worker process.
+    INGEST_RATE_LIMIT_ENABLED: bool = True
+    INGEST_KEY_SPANS_PER_SECOND: float = 2000.0
+    INGEST_KEY_BYTES_PER_SECOND: float = 8 * 1024 * 1024
+    INGEST_PROJECT_SPANS_PER_SECOND: float = 5000.0
+    INGEST_PROJECT_BYTES_PER_SECOND: float = 20 * 1024 * 1024
+    INGEST_RATE_LIMIT_BURST_SECONDS: float = 5.0
+    # Spans a project may ingest per UTC day across all workers (0 = unlimited)
+    INGEST_PROJECT_DAILY_SPAN_QUOTA: int = 0
+    PROJECT_USAGE_SYNC_INTERVAL_SECONDS: float = 10.0
+
+    # Deduplication of SDK retries: responses are replayed for a repeated
+    # Idempotency-Key, and spans already seen by this worker within the
+    # window are dropped. Both are per worker; duplicates that get past them
+    # are counted in trace_summary and the hourly rollups (see table_engine).
+    INGEST_IDEMPOTENCY_TTL_SECONDS: float = 600.0
+    INGEST_IDEMPOTENCY_MAX_KEYS: int = 100000
+    INGEST_DEDUP_WINDOW_SECONDS: float = 300.0
+    INGEST_DEDUP_MAX_ENTRIES: int = 2000000
+
+    # Observation input/output texts longer than this are written once to the
+    # payload_blobs table (keyed by content hash); the observation row keeps
+    # a reference and the first PAYLOAD_PREVIEW_CHARS characters
+    PAYLOAD_BLOBS_ENABLED: bool = True
+    PAYLOAD_BLOB_MIN_CHARS: int = 1024
+    PAYLOAD_PREVIEW_CHARS: int = 256
+
+    # Records rejected at ingest (bad types, missing ids or timestamps) are
+    # kept in ClickHouse's ingest_dead_letter table this long for replay
+    INGEST_DEAD_LETTER_TTL_DAYS: int = 30
+
+    # Local spool for batches ClickHouse can't take right now; replayed in
+    # the background. Each worker process uses its own subdirectory.
+    INGEST_SPOOL_ENABLED: bool = True
+    INGEST_SPOOL_DIR: str = "data/ingest_spool"
+    INGEST_SPOOL_SEGMENT_MAX_BYTES: int = 16 * 1024 * 1024
+    INGEST_SPOOL_MAX_BYTES: int = 4 * 1024 * 1024 * 1024
+    INGEST_SPOOL_REPLAY_CONCURRENCY: int = 2
+    INGEST_SPOOL_REPLAY_INTERVAL_SECONDS: float = 1.0
+    INGEST_SPOOL_FSYNC: bool = True
+
+    # Evaluation job queue (Postgres) and the standalone worker that runs it
+    EVALUATION_JOB_MAX_ATTEMPTS: int = 3
+    EVALUATION_JOB_RETRY_BACKOFF_SECONDS: float = 30.0
+    # A running job whose worker hasn't finished it within this time is
+    # handed to another worker; a single run is cancelled shortly before
+    EVALUATION_JOB_VISIBILITY_TIMEOUT_SECONDS: float = 600.0
+    EVALUATION_WORKER_CONCURRENCY: int = 8
+    EVALUATION_WORKER_POLL_INTERVAL_SECONDS: float = 1.0
+
+    # Days of traces kept for projects without their own retention setting
+    # (0 = forever). Enforced every DATA_RETENTION_INTERVAL_SECONDS by each
+    # API process (0 = never, e.g. to leave it to a single instance).
+    DATA_RETENTION_DAYS: int = 0
+    DATA_RETENTION_INTERVAL_SECONDS: float = 3600.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import msgspec
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.clickhouse import (
+    DEAD_LETTER_TABLE,
+    PAYLOAD_BLOB_TABLE,
+    clickhouse_manager,
+    dead_letter_batch,
+    observation_batch,
+    trace_batch,
+)
+from app.core.config import settings
+from app.core.ingest_buffer import ingest_buffer, insert_columns
+from app.core.ingest_rows import RejectedRow, append_observation, append_span
+from app.core.ingest_schema import observation_decoder, span_decoder
+from app.core.model_prices import PriceCatalog, get_price_catalog
+from app.core.payload_blobs import PayloadBlobs
+
+logger = logging.getLogger(__name__)
+
+# Longest reason stored; validation messages are short, tracebacks are not
+MAX_REASON_LENGTH = 1000
+REPLAY_PAGE_ROWS = 5000
+
+REPLAY_QUERY = f"""
+    SELECT id, toUnixTimestamp64Nano(received_at), project_id, application_id, application_name, target_table, payload
+    FROM {DEAD_LETTER_TABLE}
+    WHERE (received_at, id) > (fromUnixTimestamp64Nano({{after_ns:Int64}}), {{after_id:UUID}})
+      AND ({{target_table:Nullable(String)}} IS NULL OR target_table = {{target_table:Nullable(String)}})
+      AND ({{project_id:Nullable(UUID)}} IS NULL OR project_id = {{project_id:Nullable(UUID)}})
+    ORDER BY received_at, id
+    LIMIT {{limit:UInt32}}
+"""
+
+SUMMARY_QUERY = f"""
+    SELECT project_id, target_table, count() AS records,
+           min(received_at) AS first_received_at, max(received_at) AS last_received_at,
+           any(reason) AS example_reason
+    FROM {DEAD_LETTER_TABLE}
+    GROUP BY project_id, target_table
+    ORDER BY records DESC
+    LIMIT 1000
+"""
+
+
+class DeadLetters:
+    """
+    Records of one ingest request that were rejected, written to the
+    ingest_dead_letter table through the ingest buffer like any other rows.
+    """
+
+    def __init__(self, target_table: str, project_id, application_id, application_name: Optional[str]):
+        self.target_table = target_table
+        self.project_id = project_id
+        self.application_id = application_id
+        self.application_name = application_name
+        self.batch = dead_letter_batch()
+        self.batch_bytes = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, payload: bytes, reason: str):
+        self.count += 1
+        self.batch_bytes += len(payload)
+        self.batch.append(
+            time.time_ns(),
+            self.project_id,
+            self.application_id,
+            self.application_name,
+            self.target_table,
+            reason[:MAX_REASON_LENGTH],
+            payload.decode(errors="replace"),
+        )
+
+    def add_record(self, record: msgspec.Struct, reason: str):
+        """
+        Reject a record that decoded but can't be stored; it is kept as its
+        re-encoded JSON.
+        """
+        self.add(msgspec.json.encode(record), reason)
+
+    def is_full(self) -> bool:
+        """
+        Whether a streamed upload should flush the records rejected so far
+        rather than keep collecting them.
+        """
+        return (
+            len(self.batch) >= settings.INGEST_NDJSON_CHUNK_ROWS
+            or self.batch_bytes >= settings.INGEST_MAX_BODY_BYTES
+        )
+
+    async def flush(self):
+        await ingest_buffer.add(DEAD_LETTER_TABLE, self.batch)
+        self.batch.reset()
+        self.batch_bytes = 0
+
+
+def _replay_page(rows, counts: Dict[str, int], prices: Dict[uuid.UUID, PriceCatalog]):
+    """
+    Convert a page of dead letters with the current ingest code, insert the
+    ones that now pass and delete them from the dead letter table.
+    `prices` has the price catalog of every project in the page.
+    """
+    blobs = PayloadBlobs()
+    batches = {"traces": trace_batch(len(rows)), "observations": observation_batch(len(rows))}
+    replayed = []
+    for row_id, _, project_id, application_id, application_name, target_table, payload in rows:
+        try:
+            if target_table == "traces":
+                append_span(batches["traces"], span_decoder.decode(payload), project_id, application_name)
+            elif target_table == "observations":
+                append_observation(
+                    batches["observations"],
+                    observation_decoder.decode(payload),
+                    project_id,
+                    application_id,
+                    application_name,
+                    blobs,
+                    prices[project_id],
+                )
+            else:
+                counts["failed"] += 1
+                continue
+        except (msgspec.DecodeError, RejectedRow):
+            counts["failed"] += 1
+            continue
+        replayed.append(row_id)
+
+    # Inserted directly rather than through the buffer, so a dead letter is
+    # only deleted once its row is in ClickHouse
+    batches = {PAYLOAD_BLOB_TABLE: blobs.batch, **batches}
+    for table, batch in batches.items():
+        if batch.num_rows:
+            insert_columns(table, batch.column_names, batch.insert_columns())
+    if replayed:
+        clickhouse_manager.command(
+            f"DELETE FROM {DEAD_LETTER_TABLE} WHERE id IN {{ids:Array(UUID)}}",
+            parameters={"ids": replayed},
+        )
+    counts["replayed"] += len(replayed)
+
+
+async def dead_letter_summary() -> List[Dict[str, Any]]:
+    result = await asyncio.to_thread(clickhouse_manager.query, SUMMARY_QUERY)
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+async def replay_dead_letters(
+    session: AsyncSession,
+    target_table: Optional[str] = None,
+    project_id: Optional[uuid.UUID] = None,
+    limit: int = 100000,
+) -> Dict[str, Any]:
+    """
+    Run up to `limit` dead letters, oldest first, through the ingest
+    conversion again (typically after the code or a client has been fixed).
+    Records that still fail are left in place.
+    """
+    counts = {"replayed": 0, "failed": 0}
+    # Keyset cursor, so records that keep failing aren't read again
+    after_ns, after_id = 0, uuid.UUID(int=0)
+    remaining = limit
+    while remaining > 0:
+        result = await asyncio.to_thread(
+            clickhouse_manager.query,
+            REPLAY_QUERY,
+            parameters={
+                "after_ns": after_ns,
+                "after_id": after_id,
+                "target_table": target_table,
+                "project_id": project_id,
+                "limit": min(REPLAY_PAGE_ROWS, remaining),
+            },
+        )
+        rows = result.result_rows
+        if not rows:
+            break
+        prices = {row[2]: await get_price_catalog(session, row[2]) for row in rows if row[5] == "observations"}
+        await asyncio.to_thread(_replay_page, rows, counts, prices)
+        after_ns, after_id = rows[-1][1], rows[-1][0]
+        remaining -= len(rows)
+
+    if counts["replayed"] or counts["failed"]:
+        logger.info(f"Replayed {counts['replayed']} dead letters, {counts['failed']} still failing")
+    return counts
@@ -0,0 +1,61 @@
+import time
+from typing import Any, Dict, Hashable, Iterable
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+class SeenSet:
+    """
+    Approximate "seen recently" set for span keys, per process.
+
+    Keys live in two generations; the current one is retired every
+    `window_seconds` (or once it holds `max_entries / 2` keys), so a key is
+    remembered for between one and two windows. That is enough to catch SDK
+    retries, which arrive seconds after the original, at the cost of two set
+    lookups per span.
+    """
+
+    def __init__(self, window_seconds: float, max_entries: int):
+        self.window_seconds = window_seconds
+        self.max_generation = max(1, max_entries // 2)
+        self._current: set = set()
+        self._previous: set = set()
+        self._rotated_at = time.monotonic()
+        self.duplicates = 0
+
+    def _maybe_rotate(self):
+        now = time.monotonic()
+        if now - self._rotated_at >= self.window_seconds or len(self._current) >= self.max_generation:
+            self._previous = self._current
+            self._current = set()
+            self._rotated_at = now
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._current or key in self._previous:
+            self.duplicates += 1
+            return True
+        return False
+
+    def add_many(self, keys: Iterable[Hashable]):
+        self._maybe_rotate()
+        self._current.update(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._current) + len(self._previous),
+            "duplicates": self.duplicates,
+        }
+
+
+# (project_id, trace_id, span_id) for traces, (project_id, id) for observations
+span_seen = SeenSet(settings.INGEST_DEDUP_WINDOW_SECONDS, settings.INGEST_DEDUP_MAX_ENTRIES)
+observation_seen = SeenSet(settings.INGEST_DEDUP_WINDOW_SECONDS, settings.INGEST_DEDUP_MAX_ENTRIES)
+
+# Responses of completed ingest requests by (project_id, endpoint,
+# Idempotency-Key); an entry holding IN_PROGRESS marks a request still running
+idempotency_cache = TTLCache(
+    max_size=settings.INGEST_IDEMPOTENCY_MAX_KEYS,
+    ttl_seconds=settings.INGEST_IDEMPOTENCY_TTL_SECONDS,
+)
+IN_PROGRESS = object()
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import delete, insert, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.evaluation_job import EvaluationJob
+
+# Jobs whose lease expired on their last attempt (the worker crashed or
+# hung every time) are failed instead of being claimed again
+FAIL_EXPIRED_JOBS_SQL = text("""
+    UPDATE evaluationjob
+    SET status = 'FAILED',
+        locked_by = NULL,
+        locked_until = NULL,
+        last_error = 'Lease expired on the last attempt'
+    WHERE status = 'RUNNING' AND locked_until < :now AND attempts >= max_attempts
+""")
+
+# Claims due jobs (pending, or running with an expired lease and attempts
+# left) in one statement. SKIP LOCKED lets concurrent workers claim disjoint
+# batches without waiting on each other.
+CLAIM_JOBS_SQL = text("""
+    UPDATE evaluationjob
+    SET status = 'RUNNING',
+        attempts = attempts + 1,
+        locked_by = :worker_id,
+        locked_until = :locked_until
+    WHERE id IN (
+        SELECT id FROM evaluationjob
+        WHERE (status = 'PENDING' AND available_at <= :now)
+           OR (status = 'RUNNING' AND locked_until < :now AND attempts < max_attempts)
+        ORDER BY available_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, rule_id, trace_data, attempts, max_attempts, created_at
+""")
+
+
+async def enqueue_evaluation_jobs(session: AsyncSession, jobs: List[Dict[str, Any]]):
+    """
+    Insert jobs ({"rule_id", "trace_data"}) in a single statement and commit.
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    await session.execute(
+        insert(EvaluationJob),
+        [
+            {
+                "rule_id": job["rule_id"],
+                "trace_data": job["trace_data"],
+                "status": "PENDING",
+                "attempts": 0,
+                "max_attempts": settings.EVALUATION_JOB_MAX_ATTEMPTS,
+                "available_at": now,
+                "created_at": now,
+            }
+            for job in jobs
+        ],
+    )
+    await session.commit()
+
+
+async def claim_evaluation_jobs(session: AsyncSession, worker_id: str, limit: int) -> List[Any]:
+    now = datetime.utcnow()
+    await session.execute(FAIL_EXPIRED_JOBS_SQL, {"now": now})
+    result = await session.execute(
+        CLAIM_JOBS_SQL,
+        {
+            "worker_id": worker_id,
+            "now": now,
+            "locked_until": now + timedelta(seconds=settings.EVALUATION_JOB_VISIBILITY_TIMEOUT_SECONDS),
+            "limit": limit,
+        },
+    )
+    rows = result.all()
+    await session.commit()
+    return rows
+
+
+async def complete_evaluation_job(session: AsyncSession, job_id: int, worker_id: str):
+    # Results live in EvaluationResult; the job row itself is no longer needed
+    await session.execute(
+        delete(EvaluationJob).where(EvaluationJob.id == job_id, EvaluationJob.locked_by == worker_id)
+    )
+    await session.commit()
+
+
+async def fail_evaluation_job(
+    session: AsyncSession, job_id: int, worker_id: str, attempts: int, max_attempts: int, error: str
+):
+    """
+    Schedule a retry with exponential backoff, or mark the job FAILED once
+    it has used up its attempts.
+    """
+    values: Dict[str, Any] = {"last_error": error[:2000], "locked_by": None, "locked_until": None}
+    if attempts >= max_attempts:
+        values["status"] = "FAILED"
+    else:
+        backoff = settings.EVALUATION_JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        values["status"] = "PENDING"
+        values["available_at"] = datetime.utcnow() + timedelta(seconds=backoff)
+
+    await session.execute(
+        update(EvaluationJob)
+        .where(EvaluationJob.id == job_id, EvaluationJob.locked_by == worker_id)
+        .values(**values)
+    )
+    await session.commit()
@@ -1,7 +1,10 @@
+import asyncio
 import importlib
 import logging
 import inspect
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
@@ -17,10 +20,12 @@ from opentelemetry import trace, context as otel_context
 
 logger = logging.getLogger(__name__)
 
-async def run_triggered_evaluation(rule_id: int, trace_data: dict):
+async def run_triggered_evaluation(rule_id: int, trace_data: dict, since: Optional[datetime] = None):
     """
     Run evaluation based on a triggered rule and trace data.
     trace_data should look like { "input": ..., "output": ..., "context": ..., "trace_id": ... }
+    When retrying a job, since is its creation time: metrics completed for
+    the trace since then are skipped and unfinished results are reused.
     """
     logger.info(f"Starting triggered evaluation for Rule ID: {rule_id}")
     
@@ -53,21 +58,40 @@ async def run_triggered_evaluation(rule_id: int, trace_data: dict):
             expected = trace_data.get("expected") or inputs.get("expected")
             target_trace_id = trace_data.get("trace_id")
 
+            # Results of earlier attempts of this job, by metric
+            previous = {}
+            if since and target_trace_id:
+                stmt = select(EvaluationResult).where(
+                    EvaluationResult.trace_id == target_trace_id,
+                    EvaluationResult.metric_id.in_(metric_ids),
+                    EvaluationResult.created_at >= since,
+                ).order_by(EvaluationResult.created_at)
+                for prev in (await session.execute(stmt)).scalars():
+                    if previous.get(prev.metric_id) is None or previous[prev.metric_id].status != "COMPLETED":
+                        previous[prev.metric_id] = prev
+
             for metric_id in metric_ids:
-                # Create Initial Evaluation Result (PENDING/RUNNING)
-                eval_result = EvaluationResult(
-                    trace_id=target_trace_id,
-                    metric_id=metric_id,
-                    input=str(query) if query else None,
-                    output=str(output) if output else None,
-                    context=context if isinstance(context, list) else [str(context)] if context else [],
-                    expected_output=str(expected) if expected else None,
-                    status="RUNNING",
-                    application_name=trace_data.get("application_name") or inputs.get("application_name")
-                )
+                eval_result = previous.get(metric_id)
+                if eval_result is not None and eval_result.status == "COMPLETED":
+                    logger.info(f"Metric {metric_id} for Rule {rule_id} already completed, skipping.")
+                    continue
+                if eval_result is None:
+                    # Create Initial Evaluation Result (PENDING/RUNNING)
+                    eval_result = EvaluationResult(
+                        trace_id=target_trace_id,
+                        metric_id=metric_id,
+                        input=str(query) if query else None,
+                        output=str(output) if output else None,
+                        context=context if isinstance(context, list) else [str(context)] if context else [],
+                        expected_output=str(expected) if expected else None,
+                        application_name=trace_data.get("application_name") or inputs.get("application_name")
+                    )
+                eval_result.status = "RUNNING"
+                eval_result.reason = None
                 session.add(eval_result)
                 await session.commit()
                 await session.refresh(eval_result)
+                result_id = eval_result.id
                 
                 try:
                     provider = inputs.get("provider", "openai")
@@ -196,6 +220,20 @@ async def run_triggered_evaluation(rule_id: int, trace_data: dict):
                         await session.commit()
                         logger.info(f"Metric {metric_id} for Rule {rule_id} completed successfully.")
 
+                except asyncio.CancelledError:
+                    # Timed out or shutting down: don't leave the result RUNNING.
+                    # The session may be mid-statement, so use a fresh one.
+                    try:
+                        async with async_session() as cleanup:
+                            await cleanup.execute(
+                                update(EvaluationResult)
+                                .where(EvaluationResult.id == result_id)
+                                .values(status="FAILED", reason="Cancelled (timed out or worker stopping)")
+                            )
+                            await cleanup.commit()
+                    except Exception as e:
+                        logger.error(f"Failed to mark metric {metric_id} for Rule {rule_id} as failed: {e}")
+                    raise
                 except Exception as e:
                     logger.error(f"Metric {metric_id} for Rule {rule_id} failed: {e}")
                     eval_result.status = "FAILED"
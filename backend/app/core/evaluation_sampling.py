@@ -0,0 +1,53 @@
+import hashlib
+from typing import Any, Dict, Optional
+
+# Resolution of the sampling decision: percentages are honoured to 0.01%
+SAMPLE_BUCKETS = 10000
+
+
+def trace_sample_bucket(trace_id: Optional[str]) -> int:
+    """
+    Stable bucket in [0, SAMPLE_BUCKETS) for a trace id. It is derived from
+    a hash of the id rather than hash(), which is salted per process, so
+    every worker makes the same decision for the same trace.
+    """
+    digest = hashlib.blake2b((trace_id or "").encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % SAMPLE_BUCKETS
+
+
+def is_sampled(bucket: int, percentage: float) -> bool:
+    """
+    Whether a trace in `bucket` is kept by a rule sampling `percentage`
+    (0-100) percent of traces. Lower percentages keep a subset of the traces
+    kept by higher ones, so a trace is either evaluated by all rules at a
+    given rate or by none of them.
+    """
+    if percentage >= 100:
+        return True
+    if percentage <= 0:
+        return False
+    return bucket < percentage * SAMPLE_BUCKETS / 100
+
+
+class SamplingCounters:
+    """
+    Observations sampled in and out, per evaluation rule, in this process.
+    """
+
+    def __init__(self):
+        # rule_id -> [sampled_in, sampled_out]
+        self._counts: Dict[int, list] = {}
+
+    def record(self, rule_id: int, sampled_in: int, sampled_out: int):
+        counts = self._counts.setdefault(rule_id, [0, 0])
+        counts[0] += sampled_in
+        counts[1] += sampled_out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            str(rule_id): {"sampled_in": sampled_in, "sampled_out": sampled_out}
+            for rule_id, (sampled_in, sampled_out) in self._counts.items()
+        }
+
+
+evaluation_sampling = SamplingCounters()
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.clickhouse import get_clickhouse_client
+from app.core.columnar import ColumnarBatch
+from app.core.config import settings
+from app.core.ingest_spool import IngestSpool, ingest_spool
+
+logger = logging.getLogger(__name__)
+
+
+class IngestUnavailable(Exception):
+    """
+    Raised by IngestBuffer.add, without a spool, while ClickHouse is failing
+    and the table buffer is full; the rows were not accepted.
+    """
+
+    def __init__(self, table: str, retry_after: float):
+        super().__init__(f"ClickHouse is unavailable and the {table} buffer is full")
+        self.retry_after = retry_after
+
+
+def insert_columns(table: str, column_names, columns, token: Optional[str] = None):
+    """
+    Insert a column oriented block. With a `token`, ClickHouse skips a block
+    it has already written under that token (see enable_insert_deduplication),
+    and so do the materialized views fed by the table. Without one, the
+    views' blocks are never deduplicated: two different batches can
+    aggregate into the same rollup rows.
+    """
+    client = get_clickhouse_client()
+    insert_settings = None
+    if token:
+        insert_settings = {
+            "insert_deduplication_token": token,
+            "deduplicate_blocks_in_dependent_materialized_views": 1,
+        }
+    client.insert(table, columns, column_names=column_names, column_oriented=True, settings=insert_settings)
+
+
+class TableBuffer:
+    """
+    Pending rows for a single ClickHouse table.
+
+    Rows are appended into `active`; a flush swaps in the `spare` batch, so
+    the two column builders are reused across flushes instead of reallocated.
+    A batch whose insert failed is kept apart in `failed`, with the token it
+    was sent under, and retried as-is before `active`.
+    """
+
+    def __init__(self, table: str, template: ColumnarBatch, capacity: int):
+        self.table = table
+        self.column_names = template.column_names
+        self.column_types = template.column_types
+        self.capacity = capacity
+        self.active = ColumnarBatch(self.column_names, self.column_types, capacity)
+        self.spare: Optional[ColumnarBatch] = None
+        self.failed: Optional[ColumnarBatch] = None
+        self.failed_token: Optional[str] = None
+        self.failed_bytes = 0
+        self.size_bytes = 0
+        self.first_row_at: Optional[float] = None
+        # Serializes flushes so parts for a table are written one at a time
+        self.flush_lock = asyncio.Lock()
+
+    @property
+    def pending_rows(self) -> int:
+        return self.active.num_rows + (self.failed.num_rows if self.failed is not None else 0)
+
+    def take(self) -> Tuple[ColumnarBatch, str]:
+        """
+        The next batch to insert and its deduplication token: the failed
+        batch if there is one, else the active rows under a new token.
+        """
+        if self.failed is not None:
+            batch, token = self.failed, self.failed_token
+            self.failed = None
+            self.failed_token = None
+            self.failed_bytes = 0
+            if not self.active.num_rows:
+                self.first_row_at = None
+            return batch, token
+        batch = self.active
+        self.active = self.spare or ColumnarBatch(self.column_names, self.column_types, self.capacity)
+        self.spare = None
+        self.size_bytes = 0
+        self.first_row_at = None
+        return batch, uuid.uuid4().hex
+
+    def recycle(self, batch: ColumnarBatch):
+        batch.reset()
+        self.spare = batch
+
+    def put_back(self, batch: ColumnarBatch, token: str):
+        """
+        Make a batch that failed to insert pending again, ahead of the rows
+        added since it was taken. It isn't merged with them: the insert may
+        have been written after all, and only the same block under the same
+        token is skipped by ClickHouse.
+        """
+        self.failed = batch
+        self.failed_token = token
+        self.failed_bytes = batch.estimate_size()
+        if self.first_row_at is None:
+            self.first_row_at = time.monotonic()
+
+    def is_full(self, max_rows: int, max_bytes: int) -> bool:
+        return self.pending_rows >= max_rows or self.size_bytes + self.failed_bytes >= max_bytes
+
+
+class IngestBuffer:
+    """
+    Accumulates rows across ingest requests and writes them to ClickHouse in
+    large batches, so that SDK flushes don't each become a tiny part.
+
+    A table is flushed when it reaches `max_rows` or `max_bytes`, or when its
+    oldest pending row is older than `max_age_seconds`.
+
+    Batches that can't be inserted go to `spool` (when configured) instead
+    of being dropped: after a failed insert, for `retry_after_seconds`, and
+    when a table fills up again while its previous flush is still running.
+    Without a spool they stay buffered and are retried after
+    `retry_after_seconds`; meanwhile `add` raises IngestUnavailable once the
+    table is full, so clients retry instead of losing rows.
+    """
+
+    def __init__(
+        self,
+        max_rows: int,
+        max_bytes: int,
+        max_age_seconds: float,
+        retry_after_seconds: float = 5.0,
+        spool: Optional[IngestSpool] = None,
+    ):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.spool = spool
+        self._tables: Dict[str, TableBuffer] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        # monotonic time until which inserts are skipped in favour of the spool
+        self._unavailable_until = 0.0
+        self.flushed_rows = 0
+        self.spooled_rows = 0
+        self.dropped_rows = 0
+
+    def _get_table(self, table: str, batch: ColumnarBatch) -> TableBuffer:
+        buf = self._tables.get(table)
+        if buf is None:
+            buf = TableBuffer(table, batch, capacity=min(self.max_rows, 1024))
+            self._tables[table] = buf
+        elif buf.column_names != batch.column_names:
+            raise ValueError(f"Column mismatch for buffered table '{table}'")
+        return buf
+
+    async def add(self, table: str, batch: ColumnarBatch):
+        """
+        Queue a batch of rows for insertion. Flushes inline (applying
+        backpressure to the caller) when the table buffer is over its size limits.
+        """
+        if not batch.num_rows:
+            return
+
+        buf = self._get_table(table, batch)
+        if self.spool is None and buf.is_full(self.max_rows, self.max_bytes):
+            retry_after = self._unavailable_until - time.monotonic()
+            if retry_after > 0:
+                raise IngestUnavailable(table, retry_after)
+        if buf.first_row_at is None:
+            buf.first_row_at = time.monotonic()
+        buf.active.extend(batch)
+        buf.size_bytes += batch.estimate_size()
+
+        if buf.is_full(self.max_rows, self.max_bytes):
+            if self.spool is not None and buf.flush_lock.locked():
+                # ClickHouse hasn't finished the previous batch; spill this
+                # one rather than stall the request behind it
+                batch, token = buf.take()
+                await self._spill(buf.table, batch, token)
+                buf.recycle(batch)
+            else:
+                await self.flush(table)
+
+    async def flush(self, table: str, final: bool = False):
+        """
+        Insert the pending rows of a table. Without a spool, rows that fail
+        to insert are kept for a later flush, unless this is the `final` one.
+        """
+        buf = self._tables.get(table)
+        if buf is None:
+            return
+
+        async with buf.flush_lock:
+            while buf.pending_rows:
+                unavailable = time.monotonic() < self._unavailable_until
+                if self.spool is None and unavailable and not final:
+                    return
+                retrying = buf.failed is not None
+                batch, token = buf.take()
+                if self.spool is not None and unavailable:
+                    await self._spill(buf.table, batch, token)
+                else:
+                    try:
+                        await asyncio.to_thread(self._insert, buf.table, batch, token)
+                        self.flushed_rows += batch.num_rows
+                    except Exception as e:
+                        logger.error(f"Failed to flush {batch.num_rows} rows into {table}: {e}")
+                        self._unavailable_until = time.monotonic() + self.retry_after_seconds
+                        if self.spool is None and not final:
+                            buf.put_back(batch, token)
+                            return
+                        await self._spill(buf.table, batch, token)
+                buf.recycle(batch)
+                # After a retried batch, go on with the rows queued behind it
+                if not retrying:
+                    return
+
+    async def _spill(self, table: str, batch: ColumnarBatch, token: str):
+        if self.spool is None:
+            self.dropped_rows += batch.num_rows
+            return
+        try:
+            written = await asyncio.to_thread(
+                self.spool.write, table, batch.column_names, batch.insert_columns(), batch.num_rows, token
+            )
+        except Exception as e:
+            logger.error(f"Failed to spool {batch.num_rows} rows for {table}: {e}")
+            written = False
+        if written:
+            self.spooled_rows += batch.num_rows
+        else:
+            self.dropped_rows += batch.num_rows
+            logger.error(f"Ingest spool full, dropped {batch.num_rows} rows for {table}")
+
+    @staticmethod
+    def _insert(table: str, batch: ColumnarBatch, token: str):
+        insert_columns(table, batch.column_names, batch.insert_columns(), token)
+
+    async def flush_all(self, final: bool = False):
+        for table in list(self._tables):
+            await self.flush(table, final)
+
+    async def _run(self):
+        interval = min(self.max_age_seconds, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for table, buf in list(self._tables.items()):
+                if buf.first_row_at is not None and now - buf.first_row_at >= self.max_age_seconds:
+                    await self.flush(table)
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+        if self.spool is not None:
+            self.spool.start(insert_columns)
+
+    async def drain(self):
+        """
+        Stop the periodic flusher and write out everything still pending.
+        Called from the application lifespan on shutdown.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_all(final=True)
+        if self.spool is not None:
+            await self.spool.stop()
+        logger.info(
+            f"Ingest buffer drained ({self.flushed_rows} rows flushed, "
+            f"{self.spooled_rows} spooled, {self.dropped_rows} dropped)."
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_rows": {t: b.pending_rows for t, b in self._tables.items()},
+            "pending_bytes": {t: b.size_bytes + b.failed_bytes for t, b in self._tables.items()},
+            "flushed_rows": self.flushed_rows,
+            "spooled_rows": self.spooled_rows,
+            "dropped_rows": self.dropped_rows,
+            "spool": self.spool.stats() if self.spool is not None else None,
+        }
+
+
+ingest_buffer = IngestBuffer(
+    max_rows=settings.INGEST_BUFFER_MAX_ROWS,
+    max_bytes=settings.INGEST_BUFFER_MAX_BYTES,
+    max_age_seconds=settings.INGEST_BUFFER_MAX_AGE_SECONDS,
+    retry_after_seconds=settings.INGEST_BUFFER_RETRY_AFTER_SECONDS,
+    spool=ingest_spool if settings.INGEST_SPOOL_ENABLED else None,
+)
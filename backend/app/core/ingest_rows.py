@@ -0,0 +1,124 @@
+from app.core.columnar import ColumnarBatch, to_unix_nanos
+from app.core.model_prices import PriceCatalog
+from app.core.payload_blobs import PayloadBlobs
+from app.core.ingest_schema import (
+    ObservationPayload,
+    SpanPayload,
+    raw_string_or_text,
+    raw_text,
+    raw_text_or_none,
+    token_counts,
+)
+
+MAX_UINT64 = 2 ** 64 - 1
+
+
+class RejectedRow(ValueError):
+    """
+    A decoded record that can't be stored; the message is the reason.
+    """
+
+
+def append_span(batch: ColumnarBatch, span: SpanPayload, project_id, application_name):
+    """
+    Add a /traces span to a trace_batch, or raise RejectedRow. Missing
+    optional strings are written as '' (see traces_table_ddl).
+    """
+    if span.trace_id is None or span.span_id is None:
+        raise RejectedRow("Missing trace_id or span_id")
+    if span.name is None:
+        raise RejectedRow("Missing name")
+    if span.start_time is None or span.end_time is None:
+        raise RejectedRow("Missing start_time or end_time")
+
+    start_ns = to_unix_nanos(span.start_time)
+    end_ns = to_unix_nanos(span.end_time)
+    try:
+        batch.append(
+            span.trace_id,
+            span.span_id,
+            # "" from SDKs that always send the field; roots are NULL
+            span.parent_span_id or None,
+            span.name,
+            span.kind,
+            start_ns,
+            end_ns,
+            span.status.code,
+            span.status.message,
+            span.attributes,
+            raw_text(span.events),
+            raw_text(span.links),
+            span.resource.attributes,
+            (end_ns - start_ns) / 1e6,
+            project_id,
+            span.attributes.get("enduser.id", ""),
+            application_name or ""
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        # A partly written row is overwritten by the next append
+        raise RejectedRow(f"{type(e).__name__}: {e}")
+
+
+def append_observation(
+    batch: ColumnarBatch,
+    obs: ObservationPayload,
+    project_id,
+    application_id,
+    application_name,
+    blobs: PayloadBlobs,
+    prices: PriceCatalog,
+):
+    """
+    Add an /observations record to an observation_batch, or raise RejectedRow.
+    Long input/output texts are replaced by a preview and handed to `blobs`;
+    a missing total_cost is computed from the project's `prices`. Missing
+    name, model and other short strings are written as ''.
+    """
+    if obs.id is None or obs.trace_id is None:
+        raise RejectedRow("Missing id or trace_id")
+    if obs.type is None:
+        raise RejectedRow("Missing type")
+    if obs.id > MAX_UINT64 or (obs.parent_observation_id or 0) > MAX_UINT64:
+        raise RejectedRow("Observation id out of UInt64 range")
+
+    input_text, input_ref = blobs.preview(obs.input_text)
+    output_text, output_ref = blobs.preview(obs.output_text)
+    prompt_tokens, completion_tokens, total_tokens = token_counts(obs.token_usage)
+    total_cost = obs.total_cost
+    if total_cost is None:
+        total_cost = prices.cost(obs.model, obs.start_time, prompt_tokens, completion_tokens, total_tokens)
+    try:
+        batch.append(
+            obs.id,
+            obs.trace_id,
+            obs.parent_observation_id,
+            obs.name or "",
+            obs.type,
+            obs.model or "",
+            obs.start_time,
+            obs.end_time,
+            input_text,
+            output_text,
+            raw_text_or_none(obs.token_usage),
+            raw_text_or_none(obs.model_parameters),
+            raw_string_or_text(obs.metadata_json),
+            obs.extra,
+            obs.observation_type or "",
+            obs.error,
+            total_cost,
+            obs.start_time, # created_at
+            project_id,
+            obs.user_id or "",
+            input_ref,
+            output_ref,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+            application_id,
+            application_name or ""
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        raise RejectedRow(f"{type(e).__name__}: {e}")
+    # Only now, so a rejected row leaves no blob behind
+    blobs.store(project_id, input_ref, obs.input_text)
+    blobs.store(project_id, output_ref, obs.output_text)
@@ -0,0 +1,227 @@
+from datetime import datetime
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple, Union
+
+import msgspec
+
+# Typed payloads for the JSON ingest endpoints. Request bodies are decoded
+# straight into these Structs by msgspec; unknown fields are ignored.
+#
+# Fields that are stored as JSON text in ClickHouse (events, links,
+# token_usage, model_parameters, metadata_json) are kept as msgspec.Raw,
+# i.e. the exact bytes from the request, so they are never parsed and
+# re-serialised on the ingest path.
+#
+# Types mirror the ClickHouse columns (attributes are Map(String, String),
+# ids UInt64), so a record that could not be inserted fails here, on its
+# own, instead of failing the insert of the whole batch.
+
+# Upper bound is checked in append_observation; msgspec constraints stop at int64
+UInt64 = Annotated[int, msgspec.Meta(ge=0)]
+
+EMPTY_LIST = msgspec.Raw(b"[]")
+NULL = msgspec.Raw(b"null")
+
+# JSON values that `json.dumps(v) if v else None` used to map to None
+_FALSY_JSON = frozenset((b"", b"null", b"{}", b"[]", b'""', b"0", b"0.0", b"false"))
+
+
+class SpanStatus(msgspec.Struct, frozen=True):
+    code: str = "UNSET"
+    message: str = ""
+
+
+class SpanResource(msgspec.Struct, frozen=True):
+    attributes: Dict[str, str] = {}
+
+
+class SpanPayload(msgspec.Struct):
+    trace_id: Optional[str] = None
+    span_id: Optional[str] = None
+    parent_span_id: Optional[str] = ""
+    name: Optional[str] = None
+    kind: str = "INTERNAL"
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    status: SpanStatus = SpanStatus()
+    attributes: Dict[str, str] = {}
+    events: msgspec.Raw = EMPTY_LIST
+    links: msgspec.Raw = EMPTY_LIST
+    resource: SpanResource = SpanResource()
+
+
+class TracesPayload(msgspec.Struct):
+    spans: Union[List[SpanPayload], SpanPayload] = []
+
+
+class ObservationPayload(msgspec.Struct):
+    # Nanosecond timestamps, as sent by the SDK
+    start_time: int
+    end_time: int
+    # UInt64 in ClickHouse (the SDK sends OTel span ids as integers)
+    id: Optional[UInt64] = None
+    trace_id: Optional[str] = None
+    parent_observation_id: Optional[UInt64] = None
+    name: Optional[str] = None
+    type: Optional[str] = None
+    model: Optional[str] = None
+    input_text: Optional[str] = None
+    output_text: Optional[str] = None
+    token_usage: msgspec.Raw = NULL
+    model_parameters: msgspec.Raw = NULL
+    metadata_json: msgspec.Raw = NULL
+    extra: Optional[str] = None
+    observation_type: Optional[str] = None
+    error: Optional[str] = None
+    total_cost: Optional[float] = None
+    user_id: Optional[str] = None
+
+
+class TokenUsage(msgspec.Struct):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+class ObservationsPayload(msgspec.Struct):
+    observations: Union[List[ObservationPayload], ObservationPayload] = []
+
+
+# strict=False keeps accepting numbers sent as strings (e.g. "start_time":
+# "1735732800000000000"), which the dict based handlers used to int() through
+traces_decoder = msgspec.json.Decoder(Union[List[SpanPayload], TracesPayload], strict=False)
+observations_decoder = msgspec.json.Decoder(
+    Union[List[ObservationPayload], ObservationsPayload], strict=False
+)
+token_usage_decoder = msgspec.json.Decoder(TokenUsage, strict=False)
+span_decoder = msgspec.json.Decoder(SpanPayload, strict=False)
+observation_decoder = msgspec.json.Decoder(ObservationPayload, strict=False)
+# A body split into its records, each left undecoded
+records_decoder = msgspec.json.Decoder(Union[List[msgspec.Raw], Dict[str, msgspec.Raw]])
+
+
+def decode_spans(body: bytes) -> List[SpanPayload]:
+    """
+    Decode a /traces body: a list of spans or {"spans": [...]}.
+    Raises msgspec.DecodeError (ValidationError for type mismatches).
+    """
+    payload = traces_decoder.decode(body)
+    if isinstance(payload, TracesPayload):
+        payload = payload.spans
+    return payload if isinstance(payload, list) else [payload]
+
+
+def decode_observations(body: bytes) -> List[ObservationPayload]:
+    """
+    Decode an /observations body: a list of observations or
+    {"observations": [...]}.
+    """
+    payload = observations_decoder.decode(body)
+    if isinstance(payload, ObservationsPayload):
+        payload = payload.observations
+    return payload if isinstance(payload, list) else [payload]
+
+
+def split_records(body: bytes, key: str) -> List[msgspec.Raw]:
+    """
+    The records of a list body or of a {key: [...]} body, as raw JSON.
+    """
+    payload = records_decoder.decode(body)
+    if isinstance(payload, list):
+        return payload
+    raw = payload.get(key)
+    if raw is None or bytes(raw) == b"null":
+        return []
+    if bytes(raw).lstrip()[:1] == b"[":
+        return msgspec.json.decode(raw, type=List[msgspec.Raw])
+    return [raw]
+
+
+def decode_records(
+    body: bytes,
+    decode_all: Callable[[bytes], List[Any]],
+    decode_one: Callable[[bytes], Any],
+    key: str,
+) -> Tuple[List[Any], List[Tuple[bytes, str]]]:
+    """
+    Decode a body with `decode_all`. If some record doesn't validate, the
+    body is decoded again record by record, and the records that fail are
+    returned separately as (raw JSON, reason) rather than failing the lot.
+    Malformed JSON still raises msgspec.DecodeError.
+    """
+    try:
+        return decode_all(body), []
+    except msgspec.ValidationError:
+        pass
+
+    records = []
+    rejected = []
+    for raw in split_records(body, key):
+        try:
+            records.append(decode_one(raw))
+        except msgspec.ValidationError as e:
+            rejected.append((bytes(raw), str(e)))
+    return records, rejected
+
+
+def decode_span_records(body: bytes) -> Tuple[List[SpanPayload], List[Tuple[bytes, str]]]:
+    return decode_records(body, decode_spans, span_decoder.decode, "spans")
+
+
+def decode_observation_records(body: bytes) -> Tuple[List[ObservationPayload], List[Tuple[bytes, str]]]:
+    return decode_records(body, decode_observations, observation_decoder.decode, "observations")
+
+
+def raw_text(raw: msgspec.Raw) -> str:
+    return bytes(raw).decode()
+
+
+def raw_text_or_none(raw: msgspec.Raw) -> Optional[str]:
+    """
+    JSON text of a raw value, or None for null and empty/falsy values.
+    """
+    data = bytes(raw)
+    if data in _FALSY_JSON:
+        return None
+    return data.decode()
+
+
+def raw_string_or_text(raw: msgspec.Raw) -> Optional[str]:
+    """
+    Like raw_text_or_none, but a JSON string is returned as the string
+    itself (metadata_json may arrive either pre-serialised or as an object).
+    """
+    data = bytes(raw)
+    if data[:1] == b'"':
+        return msgspec.json.decode(data, type=str)
+    if data in _FALSY_JSON:
+        return None
+    return data.decode()
+
+
+MAX_UINT32 = 2 ** 32 - 1
+
+
+def token_counts(raw: msgspec.Raw) -> Tuple[int, int, int]:
+    """
+    (prompt, completion, total) tokens of a token_usage value, for the
+    UInt32 columns. Missing keys count as 0, and so does everything when the
+    value isn't a usage object, as with JSONExtractInt in the analytics
+    queries. Runs once per observation, hence the flat fast path.
+    """
+    if raw is NULL:
+        return 0, 0, 0
+    try:
+        usage = token_usage_decoder.decode(raw)
+    except msgspec.DecodeError:
+        return 0, 0, 0
+    prompt, completion, total = usage.prompt_tokens, usage.completion_tokens, usage.total_tokens
+    if 0 <= prompt <= MAX_UINT32 and 0 <= completion <= MAX_UINT32 and 0 <= total <= MAX_UINT32:
+        return prompt, completion, total
+    return tuple(min(max(value, 0), MAX_UINT32) for value in (prompt, completion, total))
+
+
+def raw_value(raw: msgspec.Raw) -> Any:
+    """
+    Fully decode a raw value; only for the rare paths that need the object.
+    """
+    return msgspec.json.decode(raw) if raw else None
@@ -0,0 +1,361 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Record layout: magic, payload length, crc32 of payload, then the payload
+# (zlib compressed JSON: {"table", "column_names", "columns", "token"})
+RECORD_MAGIC = b"OXS1"
+RECORD_HEADER = struct.Struct("<4sII")
+
+OPEN_SUFFIX = ".open"
+SEGMENT_SUFFIX = ".seg"
+# Upper bound on spool subdirectories, i.e. on worker processes sharing a root
+MAX_SPOOL_SLOTS = 64
+
+
+def _json_default(value: Any):
+    if isinstance(value, array):
+        return value.tolist()
+    # UUIDs; clickhouse_connect accepts their string form on insert
+    return str(value)
+
+
+def encode_record(
+    table: str, column_names: Sequence[str], columns: Sequence[Any], token: Optional[str] = None
+) -> bytes:
+    payload = zlib.compress(
+        json.dumps(
+            {"table": table, "column_names": list(column_names), "columns": list(columns), "token": token},
+            default=_json_default,
+        ).encode(),
+        1,
+    )
+    return RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Read every intact record of a segment file.
+
+    Returns the records and the number of corrupt ones. A checksum mismatch
+    or a torn write at the end of the file (crash mid-append) stops the read,
+    since nothing after it can be framed reliably.
+    """
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+
+    offset = 0
+    while offset < len(data):
+        header = data[offset:offset + RECORD_HEADER.size]
+        if len(header) < RECORD_HEADER.size:
+            return records, 1
+        magic, length, crc = RECORD_HEADER.unpack(header)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if magic != RECORD_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+            return records, 1
+        try:
+            records.append(json.loads(zlib.decompress(payload)))
+        except (zlib.error, ValueError):
+            return records, 1
+        offset = start + length
+    return records, 0
+
+
+class IngestSpool:
+    """
+    Append-only on-disk spool for rows that could not be written to
+    ClickHouse, either because inserts are failing or because the buffer is
+    producing batches faster than they can be flushed.
+
+    Records are appended to the open segment; segments are closed once they
+    reach `segment_max_bytes` (or when the replayer finds nothing else to do)
+    and a background task inserts closed segments back into ClickHouse, at
+    most `replay_concurrency` at a time. A segment is deleted once all of its
+    rows are written.
+
+    Each process claims its own subdirectory of `root` with an flock, so
+    several uvicorn workers can share one spool root, and a restarted worker
+    picks up whatever a previous one left behind.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        segment_max_bytes: int,
+        max_total_bytes: int,
+        replay_concurrency: int,
+        replay_interval_seconds: float,
+        fsync: bool = True,
+    ):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.replay_concurrency = replay_concurrency
+        self.replay_interval_seconds = replay_interval_seconds
+        self.fsync = fsync
+
+        self.directory: Optional[str] = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._open_file = None
+        self._open_path: Optional[str] = None
+        self._next_seq = 0
+        self._pending_bytes = 0
+        self._replayer: Optional[asyncio.Task] = None
+
+        self.spooled_rows = 0
+        self.replayed_rows = 0
+        self.rejected_rows = 0
+        self.corrupt_records = 0
+        self.last_replay_error: Optional[str] = None
+
+    def _claim_directory(self) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        for slot in range(MAX_SPOOL_SLOTS):
+            directory = os.path.join(self.root, f"worker-{slot}")
+            os.makedirs(directory, exist_ok=True)
+            lock_file = open(os.path.join(directory, "lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            self._lock_file = lock_file
+            return directory
+        raise RuntimeError(f"No free ingest spool slot under {self.root}")
+
+    def open(self):
+        """
+        Claim a spool directory and recover segments left by a previous run.
+        An `.open` segment from a crash is closed as-is; its torn tail, if
+        any, is detected by the record checksums on replay.
+        """
+        if self.directory is not None:
+            return
+        self.directory = self._claim_directory()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(OPEN_SUFFIX):
+                closed = path[: -len(OPEN_SUFFIX)] + SEGMENT_SUFFIX
+                os.replace(path, closed)
+                path = closed
+            if path.endswith(SEGMENT_SUFFIX):
+                self._pending_bytes += os.path.getsize(path)
+                self._next_seq = max(self._next_seq, self._segment_seq(path) + 1)
+        if self._pending_bytes:
+            logger.warning(
+                f"Ingest spool {self.directory} has {self._pending_bytes} bytes pending from a previous run"
+            )
+
+    @staticmethod
+    def _segment_seq(path: str) -> int:
+        name = os.path.basename(path)
+        return int(name.split(".")[0])
+
+    def _segment_path(self, seq: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{seq:012d}{suffix}")
+
+    def write(
+        self,
+        table: str,
+        column_names: Sequence[str],
+        columns: Sequence[Any],
+        num_rows: int,
+        token: Optional[str] = None,
+    ) -> bool:
+        """
+        Append one batch of rows, with the deduplication token it is to be
+        inserted under. Returns False (and counts the rows as rejected) when
+        the spool is at `max_total_bytes`. Blocking; call it from a worker
+        thread.
+        """
+        record = encode_record(table, column_names, columns, token)
+        with self._lock:
+            if self._pending_bytes + len(record) > self.max_total_bytes:
+                self.rejected_rows += num_rows
+                return False
+            if self._open_file is None:
+                self._open_path = self._segment_path(self._next_seq, OPEN_SUFFIX)
+                self._next_seq += 1
+                self._open_file = open(self._open_path, "ab")
+            self._open_file.write(record)
+            self._open_file.flush()
+            if self.fsync:
+                os.fsync(self._open_file.fileno())
+            self._pending_bytes += len(record)
+            self.spooled_rows += num_rows
+            if self._open_file.tell() >= self.segment_max_bytes:
+                self._close_segment()
+        return True
+
+    def _close_segment(self):
+        # Caller holds self._lock
+        if self._open_file is None:
+            return
+        self._open_file.close()
+        os.replace(self._open_path, self._open_path[: -len(OPEN_SUFFIX)] + SEGMENT_SUFFIX)
+        self._open_file = None
+        self._open_path = None
+
+    def close_segment(self):
+        with self._lock:
+            self._close_segment()
+
+    def closed_segments(self) -> List[str]:
+        if self.directory is None:
+            return []
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _remove_segment(self, path: str, size: int):
+        os.remove(path)
+        with self._lock:
+            self._pending_bytes -= size
+
+    def replay_segment(self, path: str, insert: Callable[[str, List[str], List[Any], Optional[str]], None]):
+        """
+        Insert every record of a closed segment. A record is inserted on its
+        own under its token, so ClickHouse skips it if it was already written
+        (by the insert that failed on our side, or by an earlier replay that
+        died before removing the segment); records without one, from older
+        segments, are merged per table. If an insert fails, the segment is
+        rewritten with only the records that are still pending. Blocking;
+        call it from a worker thread.
+        """
+        size = os.path.getsize(path)
+        records, corrupt = read_records(path)
+        if corrupt:
+            self.corrupt_records += corrupt
+            logger.error(f"Ingest spool segment {path} is damaged; replaying its first {len(records)} records")
+
+        groups: Dict[Tuple[str, Tuple[str, ...], Optional[str]], List[Dict[str, Any]]] = {}
+        for record in records:
+            key = (record["table"], tuple(record["column_names"]), record.get("token"))
+            groups.setdefault(key, []).append(record)
+
+        remaining = []
+        error = None
+        for (table, column_names, token), group in groups.items():
+            if error is not None:
+                remaining.extend(group)
+                continue
+            columns = [[] for _ in column_names]
+            for record in group:
+                for col, values in zip(columns, record["columns"]):
+                    col.extend(values)
+            try:
+                insert(table, list(column_names), columns, token)
+                self.replayed_rows += len(columns[0]) if columns else 0
+            except Exception as e:
+                error = e
+                remaining.extend(group)
+
+        if not remaining:
+            self._remove_segment(path, size)
+            return
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for record in remaining:
+                f.write(
+                    encode_record(record["table"], record["column_names"], record["columns"], record.get("token"))
+                )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._pending_bytes += os.path.getsize(path) - size
+        raise error
+
+    async def _run(self, insert: Callable[[str, List[str], List[Any], Optional[str]], None]):
+        semaphore = asyncio.Semaphore(self.replay_concurrency)
+        backoff = self.replay_interval_seconds
+
+        async def replay(path: str):
+            async with semaphore:
+                await asyncio.to_thread(self.replay_segment, path, insert)
+
+        while True:
+            await asyncio.sleep(backoff)
+            segments = self.closed_segments()
+            if not segments:
+                # Nothing closed yet; close the open segment so it drains too
+                if self._open_file is not None:
+                    await asyncio.to_thread(self.close_segment)
+                continue
+
+            results = await asyncio.gather(
+                *(replay(path) for path in segments), return_exceptions=True
+            )
+            failures = [r for r in results if isinstance(r, BaseException)]
+            if failures:
+                self.last_replay_error = str(failures[0])
+                backoff = min(backoff * 2, 60.0)
+                logger.warning(
+                    f"Ingest spool replay failed for {len(failures)} segment(s), retrying in {backoff:.1f}s: {failures[0]}"
+                )
+            else:
+                self.last_replay_error = None
+                backoff = self.replay_interval_seconds
+                logger.info(f"Ingest spool replayed {len(segments)} segment(s)")
+
+    def start(self, insert: Callable[[str, List[str], List[Any], Optional[str]], None]):
+        self.open()
+        if self._replayer is None:
+            self._replayer = asyncio.create_task(self._run(insert))
+
+    async def stop(self):
+        """
+        Stop replaying and close the open segment. Pending segments stay on
+        disk and are replayed by the next process that claims this directory.
+        """
+        if self._replayer is not None:
+            self._replayer.cancel()
+            try:
+                await self._replayer
+            except asyncio.CancelledError:
+                pass
+            self._replayer = None
+        self.close_segment()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.directory = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "pending_bytes": self._pending_bytes,
+            "pending_segments": len(self.closed_segments()) + (1 if self._open_file is not None else 0),
+            "spooled_rows": self.spooled_rows,
+            "replayed_rows": self.replayed_rows,
+            "rejected_rows": self.rejected_rows,
+            "corrupt_records": self.corrupt_records,
+            "last_replay_error": self.last_replay_error,
+        }
+
+
+ingest_spool = IngestSpool(
+    root=settings.INGEST_SPOOL_DIR,
+    segment_max_bytes=settings.INGEST_SPOOL_SEGMENT_MAX_BYTES,
+    max_total_bytes=settings.INGEST_SPOOL_MAX_BYTES,
+    replay_concurrency=settings.INGEST_SPOOL_REPLAY_CONCURRENCY,
+    replay_interval_seconds=settings.INGEST_SPOOL_REPLAY_INTERVAL_SECONDS,
+    fsync=settings.INGEST_SPOOL_FSYNC,
+)
@@ -0,0 +1,123 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.cache import TTLCache
+from app.core.columnar import to_unix_nanos
+from app.core.config import settings
+from app.models.model_price import ModelPrice
+
+# (effective_from ns, USD per prompt token, USD per completion token)
+PriceVersion = Tuple[int, float, float]
+
+# Model names remembered per catalog; names come from clients, so bounded
+MAX_RESOLVED_MODELS = 1024
+
+
+class PriceCatalog:
+    """
+    Model prices of one project, detached from the session so it can be
+    cached and used while building an observation batch.
+    """
+
+    def __init__(self, prices: Dict[str, List[PriceVersion]]):
+        # lower-cased model -> versions sorted by effective_from
+        self._prices = prices
+        self._starts = {model: [v[0] for v in versions] for model, versions in prices.items()}
+        # lower-cased model -> catalog entry, for priced models only
+        self._resolved: Dict[str, str] = {}
+
+    def __len__(self):
+        return len(self._prices)
+
+    def _catalog_model(self, model: str) -> Optional[str]:
+        """
+        The catalog entry pricing `model`: the same name, or else the
+        longest entry it extends with a "-suffix" (gpt-4o-2024-08-06 is
+        priced as gpt-4o).
+        """
+        model = model.lower()
+        if model in self._prices:
+            return model
+        key = self._resolved.get(model)
+        if key is not None:
+            return key
+        candidates = [name for name in self._prices if model.startswith(name + "-")]
+        if not candidates:
+            return None
+        key = max(candidates, key=len)
+        if len(self._resolved) < MAX_RESOLVED_MODELS:
+            self._resolved[model] = key
+        return key
+
+    def cost(self, model: Optional[str], start_ns: int, prompt_tokens: int, completion_tokens: int, total_tokens: int) -> Optional[float]:
+        """
+        USD cost of an observation, or None when the model has no price in
+        effect at start_ns. Usage that only reports a total is charged at
+        the prompt price.
+        """
+        if not model or not self._prices:
+            return None
+        key = self._catalog_model(model)
+        if key is None:
+            return None
+        i = bisect.bisect_right(self._starts[key], start_ns) - 1
+        if i < 0:
+            return None
+        _, prompt_price, completion_price = self._prices[key][i]
+        if prompt_tokens or completion_tokens:
+            return prompt_tokens * prompt_price + completion_tokens * completion_price
+        return total_tokens * prompt_price
+
+
+EMPTY_CATALOG = PriceCatalog({})
+
+# project_id -> PriceCatalog. Edits invalidate the local worker at once,
+# others within the TTL.
+price_cache = TTLCache(
+    max_size=settings.MODEL_PRICE_CACHE_MAX_SIZE,
+    ttl_seconds=settings.MODEL_PRICE_CACHE_TTL_SECONDS,
+)
+
+
+async def get_price_catalog(session: AsyncSession, project_id) -> PriceCatalog:
+    key = str(project_id)
+    catalog = price_cache.get(key)
+    if catalog is not None:
+        return catalog
+
+    result = await session.execute(
+        select(ModelPrice).where(
+            (ModelPrice.project_id == project_id) | (ModelPrice.project_id == None)
+        )
+    )
+    defaults: Dict[str, List[PriceVersion]] = {}
+    own: Dict[str, List[PriceVersion]] = {}
+    for price in result.scalars().all():
+        target = defaults if price.project_id is None else own
+        target.setdefault(price.model.lower(), []).append(
+            (
+                to_unix_nanos(price.effective_from),
+                price.prompt_price_per_million / 1e6,
+                price.completion_price_per_million / 1e6,
+            )
+        )
+    prices = {**defaults, **own}
+    for versions in prices.values():
+        versions.sort()
+    catalog = PriceCatalog(prices) if prices else EMPTY_CATALOG
+    price_cache.set(key, catalog)
+    return catalog
+
+
+def invalidate_prices(project_id=None):
+    """
+    Forget the cached catalog of a project, or of every project when a
+    default (project_id None) price changed.
+    """
+    if project_id is None:
+        price_cache.delete_where(lambda key, value: True)
+    else:
+        price_cache.delete(str(project_id))
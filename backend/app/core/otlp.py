@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, Container, Dict, Optional
+
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest,
+)
+from opentelemetry.proto.common.v1.common_pb2 import AnyValue
+from opentelemetry.proto.trace.v1.trace_pb2 import Span, Status
+
+from app.core.clickhouse import trace_batch
+from app.core.columnar import ColumnarBatch
+
+# Same spellings the JSON ingest path receives from the SDK
+SPAN_KIND_NAMES = {
+    Span.SPAN_KIND_UNSPECIFIED: "INTERNAL",
+    Span.SPAN_KIND_INTERNAL: "INTERNAL",
+    Span.SPAN_KIND_SERVER: "SERVER",
+    Span.SPAN_KIND_CLIENT: "CLIENT",
+    Span.SPAN_KIND_PRODUCER: "PRODUCER",
+    Span.SPAN_KIND_CONSUMER: "CONSUMER",
+}
+
+STATUS_CODE_NAMES = {
+    Status.STATUS_CODE_UNSET: "UNSET",
+    Status.STATUS_CODE_OK: "OK",
+    Status.STATUS_CODE_ERROR: "ERROR",
+}
+
+
+def any_value_to_python(value: AnyValue) -> Any:
+    which = value.WhichOneof("value")
+    if which == "string_value":
+        return value.string_value
+    if which == "bool_value":
+        return value.bool_value
+    if which == "int_value":
+        return value.int_value
+    if which == "double_value":
+        return value.double_value
+    if which == "bytes_value":
+        return base64.b64encode(value.bytes_value).decode()
+    if which == "array_value":
+        return [any_value_to_python(v) for v in value.array_value.values]
+    if which == "kvlist_value":
+        return {kv.key: any_value_to_python(kv.value) for kv in value.kvlist_value.values}
+    return None
+
+
+def any_value_to_str(value: AnyValue) -> str:
+    """
+    Flatten an attribute value for the Map(String, String) columns.
+    Scalars keep their natural text form, containers are JSON encoded.
+    """
+    which = value.WhichOneof("value")
+    if which == "string_value":
+        return value.string_value
+    if which == "bool_value":
+        return "true" if value.bool_value else "false"
+    if which in ("int_value", "double_value"):
+        return str(getattr(value, which))
+    if which is None:
+        return ""
+    return json.dumps(any_value_to_python(value))
+
+
+def attributes_to_map(attributes) -> Dict[str, str]:
+    return {kv.key: any_value_to_str(kv.value) for kv in attributes}
+
+
+def _ns_to_datetime(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc)
+
+
+def decode_export_trace_request(
+    body: bytes, project_id, application_name: str, seen: Optional[Container] = None
+) -> ColumnarBatch:
+    """
+    Decode an OTLP ExportTraceServiceRequest into a batch for the traces table.
+
+    Resource attributes and instrumentation scope name, version and
+    attributes are merged into resource_attributes. Spans whose
+    (project_id, trace_id, span_id) is in `seen`, or repeats a span earlier
+    in the request, are skipped.
+    """
+    request = ExportTraceServiceRequest.FromString(body)
+    batch = trace_batch()
+    in_request = set()
+
+    for resource_spans in request.resource_spans:
+        resource_attrs = attributes_to_map(resource_spans.resource.attributes)
+
+        for scope_spans in resource_spans.scope_spans:
+            scope = scope_spans.scope
+            scope_attrs = dict(resource_attrs)
+            if scope.name:
+                scope_attrs["otel.scope.name"] = scope.name
+            if scope.version:
+                scope_attrs["otel.scope.version"] = scope.version
+            scope_attrs.update(attributes_to_map(scope.attributes))
+
+            for span in scope_spans.spans:
+                trace_id = span.trace_id.hex()
+                span_id = span.span_id.hex()
+                key = (project_id, trace_id, span_id)
+                if key in in_request or (seen is not None and key in seen):
+                    continue
+                in_request.add(key)
+
+                attributes = attributes_to_map(span.attributes)
+                events = [
+                    {
+                        "name": event.name,
+                        "timestamp": _ns_to_datetime(event.time_unix_nano).isoformat(),
+                        "attributes": attributes_to_map(event.attributes),
+                    }
+                    for event in span.events
+                ]
+                links = [
+                    {
+                        "trace_id": link.trace_id.hex(),
+                        "span_id": link.span_id.hex(),
+                        "attributes": attributes_to_map(link.attributes),
+                    }
+                    for link in span.links
+                ]
+
+                batch.append(
+                    trace_id,
+                    span_id,
+                    span.parent_span_id.hex() or None,
+                    span.name,
+                    SPAN_KIND_NAMES.get(span.kind, "INTERNAL"),
+                    span.start_time_unix_nano,
+                    span.end_time_unix_nano,
+                    STATUS_CODE_NAMES.get(span.status.code, "UNSET"),
+                    span.status.message,
+                    attributes,
+                    json.dumps(events),
+                    json.dumps(links),
+                    scope_attrs,
+                    (span.end_time_unix_nano - span.start_time_unix_nano) / 1e6,
+                    project_id,
+                    attributes.get("enduser.id", ""),
+                    application_name,
+                )
+
+    return batch
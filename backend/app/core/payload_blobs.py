@@ -0,0 +1,77 @@
+import hashlib
+from typing import Dict, Iterable, Optional, Tuple
+
+from clickhouse_connect.driver.client import Client
+
+from app.core.clickhouse import PAYLOAD_BLOB_TABLE, payload_blob_batch
+from app.core.config import settings
+from app.core.dedup import SeenSet
+from app.core.ingest_buffer import ingest_buffer
+
+# (project_id, hash) of blobs this worker wrote recently; a prompt resent
+# within the window isn't even buffered again
+blob_seen = SeenSet(settings.INGEST_DEDUP_WINDOW_SECONDS, settings.INGEST_DEDUP_MAX_ENTRIES)
+
+
+def payload_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PayloadBlobs:
+    """
+    Large texts met while building an observation batch. Each distinct
+    text is queued once for the payload_blobs table; the observation keeps
+    a preview and the text's hash as its reference.
+    """
+
+    def __init__(self):
+        self.batch = payload_blob_batch()
+        self._pending = set()
+
+    def preview(self, text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        (text to keep on the observation row, blob reference or None).
+        Nothing is queued until `store` is called with the reference.
+        """
+        if text is None or len(text) <= settings.PAYLOAD_BLOB_MIN_CHARS or not settings.PAYLOAD_BLOBS_ENABLED:
+            return text, None
+        return text[:settings.PAYLOAD_PREVIEW_CHARS], payload_hash(text.encode())
+
+    def store(self, project_id, ref: Optional[str], text: Optional[str]):
+        """
+        Queue the full text behind a reference returned by `preview`, once
+        the row pointing at it has been kept.
+        """
+        if ref is None:
+            return
+        key = (project_id, ref)
+        if key not in self._pending and key not in blob_seen:
+            self._pending.add(key)
+            self.batch.append(project_id, ref, text, len(text.encode()))
+
+    async def flush(self):
+        """
+        Queue the blobs for insertion; called before the observations that
+        reference them are queued.
+        """
+        await ingest_buffer.add(PAYLOAD_BLOB_TABLE, self.batch)
+        blob_seen.add_many(self._pending)
+        self.batch.reset()
+        self._pending = set()
+
+
+def resolve_payload_refs(client: Client, project_id, refs: Iterable[str]) -> Dict[str, str]:
+    """
+    Full texts for the given references of one project, by reference.
+    A blob still sitting in an ingest buffer is simply missing here, in
+    which case callers fall back to the preview.
+    """
+    refs = list(set(refs))
+    if not refs:
+        return {}
+    result = client.query(
+        f"SELECT hash, any(content) FROM {PAYLOAD_BLOB_TABLE} "
+        "WHERE project_id = {project_id:UUID} AND hash IN {refs:Array(String)} GROUP BY hash",
+        parameters={"project_id": project_id, "refs": refs},
+    )
+    return dict(result.result_rows)
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.core.api_key_cache import ResolvedApiKey
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import engine
+from app.models.project_usage import ProjectUsage
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills at `rate` tokens per second up to `burst`.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` tokens can be taken, 0 if they can be now.
+        A request larger than the whole burst is let through once the bucket
+        is full (the bucket then goes into debt), otherwise it could never pass.
+        """
+        needed = min(amount, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class IngestRateLimiter:
+    """
+    Token buckets for ingest volume, in spans/s and bytes/s, kept per API key
+    and per project. A request is admitted only if every bucket it touches
+    has room, and is then charged to all of them.
+
+    Buckets live in this process only, so with N workers the effective
+    limits are up to N times the configured ones. A rate of 0 disables
+    that bucket. Idle buckets are evicted after `burst_seconds`, by which
+    time they would have refilled anyway.
+    """
+
+    def __init__(
+        self,
+        key_spans_per_second: float,
+        key_bytes_per_second: float,
+        project_spans_per_second: float,
+        project_bytes_per_second: float,
+        burst_seconds: float,
+        max_buckets: int = 100000,
+    ):
+        self.limits = {
+            "key_spans": key_spans_per_second,
+            "key_bytes": key_bytes_per_second,
+            "project_spans": project_spans_per_second,
+            "project_bytes": project_bytes_per_second,
+        }
+        self.burst_seconds = burst_seconds
+        self._buckets = TTLCache(max_size=max_buckets, ttl_seconds=burst_seconds)
+        self.admitted_requests = 0
+        self.rejected_requests = 0
+
+    def _bucket(self, kind: str, owner: uuid.UUID, now: float) -> Optional[TokenBucket]:
+        rate = self.limits[kind]
+        if not rate:
+            return None
+        key = (kind, owner)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, rate * self.burst_seconds, now)
+        else:
+            bucket.refill(now)
+        # Re-set on every use so the idle TTL is measured from the last request
+        self._buckets.set(key, bucket)
+        return bucket
+
+    def _charges(
+        self, api_key: ResolvedApiKey, spans: int, nbytes: int, now: float
+    ) -> List[Tuple[TokenBucket, float]]:
+        charges = []
+        for kind, owner, amount in (
+            ("key_spans", api_key.api_key_id, spans),
+            ("key_bytes", api_key.api_key_id, nbytes),
+            ("project_spans", api_key.project_id, spans),
+            ("project_bytes", api_key.project_id, nbytes),
+        ):
+            bucket = self._bucket(kind, owner, now)
+            if bucket is not None:
+                charges.append((bucket, amount))
+        return charges
+
+    def check(self, api_key: ResolvedApiKey, spans: int, nbytes: int) -> float:
+        """
+        Admit and charge a request, or return how many seconds the caller
+        should wait before retrying (without charging anything).
+        """
+        charges = self._charges(api_key, spans, nbytes, time.monotonic())
+        retry_after = max((bucket.wait_time(amount) for bucket, amount in charges), default=0.0)
+        if retry_after > 0:
+            self.rejected_requests += 1
+            return retry_after
+
+        for bucket, amount in charges:
+            bucket.take(amount)
+        self.admitted_requests += 1
+        return 0.0
+
+    def precheck(self, api_key: ResolvedApiKey, nbytes: int) -> float:
+        """
+        Like check, for a request whose body hasn't been read yet: `nbytes`
+        is its Content-Length (a lower bound of what it is charged), and its
+        span count is unknown, so only a spans bucket in debt turns it away.
+        Charges nothing; the request goes through check once decoded.
+        """
+        charges = self._charges(api_key, 0, nbytes, time.monotonic())
+        retry_after = max((bucket.wait_time(amount) for bucket, amount in charges), default=0.0)
+        if retry_after > 0:
+            self.rejected_requests += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buckets": len(self._buckets),
+            "admitted_requests": self.admitted_requests,
+            "rejected_requests": self.rejected_requests,
+        }
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def seconds_until_utc_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return (midnight - now).total_seconds()
+
+
+class ProjectUsageCounter:
+    """
+    Daily ingested volume per project, persisted in the `projectusage` table.
+
+    Counts are accumulated in memory and added to Postgres every
+    `sync_interval_seconds`; the upsert returns the project's total across
+    all workers, which is what the quota is checked against. A worker can
+    therefore overshoot the quota by at most one sync interval's worth of
+    traffic. A quota of 0 means unlimited (usage is still counted).
+    """
+
+    def __init__(self, daily_span_quota: int, sync_interval_seconds: float):
+        self.daily_span_quota = daily_span_quota
+        self.sync_interval_seconds = sync_interval_seconds
+        # (project_id, day) -> [spans, bytes] not yet written to Postgres
+        self._pending: Dict[Tuple[uuid.UUID, date], list] = {}
+        # Counts being written by a sync that hasn't returned yet
+        self._in_flight: Dict[Tuple[uuid.UUID, date], list] = {}
+        # project_id -> (day, span total in Postgres as of the last sync)
+        self._synced: Dict[uuid.UUID, Tuple[date, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def used_today(self, project_id: uuid.UUID) -> int:
+        today = utc_today()
+        synced_day, synced = self._synced.get(project_id, (today, 0))
+        used = synced if synced_day == today else 0
+        for counts in (self._pending, self._in_flight):
+            pending = counts.get((project_id, today))
+            if pending:
+                used += pending[0]
+        return used
+
+    def quota_exceeded(self, project_id: uuid.UUID) -> bool:
+        return bool(self.daily_span_quota) and self.used_today(project_id) >= self.daily_span_quota
+
+    def record(self, project_id: uuid.UUID, spans: int, nbytes: int):
+        self._add_pending((project_id, utc_today()), spans, nbytes)
+
+    def _add_pending(self, key: Tuple[uuid.UUID, date], spans: int, nbytes: int):
+        counts = self._pending.setdefault(key, [0, 0])
+        counts[0] += spans
+        counts[1] += nbytes
+
+    async def sync(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._in_flight = pending
+
+        table = ProjectUsage.__table__
+        async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        try:
+            async with async_session() as session:
+                totals = {}
+                for (project_id, day), (spans, nbytes) in pending.items():
+                    stmt = pg_insert(table).values(
+                        project_id=project_id, day=day, span_count=spans, byte_count=nbytes
+                    )
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.project_id, table.c.day],
+                        set_={
+                            "span_count": table.c.span_count + stmt.excluded.span_count,
+                            "byte_count": table.c.byte_count + stmt.excluded.byte_count,
+                        },
+                    ).returning(table.c.span_count)
+                    result = await session.execute(stmt)
+                    totals[(project_id, day)] = result.scalar_one()
+                await session.commit()
+        except Exception as e:
+            # Put the counts back so they are written on the next attempt
+            for key, (spans, nbytes) in pending.items():
+                self._add_pending(key, spans, nbytes)
+            logger.error(f"Failed to sync project usage: {e}")
+            return
+        finally:
+            self._in_flight = {}
+
+        for (project_id, day), total in totals.items():
+            self._synced[project_id] = (day, total)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval_seconds)
+            await self.sync()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync()
+
+
+ingest_rate_limiter = IngestRateLimiter(
+    key_spans_per_second=settings.INGEST_KEY_SPANS_PER_SECOND,
+    key_bytes_per_second=settings.INGEST_KEY_BYTES_PER_SECOND,
+    project_spans_per_second=settings.INGEST_PROJECT_SPANS_PER_SECOND,
+    project_bytes_per_second=settings.INGEST_PROJECT_BYTES_PER_SECOND,
+    burst_seconds=settings.INGEST_RATE_LIMIT_BURST_SECONDS,
+)
+
+project_usage = ProjectUsageCounter(
+    daily_span_quota=settings.INGEST_PROJECT_DAILY_SPAN_QUOTA,
+    sync_interval_seconds=settings.PROJECT_USAGE_SYNC_INTERVAL_SECONDS,
+)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+
+from app.core.clickhouse import RETENTION_TABLES, clickhouse_manager
+from app.core.config import settings
+from app.core.database import engine
+from app.models.all_models import Project
+from app.models.project_retention import ProjectRetention
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions (see partition_by) ending before the cutoff. Tables
+# created before they were partitioned only have the "tuple()" partition,
+# which never matches, and rely on the deletes below.
+EXPIRED_PARTITIONS_QUERY = """
+SELECT DISTINCT partition_id
+FROM system.parts
+WHERE database = currentDatabase() AND table = {table:String} AND active
+  AND match(partition, '^[0-9]+$')
+  AND addMonths(makeDate(intDiv(toUInt32(partition), 100), toUInt32(partition) % 100, 1), 1)
+      <= toDate(toDateTime({cutoff:UInt32}))
+"""
+
+
+async def load_retention_days() -> Dict[uuid.UUID, int]:
+    """
+    Retention of every project in days, 0 meaning forever.
+    """
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with async_session() as session:
+        result = await session.execute(
+            select(Project.id, ProjectRetention.retention_days).outerjoin(
+                ProjectRetention, ProjectRetention.project_id == Project.id
+            )
+        )
+        return {
+            project_id: settings.DATA_RETENTION_DAYS if days is None else days
+            for project_id, days in result.all()
+        }
+
+
+def enforce_retention(retention_days: Dict[uuid.UUID, int], now: Optional[float] = None) -> Dict[str, int]:
+    """
+    Remove the rows that are past their project's retention.
+
+    A monthly partition is dropped once it's past the retention of every
+    project, which is a metadata operation. Rows of projects that keep data
+    for less than that are removed with lightweight deletes, only issued
+    when the project has such rows.
+    """
+    now = time.time() if now is None else now
+    counts = {"dropped_partitions": 0, "deletes": 0}
+
+    cutoffs = {
+        project_id: int(now - days * 86400)
+        for project_id, days in retention_days.items()
+        if days > 0
+    }
+    if not cutoffs:
+        return counts
+    # A partition can only go once no project keeps it. Data of projects
+    # deleted from Postgres doesn't hold partitions back.
+    partition_cutoff = None
+    if len(cutoffs) == len(retention_days):
+        partition_cutoff = min(cutoffs.values())
+
+    for table, (_, expired) in RETENTION_TABLES.items():
+        if partition_cutoff is not None:
+            result = clickhouse_manager.query(
+                EXPIRED_PARTITIONS_QUERY,
+                parameters={"table": table, "cutoff": partition_cutoff},
+            )
+            for (partition_id,) in result.result_rows:
+                clickhouse_manager.command(f"ALTER TABLE {table} DROP PARTITION ID '{partition_id}'")
+                counts["dropped_partitions"] += 1
+                logger.info(f"Dropped expired partition {partition_id} of {table}")
+
+        condition = f"project_id = {{project_id:UUID}} AND {expired}"
+        for project_id, cutoff in cutoffs.items():
+            parameters = {"project_id": project_id, "cutoff": cutoff}
+            result = clickhouse_manager.query(
+                f"SELECT 1 FROM {table} WHERE {condition} LIMIT 1", parameters=parameters
+            )
+            if result.result_rows:
+                clickhouse_manager.command(f"DELETE FROM {table} WHERE {condition}", parameters=parameters)
+                counts["deletes"] += 1
+    return counts
+
+
+class RetentionJob:
+    """
+    Periodically enforces project retention from the API process. Every
+    step is idempotent, so several processes running it only repeat the
+    existence checks. An interval of 0 disables it.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[str, int]:
+        retention_days = await load_retention_days()
+        return await asyncio.to_thread(enforce_retention, retention_days)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                counts = await self.run_once()
+                if any(counts.values()):
+                    logger.info(f"Retention enforced: {counts}")
+            except Exception as e:
+                logger.error(f"Failed to enforce data retention: {e}")
+
+    def start(self):
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+retention_job = RetentionJob(interval_seconds=settings.DATA_RETENTION_INTERVAL_SECONDS)
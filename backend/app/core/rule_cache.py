@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.evaluation_rule import EvaluationRule
+
+
+@dataclass(frozen=True)
+class ActiveRule:
+    """
+    The parts of an EvaluationRule the ingest path needs to queue jobs,
+    detached from the session so it can be cached.
+    """
+
+    id: int
+    percentage: float
+
+
+# application_id (as stored on EvaluationRule) -> tuple of ActiveRule.
+# Applications without rules are cached as an empty tuple, which is what
+# lets ingest skip evaluation without a query.
+rule_cache = TTLCache(
+    max_size=settings.RULE_CACHE_MAX_SIZE,
+    ttl_seconds=settings.RULE_CACHE_TTL_SECONDS,
+)
+
+
+async def get_active_rules(session: AsyncSession, application_id) -> Tuple[ActiveRule, ...]:
+    key = str(application_id)
+    rules = rule_cache.get(key)
+    if rules is not None:
+        return rules
+
+    result = await session.execute(
+        select(EvaluationRule.id, EvaluationRule.percentage)
+        .where(EvaluationRule.application_id == key)
+        .where(EvaluationRule.active == True)
+    )
+    rules = tuple(ActiveRule(id=row.id, percentage=row.percentage) for row in result.all())
+    rule_cache.set(key, rules)
+    return rules
+
+
+def invalidate_rules(application_id):
+    rule_cache.delete(str(application_id))
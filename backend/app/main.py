@@ -4,7 +4,10 @@ from app.core.database import init_db
 from app.core.config import settings
 
 from app.api.v1.api import api_router
-from app.core.clickhouse import init_clickhouse
+from app.core.clickhouse import init_clickhouse, clickhouse_manager
+from app.core.ingest_buffer import ingest_buffer
+from app.core.rate_limit import project_usage
+from app.core.retention import retention_job
 from fastapi.middleware.cors import CORSMiddleware
 
 
@@ -12,7 +15,15 @@ from fastapi.middleware.cors import CORSMiddleware
 async def lifespan(app: FastAPI):
     await init_db()
     init_clickhouse()
+    ingest_buffer.start()
+    project_usage.start()
+    retention_job.start()
     yield
+    await retention_job.stop()
+    await project_usage.stop()
+    # Flush rows still buffered in memory before the process exits
+    await ingest_buffer.drain()
+    clickhouse_manager.reset()
 
 
 app = FastAPI(
@@ -35,7 +46,10 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "clickhouse": "ok" if clickhouse_manager.check_health() else "unavailable",
+    }
 
 
 if __name__ == "__main__":
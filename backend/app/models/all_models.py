@@ -7,6 +7,10 @@ from app.models.metric import Metric
 from app.models.evaluation_result import EvaluationResult
 from app.models.llm_provider import LLMProvider
 from app.models.evaluation_rule import EvaluationRule
+from app.models.project_usage import ProjectUsage
+from app.models.evaluation_job import EvaluationJob
+from app.models.model_price import ModelPrice
+from app.models.project_retention import ProjectRetention
 
 
 class Role(SQLModel, table=True):
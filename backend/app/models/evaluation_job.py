@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import Column, Index, JSON
+from sqlmodel import SQLModel, Field
+
+
+class EvaluationJob(SQLModel, table=True):
+    """
+    A queued run of one evaluation rule against one observation, created at
+    ingest and executed by app/workers/evaluation_worker.py.
+    """
+
+    __table_args__ = (
+        # Serves the claim query: pending jobs by due time, expired leases
+        Index("ix_evaluationjob_status_available_at", "status", "available_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    rule_id: int
+    trace_data: Dict = Field(default={}, sa_column=Column(JSON))
+
+    status: str = Field(default="PENDING")  # PENDING, RUNNING, FAILED
+    attempts: int = 0
+    max_attempts: int = 3
+    # Not claimable before this time (set on retry to back off)
+    available_at: datetime = Field(default_factory=datetime.utcnow)
+    # Lease held by the worker running the job; once it expires the job
+    # is claimable again
+    locked_by: Optional[str] = None
+    locked_until: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
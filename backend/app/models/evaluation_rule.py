@@ -16,5 +16,5 @@ class EvaluationRule(SQLModel, table=True):
     active: bool = Field(default=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
-    # Sampling (0.0 to 1.0) - optional for later
+    # Percentage of traces (0-100) evaluated, sampled on a hash of trace_id
     percentage: float = 100.0 
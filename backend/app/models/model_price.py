@@ -0,0 +1,23 @@
+from typing import Optional
+from datetime import datetime
+import uuid
+from sqlmodel import SQLModel, Field
+
+
+class ModelPrice(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    # None: default price for every project. A project's own rows for a
+    # model replace the defaults for that model.
+    project_id: Optional[uuid.UUID] = Field(default=None, index=True)
+    # As reported on observations, e.g. gpt-4o; also prices dated
+    # variants such as gpt-4o-2024-08-06 unless they have their own rows
+    model: str = Field(index=True)
+
+    # USD per million tokens
+    prompt_price_per_million: float = 0.0
+    completion_price_per_million: float = 0.0
+
+    # Price changes are new rows; an observation is priced with the row in
+    # effect at its start_time (UTC)
+    effective_from: datetime = Field(default=datetime(1970, 1, 1))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,15 @@
+import uuid
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+
+class ProjectRetention(SQLModel, table=True):
+    """
+    How long a project's traces are kept, overriding DATA_RETENTION_DAYS.
+    """
+
+    project_id: uuid.UUID = Field(primary_key=True)
+    # 0 keeps them forever
+    retention_days: int
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
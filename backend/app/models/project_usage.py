@@ -0,0 +1,15 @@
+import uuid
+from datetime import date
+
+from sqlmodel import SQLModel, Field
+
+
+class ProjectUsage(SQLModel, table=True):
+    """
+    Ingested volume per project per UTC day, used for the daily ingest quota.
+    """
+
+    project_id: uuid.UUID = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    span_count: int = 0
+    byte_count: int = 0
@@ -0,0 +1,121 @@
+"""
+Runs queued evaluation jobs (see app/core/evaluation_queue.py) outside the
+API processes.
+
+    python -m app.workers.evaluation_worker
+
+Several workers can run side by side; jobs are claimed with SKIP LOCKED and
+leased for EVALUATION_JOB_VISIBILITY_TIMEOUT_SECONDS, after which a job left
+behind by a crashed worker is picked up again.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from typing import Set
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.evaluation_queue import (
+    claim_evaluation_jobs,
+    complete_evaluation_job,
+    fail_evaluation_job,
+)
+from app.core.evaluation_runner import run_triggered_evaluation
+
+logger = logging.getLogger(__name__)
+
+# A run is cancelled this long before its lease expires, so its failure is
+# recorded before another worker can claim the job
+LEASE_MARGIN_SECONDS = 30.0
+
+
+class EvaluationWorker:
+    def __init__(self, concurrency: int, poll_interval_seconds: float):
+        self.concurrency = concurrency
+        self.poll_interval_seconds = poll_interval_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        self.run_timeout = max(
+            settings.EVALUATION_JOB_VISIBILITY_TIMEOUT_SECONDS - LEASE_MARGIN_SECONDS,
+            settings.EVALUATION_JOB_VISIBILITY_TIMEOUT_SECONDS / 2,
+        )
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    async def run_job(self, job):
+        try:
+            await asyncio.wait_for(
+                run_triggered_evaluation(
+                    job.rule_id,
+                    job.trace_data,
+                    # A retry reuses the results the earlier attempts recorded
+                    since=job.created_at if job.attempts > 1 else None,
+                ),
+                timeout=self.run_timeout,
+            )
+        except Exception as e:
+            error = "Timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+            logger.error(f"Evaluation job {job.id} (attempt {job.attempts}/{job.max_attempts}) failed: {error}")
+            async with self.async_session() as session:
+                await fail_evaluation_job(
+                    session, job.id, self.worker_id, job.attempts, job.max_attempts, error
+                )
+            return
+
+        async with self.async_session() as session:
+            await complete_evaluation_job(session, job.id, self.worker_id)
+
+    async def run(self):
+        logger.info(f"Evaluation worker {self.worker_id} started (concurrency {self.concurrency})")
+        while not self._stopping.is_set():
+            free = self.concurrency - len(self._running)
+            jobs = []
+            if free > 0:
+                try:
+                    async with self.async_session() as session:
+                        jobs = await claim_evaluation_jobs(session, self.worker_id, free)
+                except Exception as e:
+                    logger.error(f"Failed to claim evaluation jobs: {e}")
+
+            for job in jobs:
+                task = asyncio.create_task(self.run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            # Poll again right away while there is more work and free capacity
+            if jobs and len(jobs) == free:
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        if self._running:
+            logger.info(f"Waiting for {len(self._running)} running evaluation jobs")
+            await asyncio.gather(*self._running, return_exceptions=True)
+        logger.info(f"Evaluation worker {self.worker_id} stopped")
+
+    def stop(self):
+        self._stopping.set()
+
+
+async def main():
+    worker = EvaluationWorker(
+        concurrency=settings.EVALUATION_WORKER_CONCURRENCY,
+        poll_interval_seconds=settings.EVALUATION_WORKER_POLL_INTERVAL_SECONDS,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await worker.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
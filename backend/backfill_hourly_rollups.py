@@ -0,0 +1,95 @@
+"""
+Fill the hourly dashboard rollups from the traces and observations rows
+that were ingested before their materialized views existed.
+
+    uv run python backfill_hourly_rollups.py [--until "2025-01-01 00:00:00"] [--replace]
+
+Rebuilds every hour before --until (default: the hour the views were
+created in) from the raw rows. Spans that started in those hours but
+arrived later were already rolled up by the views, so the script refuses
+to run while the rollups hold rows for those hours; with --replace it
+deletes them first and recomputes the hours as a whole, so nothing is
+counted twice and a rerun gives the same result. Use --replace with a later
+--until to rebuild rollups written by older views. Spans arriving for a
+rebuilt hour while it is being recomputed may be counted twice. Runs one
+project at a time to keep the GROUP BY small.
+"""
+import argparse
+
+from app.core.clickhouse import HOURLY_ROLLUPS, get_clickhouse_client, init_clickhouse
+
+# Hours before --until, on the raw rows and on the rollups
+RAW_BEFORE = "start_time < toStartOfHour(toDateTime({until:String}))"
+ROLLUP_BEFORE = "hour < toStartOfHour(toDateTime({until:String}))"
+
+
+def views_created_at(client) -> str:
+    result = client.query(
+        "SELECT min(metadata_modification_time) FROM system.tables "
+        "WHERE database = currentDatabase() AND name IN {names:Array(String)}",
+        parameters={
+            "names": [
+                f"{table}_{source}_mv"
+                for table, sources in HOURLY_ROLLUPS.items()
+                for source in sources
+            ]
+        },
+    )
+    return str(result.result_rows[0][0])
+
+
+def backfill(until: str, replace: bool):
+    client = get_clickhouse_client()
+    filled = [
+        table
+        for table in HOURLY_ROLLUPS
+        if client.query(
+            f"SELECT 1 FROM {table} WHERE {ROLLUP_BEFORE} LIMIT 1", parameters={"until": until}
+        ).result_rows
+    ]
+    if filled and not replace:
+        raise SystemExit(
+            f"{', '.join(filled)} already hold rows for hours before {until}; "
+            "run with --replace to rebuild those hours."
+        )
+
+    projects = [
+        row[0]
+        for row in client.query(
+            "SELECT DISTINCT project_id FROM traces "
+            "UNION DISTINCT SELECT DISTINCT project_id FROM observations"
+        ).result_rows
+    ]
+    print(f"Backfilling {', '.join(HOURLY_ROLLUPS)} for {len(projects)} projects (hours before {until})")
+    where = f"AND project_id = {{project_id:UUID}} AND {RAW_BEFORE}"
+    inserts = []
+    for table, sources in HOURLY_ROLLUPS.items():
+        for select in sources.values():
+            # INSERT ... SELECT matches columns by position, views match by name
+            columns = [row[0] for row in client.query(f"DESCRIBE ({select.format(where='')})").result_rows]
+            inserts.append(f"INSERT INTO {table} ({', '.join(columns)}) {select.format(where=where)}")
+    for i, project_id in enumerate(projects, 1):
+        parameters = {"project_id": project_id, "until": until}
+        if filled:
+            for table in HOURLY_ROLLUPS:
+                client.command(
+                    f"DELETE FROM {table} WHERE project_id = {{project_id:UUID}} AND {ROLLUP_BEFORE}",
+                    parameters=parameters,
+                )
+        for insert in inserts:
+            client.command(insert, parameters=parameters)
+        print(f"[{i}/{len(projects)}] {project_id}")
+    print("Backfill complete.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--until", help="Rebuild the hours before this time (server time zone)")
+    parser.add_argument(
+        "--replace", action="store_true", help="Delete rollup rows for those hours before rebuilding them"
+    )
+    args = parser.parse_args()
+
+    # Makes sure the tables and views exist
+    init_clickhouse()
+    backfill(args.until or views_created_at(get_clickhouse_client()), args.replace)
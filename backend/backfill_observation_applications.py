@@ -0,0 +1,116 @@
+"""
+Fill application_id and application_name of observations ingested before
+the ingest path wrote them.
+
+    uv run python backfill_observation_applications.py
+
+The application name is taken from the trace's spans in the traces table
+and mapped to its id through the Postgres application table. Observations
+whose trace has no spans keep an empty name and a NULL id. Runs as a
+single ClickHouse mutation and polls system.mutations until it is done;
+the lookup tables it reads are only dropped after that, or after the
+mutation was killed because it failed or the script was interrupted.
+"""
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from app.core.clickhouse import get_clickhouse_client, init_clickhouse
+from app.core.database import engine
+from app.models.all_models import Application
+
+# Join engine tables the mutation looks names and ids up in, dropped after
+TRACE_APPS = "backfill_trace_applications"
+APP_IDS = "backfill_application_ids"
+POLL_SECONDS = 10
+
+# The backfill's mutation, recognised by the lookup table it reads
+MUTATION_FILTER = f"database = currentDatabase() AND table = 'observations' AND command LIKE '%{TRACE_APPS}%'"
+
+
+async def load_applications():
+    async with engine.connect() as conn:
+        result = await conn.execute(select(Application.project_id, Application.name, Application.id))
+        return [tuple(row) for row in result.all()]
+
+
+def drop_lookup_tables(client):
+    for table in (TRACE_APPS, APP_IDS):
+        client.command(f"DROP TABLE IF EXISTS {table}")
+
+
+def wait_for_mutation(client):
+    while True:
+        rows = client.query(
+            "SELECT is_done, parts_to_do, latest_fail_reason FROM system.mutations "
+            f"WHERE {MUTATION_FILTER} AND NOT is_killed ORDER BY create_time DESC LIMIT 1"
+        ).result_rows
+        if not rows:
+            raise SystemExit("The backfill mutation is missing from system.mutations.")
+        is_done, parts_to_do, fail_reason = rows[0]
+        if is_done:
+            return
+        if fail_reason:
+            raise SystemExit(f"The backfill mutation failed: {fail_reason}")
+        print(f"{parts_to_do} parts left to update")
+        time.sleep(POLL_SECONDS)
+
+
+def backfill(applications):
+    client = get_clickhouse_client()
+    drop_lookup_tables(client)
+
+    client.command(f"""
+    CREATE TABLE {TRACE_APPS} (project_id UUID, trace_id String, application_name String)
+    ENGINE = Join(ANY, LEFT, project_id, trace_id)
+    """)
+    client.command(f"""
+    INSERT INTO {TRACE_APPS}
+    SELECT project_id, trace_id, any(application_name)
+    FROM traces
+    WHERE application_name != ''
+      AND (project_id, trace_id) IN (
+        SELECT DISTINCT project_id, trace_id FROM observations WHERE ifNull(application_name, '') = ''
+      )
+    GROUP BY project_id, trace_id
+    """)
+    client.command(f"""
+    CREATE TABLE {APP_IDS} (project_id UUID, application_name String, application_id UUID)
+    ENGINE = Join(ANY, LEFT, project_id, application_name)
+    """)
+    if applications:
+        client.insert(APP_IDS, applications, column_names=["project_id", "application_name", "application_id"])
+    print(f"Loaded {len(applications)} applications")
+
+    # Mutations run without a default database, so the lookups are qualified
+    database = client.query("SELECT currentDatabase()").result_rows[0][0]
+    trace_app = f"joinGet('{database}.{TRACE_APPS}', 'application_name', project_id, trace_id)"
+    try:
+        client.command(
+            f"""
+            ALTER TABLE observations UPDATE
+                application_name = {trace_app},
+                application_id = nullIf(
+                    joinGet('{database}.{APP_IDS}', 'application_id', project_id, {trace_app}),
+                    toUUID('00000000-0000-0000-0000-000000000000')
+                )
+            WHERE ifNull(application_name, '') = ''
+            """,
+            settings={"mutations_sync": 0, "allow_nondeterministic_mutations": 1},
+        )
+        wait_for_mutation(client)
+    except BaseException:
+        # A mutation left running would fail on every remaining part once
+        # its lookup tables are gone, and hold back later mutations
+        client.command(f"KILL MUTATION WHERE {MUTATION_FILTER}")
+        raise
+    finally:
+        drop_lookup_tables(client)
+    print("Backfill complete.")
+
+
+if __name__ == "__main__":
+    # Adds the columns if this server hasn't started since they were introduced
+    init_clickhouse()
+    backfill(asyncio.run(load_applications()))
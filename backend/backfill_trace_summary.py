@@ -0,0 +1,90 @@
+"""
+Fill trace_summary from the traces and observations rows that were
+ingested before its materialized views existed.
+
+    uv run python backfill_trace_summary.py [--until "2025-01-01 00:00:00"] [--replace]
+
+Rebuilds every day before --until (default: the day the views were
+created on) from the raw rows. Spans that started on those days but
+arrived later were already summarised by the views, so the script refuses
+to run while trace_summary holds rows for those days; with --replace it
+deletes them first and recomputes the days as a whole, so nothing is
+counted twice and a rerun gives the same result. Spans arriving for a
+rebuilt day while it is being recomputed may be counted twice. Runs one
+project at a time to keep the GROUP BY small.
+"""
+import argparse
+
+from app.core.clickhouse import (
+    TRACE_SUMMARY_FROM_OBSERVATIONS,
+    TRACE_SUMMARY_FROM_TRACES,
+    TRACE_SUMMARY_TABLE,
+    get_clickhouse_client,
+    init_clickhouse,
+)
+
+# Days before --until, on the raw rows and on trace_summary
+RAW_BEFORE = "start_time < toStartOfDay(toDateTime({until:String}))"
+SUMMARY_BEFORE = "day < toDate(toDateTime({until:String}))"
+
+
+def views_created_at(client) -> str:
+    result = client.query(
+        "SELECT min(metadata_modification_time) FROM system.tables "
+        "WHERE database = currentDatabase() AND name LIKE {pattern:String}",
+        parameters={"pattern": f"{TRACE_SUMMARY_TABLE}_%_mv"},
+    )
+    return str(result.result_rows[0][0])
+
+
+def backfill(until: str, replace: bool):
+    client = get_clickhouse_client()
+    filled = client.query(
+        f"SELECT 1 FROM {TRACE_SUMMARY_TABLE} WHERE {SUMMARY_BEFORE} LIMIT 1", parameters={"until": until}
+    ).result_rows
+    if filled and not replace:
+        raise SystemExit(
+            f"{TRACE_SUMMARY_TABLE} already holds rows for days before {until}; "
+            "run with --replace to rebuild those days."
+        )
+
+    projects = [
+        row[0]
+        for row in client.query(
+            "SELECT DISTINCT project_id FROM traces "
+            "UNION DISTINCT SELECT DISTINCT project_id FROM observations"
+        ).result_rows
+    ]
+    print(f"Backfilling {TRACE_SUMMARY_TABLE} for {len(projects)} projects (days before {until})")
+    where = f"AND project_id = {{project_id:UUID}} AND {RAW_BEFORE}"
+    inserts = []
+    for select in (TRACE_SUMMARY_FROM_TRACES, TRACE_SUMMARY_FROM_OBSERVATIONS):
+        # INSERT ... SELECT matches columns by position, views match by name
+        columns = [row[0] for row in client.query(f"DESCRIBE ({select.format(where='')})").result_rows]
+        inserts.append(
+            f"INSERT INTO {TRACE_SUMMARY_TABLE} ({', '.join(columns)}) {select.format(where=where)}"
+        )
+    for i, project_id in enumerate(projects, 1):
+        parameters = {"project_id": project_id, "until": until}
+        if filled:
+            client.command(
+                f"DELETE FROM {TRACE_SUMMARY_TABLE} WHERE project_id = {{project_id:UUID}} AND {SUMMARY_BEFORE}",
+                parameters=parameters,
+            )
+        for insert in inserts:
+            client.command(insert, parameters=parameters)
+        print(f"[{i}/{len(projects)}] {project_id}")
+    print("Backfill complete.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--until", help="Rebuild the days before this time (server time zone)")
+    parser.add_argument(
+        "--replace", action="store_true", help="Delete trace_summary rows for those days before rebuilding them"
+    )
+    args = parser.parse_args()
+
+    # Makes sure the table and views exist
+    init_clickhouse()
+    backfill(args.until or views_created_at(get_clickhouse_client()), args.replace)
@@ -0,0 +1,170 @@
+"""
+Per-span CPU cost of a traces insert on the ingest path, row-oriented (one
+list per span with datetime values) versus the ColumnarBatch path (typed
+arrays, nanosecond ticks, column_oriented=True), in three phases:
+
+  build      turning decoded spans into rows
+  buffer     what IngestBuffer.add does with them: size them for the flush
+             limits and copy them into the table buffer
+  serialize  clickhouse_connect's Native serializer, run in-process so no
+             server is needed; network time is excluded on purpose
+
+    uv run python benchmarks/bench_columnar_insert.py
+"""
+import gc
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from clickhouse_connect.datatypes.registry import get_from_name  # noqa: E402
+from clickhouse_connect.driver.insert import InsertContext  # noqa: E402
+from clickhouse_connect.driver.transform import NativeTransform  # noqa: E402
+
+from app.core.clickhouse import TRACE_COLUMNS, trace_batch  # noqa: E402
+from app.core.columnar import ColumnarBatch, to_unix_nanos  # noqa: E402
+
+TRACE_COLUMN_CH_TYPES = [
+    "String", "String", "Nullable(String)", "String", "String",
+    "DateTime64(9)", "DateTime64(9)", "String", "Nullable(String)",
+    "Map(String, String)", "String", "String", "Map(String, String)", "Float64",
+    "UUID", "Nullable(String)", "Nullable(String)",
+]
+BATCH_SIZES = [1_000, 10_000, 50_000]
+REPEATS = 5
+
+
+def make_spans(n: int):
+    spans = []
+    for i in range(n):
+        spans.append({
+            "trace_id": f"{i // 10:032x}",
+            "span_id": f"{i:016x}",
+            "parent_span_id": f"{i - 1:016x}" if i % 10 else None,
+            "name": f"step_{i % 7}",
+            "kind": "INTERNAL",
+            "start_time": "2025-01-01T12:00:00.123456Z",
+            "end_time": "2025-01-01T12:00:01.654321Z",
+            "status": {"code": "OK", "message": ""},
+            "attributes": {"enduser.id": "user-1", "llm.model": "gpt-4o"},
+            "events": [],
+            "links": [],
+            "resource": {"attributes": {"service.name": "agent"}},
+        })
+    return spans
+
+
+def serialize(columns_or_rows, column_oriented: bool):
+    ctx = InsertContext(
+        "traces",
+        TRACE_COLUMNS,
+        [get_from_name(t) for t in TRACE_COLUMN_CH_TYPES],
+        columns_or_rows,
+        column_oriented=column_oriented,
+        compression=None,
+    )
+    return sum(len(chunk) for chunk in NativeTransform.build_insert(ctx))
+
+
+def build_rows(spans, project_id):
+    data = []
+    for span in spans:
+        start_t = datetime.fromisoformat(span["start_time"].replace("Z", "+00:00"))
+        end_t = datetime.fromisoformat(span["end_time"].replace("Z", "+00:00"))
+        data.append([
+            span.get("trace_id"), span.get("span_id"), span.get("parent_span_id", ""),
+            span.get("name"), span.get("kind", "INTERNAL"), start_t, end_t,
+            span.get("status", {}).get("code", "UNSET"), span.get("status", {}).get("message", ""),
+            span.get("attributes", {}), json.dumps(span.get("events", [])), json.dumps(span.get("links", [])),
+            span.get("resource", {}).get("attributes", {}), (end_t - start_t).total_seconds() * 1000,
+            project_id, span.get("attributes", {}).get("enduser.id", ""), "bench",
+        ])
+    return data
+
+
+def estimate_row_size(row) -> int:
+    """
+    How the row-oriented ingest buffer sized every row it was given.
+    """
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                size += len(str(k)) + len(str(v))
+        else:
+            size += 8
+    return size
+
+
+def buffer_rows(rows, pending):
+    pending.clear()
+    pending.extend(rows)
+    return sum(estimate_row_size(row) for row in rows)
+
+
+def buffer_columns(batch: ColumnarBatch, pending: ColumnarBatch):
+    pending.reset()
+    pending.extend(batch)
+    return batch.estimate_size()
+
+
+def build_columns(spans, project_id, batch):
+    batch.reset()
+    for span in spans:
+        start_ns = to_unix_nanos(datetime.fromisoformat(span["start_time"].replace("Z", "+00:00")))
+        end_ns = to_unix_nanos(datetime.fromisoformat(span["end_time"].replace("Z", "+00:00")))
+        batch.append(
+            span.get("trace_id"), span.get("span_id"), span.get("parent_span_id", ""),
+            span.get("name"), span.get("kind", "INTERNAL"), start_ns, end_ns,
+            span.get("status", {}).get("code", "UNSET"), span.get("status", {}).get("message", ""),
+            span.get("attributes", {}), json.dumps(span.get("events", [])), json.dumps(span.get("links", [])),
+            span.get("resource", {}).get("attributes", {}), (end_ns - start_ns) / 1e6,
+            project_id, span.get("attributes", {}).get("enduser.id", ""), "bench",
+        )
+    return batch
+
+
+def best_of(fn, *args):
+    best = float("inf")
+    result = None
+    for _ in range(REPEATS):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    project_id = uuid.uuid4()
+    print("us/span         build   buffer  serialize   total")
+    for n in BATCH_SIZES:
+        spans = make_spans(n)
+        # Same builders reused across runs, as the ingest path does
+        batch = trace_batch(n)
+        pending = trace_batch(n)
+
+        build_before, rows = best_of(build_rows, spans, project_id)
+        buffer_before, _ = best_of(buffer_rows, rows, [])
+        ser_before, _ = best_of(serialize, rows, False)
+        build_after, batch = best_of(build_columns, spans, project_id, batch)
+        buffer_after, _ = best_of(buffer_columns, batch, pending)
+        ser_after, _ = best_of(serialize, batch.insert_columns(), True)
+
+        phases = {
+            "  rows": (build_before, buffer_before, ser_before),
+            "  columnar": (build_after, buffer_after, ser_after),
+        }
+        print(f"{n} spans ({sum(phases['  rows']) / sum(phases['  columnar']):.2f}x)")
+        for label, times in phases.items():
+            print(f"{label:<12}" + "".join(f" {t / n * 1e6:>8.2f}" for t in times) + f" {sum(times) / n * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
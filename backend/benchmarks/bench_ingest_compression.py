@@ -0,0 +1,97 @@
+"""
+Compare ingest body decoding throughput for identity, gzip and zstd bodies.
+
+Builds synthetic observation batches shaped like SDK uploads (large, partly
+repeated prompt bodies), then measures compressed size and the time to
+decompress through the ingest body decoders and parse the JSON.
+
+    uv run python benchmarks/bench_ingest_compression.py
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+import zstandard
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.api.ingest_body import get_decoder  # noqa: E402
+
+PAYLOAD_SIZES = [64 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024]
+REPEATS = 5
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant. Answer using only the provided context. "
+    "If the answer is not in the context, say you don't know. " * 20
+)
+WORDS = "agent tool call retrieval context answer query token model latency span trace".split()
+
+
+def build_payload(target_size: int) -> bytes:
+    rng = random.Random(42)
+    observations = []
+    size = 0
+    i = 0
+    while size < target_size:
+        user_msg = " ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 400)))
+        obs = {
+            "id": i,
+            "trace_id": f"{rng.getrandbits(128):032x}",
+            "name": "llm_call",
+            "type": "llm",
+            "model": "gpt-4o",
+            "start_time": 1_700_000_000_000_000_000 + i * 1_000_000,
+            "end_time": 1_700_000_000_000_000_000 + i * 1_000_000 + 500_000,
+            "input_text": SYSTEM_PROMPT + user_msg,
+            "output_text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))),
+            "token_usage": {"prompt_tokens": 900, "completion_tokens": 120, "total_tokens": 1020},
+        }
+        encoded = json.dumps(obs)
+        size += len(encoded) + 2
+        observations.append(obs)
+        i += 1
+    return json.dumps({"observations": observations}).encode()
+
+
+def decode(body: bytes, encoding: str) -> bytes:
+    decoder = get_decoder(encoding)
+    chunks = []
+    # Feed in 64 KiB pieces, roughly what the ASGI server hands us
+    for i in range(0, len(body), 64 * 1024):
+        chunks.extend(decoder.feed(body[i:i + 64 * 1024]))
+    chunks.extend(decoder.flush())
+    return b"".join(chunks)
+
+
+def bench(body: bytes, encoding: str) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        json.loads(decode(body, encoding))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    zstd = zstandard.ZstdCompressor(level=3)
+    print(f"{'raw size':>10} {'encoding':>9} {'wire size':>10} {'ratio':>6} {'decode+parse':>13} {'MB/s (raw)':>11}")
+    for target in PAYLOAD_SIZES:
+        raw = build_payload(target)
+        bodies = {
+            "identity": raw,
+            "gzip": gzip.compress(raw, compresslevel=6),
+            "zstd": zstd.compress(raw),
+        }
+        for encoding, body in bodies.items():
+            elapsed = bench(body, encoding)
+            print(
+                f"{len(raw) / 1024:>8.0f}KB {encoding:>9} {len(body) / 1024:>8.0f}KB "
+                f"{len(raw) / len(body):>6.1f} {elapsed * 1000:>11.1f}ms {len(raw) / elapsed / 1e6:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
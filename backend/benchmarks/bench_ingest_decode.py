@@ -0,0 +1,173 @@
+"""
+Per-record CPU cost of turning an ingest request body into a ColumnarBatch:
+json.loads + dict lookups + json.dumps of nested fields (the previous
+handlers) versus msgspec Structs with raw JSON slices.
+
+The loops mirror ingest_traces / append_observation; the endpoint module
+itself isn't imported so this runs without the evaluation dependencies.
+
+    uv run python benchmarks/bench_ingest_decode.py
+"""
+import gc
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.clickhouse import observation_batch, trace_batch  # noqa: E402
+from app.core.columnar import to_unix_nanos  # noqa: E402
+from app.core.ingest_schema import (  # noqa: E402
+    decode_observations,
+    decode_spans,
+    raw_string_or_text,
+    raw_text,
+    raw_text_or_none,
+    token_counts,
+)
+
+BATCH_SIZES = [100, 1_000, 10_000]
+REPEATS = 5
+
+
+def make_spans_body(n: int) -> bytes:
+    spans = []
+    for i in range(n):
+        spans.append({
+            "trace_id": f"{i // 10:032x}",
+            "span_id": f"{i:016x}",
+            "parent_span_id": f"{i - 1:016x}" if i % 10 else None,
+            "name": f"step_{i % 7}",
+            "kind": "INTERNAL",
+            "start_time": "2025-01-01T12:00:00.123456Z",
+            "end_time": "2025-01-01T12:00:01.654321Z",
+            "status": {"code": "OK", "message": ""},
+            "attributes": {"enduser.id": "user-1", "llm.model": "gpt-4o"},
+            "events": [{"name": "retry", "timestamp": "2025-01-01T12:00:00.5Z", "attributes": {"n": "1"}}],
+            "links": [],
+            "resource": {"attributes": {"service.name": "agent"}},
+        })
+    return json.dumps({"spans": spans}).encode()
+
+
+def make_observations_body(n: int) -> bytes:
+    observations = []
+    for i in range(n):
+        observations.append({
+            "id": 0x1F2E3D4C5B6A0000 + i,
+            "trace_id": f"{i // 10:032x}",
+            "parent_observation_id": None,
+            "name": "llm_call",
+            "type": "llm",
+            "model": "gpt-4o",
+            "start_time": 1735732800123456000 + i,
+            "end_time": 1735732801654321000 + i,
+            "input_text": "What is the capital of France? " * 4,
+            "output_text": "Paris is the capital of France. " * 4,
+            "token_usage": {"prompt_tokens": 40, "completion_tokens": 28, "total_tokens": 68},
+            "model_parameters": {"temperature": 0.2, "max_tokens": 256},
+            "metadata_json": {"user": "u-1", "tags": ["a", "b"], "session": "s-1"},
+            "observation_type": "generation",
+            "total_cost": 0.00042,
+        })
+    return json.dumps({"observations": observations}).encode()
+
+
+def spans_before(body, project_id, batch):
+    batch.reset()
+    payload = json.loads(body)
+    spans = payload.get("spans", []) if isinstance(payload, dict) else payload
+    for span in spans:
+        start_ns = to_unix_nanos(datetime.fromisoformat(span["start_time"].replace("Z", "+00:00")))
+        end_ns = to_unix_nanos(datetime.fromisoformat(span["end_time"].replace("Z", "+00:00")))
+        batch.append(
+            span.get("trace_id"), span.get("span_id"), span.get("parent_span_id", ""),
+            span.get("name"), span.get("kind", "INTERNAL"), start_ns, end_ns,
+            span.get("status", {}).get("code", "UNSET"), span.get("status", {}).get("message", ""),
+            span.get("attributes", {}), json.dumps(span.get("events", [])), json.dumps(span.get("links", [])),
+            span.get("resource", {}).get("attributes", {}), (end_ns - start_ns) / 1e6,
+            project_id, span.get("attributes", {}).get("enduser.id", ""), "bench",
+        )
+
+
+def spans_after(body, project_id, batch):
+    batch.reset()
+    for span in decode_spans(body):
+        start_ns = to_unix_nanos(span.start_time)
+        end_ns = to_unix_nanos(span.end_time)
+        batch.append(
+            span.trace_id, span.span_id, span.parent_span_id, span.name, span.kind,
+            start_ns, end_ns, span.status.code, span.status.message, span.attributes,
+            raw_text(span.events), raw_text(span.links), span.resource.attributes,
+            (end_ns - start_ns) / 1e6, project_id, span.attributes.get("enduser.id", ""), "bench",
+        )
+
+
+def observations_before(body, project_id, batch):
+    batch.reset()
+    payload = json.loads(body)
+    observations = payload.get("observations", []) if isinstance(payload, dict) else payload
+    for obs in observations:
+        start_ns = int(obs.get("start_time"))
+        end_ns = int(obs.get("end_time"))
+        usage = obs.get("token_usage") or {}
+        batch.append(
+            obs.get("id"), obs.get("trace_id"), obs.get("parent_observation_id"), obs.get("name"),
+            obs.get("type"), obs.get("model"), start_ns, end_ns, obs.get("input_text"), obs.get("output_text"),
+            json.dumps(obs.get("token_usage")) if obs.get("token_usage") else None,
+            json.dumps(obs.get("model_parameters")) if obs.get("model_parameters") else None,
+            json.dumps(obs.get("metadata_json")) if not isinstance(obs.get("metadata_json"), str) and obs.get("metadata_json") else obs.get("metadata_json"),
+            obs.get("extra"), obs.get("observation_type"), obs.get("error"), obs.get("total_cost"),
+            start_ns, project_id, obs.get("user_id"), None, None,
+            usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), usage.get("total_tokens", 0),
+            project_id, "bench",
+        )
+
+
+def observations_after(body, project_id, batch):
+    batch.reset()
+    for obs in decode_observations(body):
+        prompt_tokens, completion_tokens, total_tokens = token_counts(obs.token_usage)
+        batch.append(
+            obs.id, obs.trace_id, obs.parent_observation_id, obs.name, obs.type, obs.model,
+            obs.start_time, obs.end_time, obs.input_text, obs.output_text,
+            raw_text_or_none(obs.token_usage), raw_text_or_none(obs.model_parameters),
+            raw_string_or_text(obs.metadata_json), obs.extra, obs.observation_type, obs.error,
+            obs.total_cost, obs.start_time, project_id, obs.user_id, None, None,
+            prompt_tokens, completion_tokens, total_tokens, project_id, "bench",
+        )
+
+
+def best_of(fn, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        gc.collect()
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    project_id = uuid.uuid4()
+    print("us/record                 dicts    typed  speedup")
+    for label, make_body, make_batch, before, after in (
+        ("traces", make_spans_body, trace_batch, spans_before, spans_after),
+        ("observations", make_observations_body, observation_batch, observations_before, observations_after),
+    ):
+        for n in BATCH_SIZES:
+            body = make_body(n)
+            batch = make_batch(n)
+            t_before = best_of(before, body, project_id, batch)
+            t_after = best_of(after, body, project_id, batch)
+            print(
+                f"{label:<12} {n:>6}  {t_before / n * 1e6:>9.2f} {t_after / n * 1e6:>8.2f} "
+                f"{t_before / t_after:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
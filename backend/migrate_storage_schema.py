@@ -0,0 +1,195 @@
+"""
+Convert traces and observations created with an older storage layout to
+the current one (STORAGE_SCHEMA_VERSION in app/core/clickhouse.py), while
+ingest keeps running.
+
+    uv run python migrate_storage_schema.py [--table traces] [--chunk-hours 24] [--no-swap]
+
+For each table that isn't on the current layout yet:
+
+1. creates <table>_v<N> with the current layout, and a materialized view
+   copying every row inserted into <table> from then on into it;
+2. copies the existing rows over, chunk_hours of start_time at a time,
+   skipping rows the view already copied;
+3. drops the view and swaps the two tables with EXCHANGE TABLES. Rows that
+   reached the old table in between are attached to the new one as parts,
+   which doesn't run the views behind trace_summary and the hourly rollups
+   again. The old rows stay in <table>_v<N> until you drop it.
+
+Those views read from the table by name, so they follow the swap; this is
+checked against system.tables, and the swap is undone if they didn't. An
+interrupted run can be restarted; with --no-swap it stops after copying, to
+compare the tables first. NULLs in columns that are no longer Nullable are
+copied as '' (or the type's default).
+"""
+import argparse
+import time
+from typing import Set, Tuple
+
+from app.core.clickhouse import (
+    STORAGE_SCHEMA_COMMENT,
+    STORAGE_SCHEMA_VERSION,
+    enable_insert_deduplication,
+    get_clickhouse_client,
+    init_clickhouse,
+    observations_table_ddl,
+    traces_table_ddl,
+)
+
+# DDL of the new table and the key identifying a row, to skip rows the
+# view copied already
+TABLES = {
+    "traces": (traces_table_ddl, "(trace_id, span_id)"),
+    "observations": (observations_table_ddl, "id"),
+}
+
+
+def table_comment(client, table: str) -> str:
+    result = client.query(
+        "SELECT comment FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+        parameters={"table": table},
+    )
+    return result.result_rows[0][0] if result.result_rows else ""
+
+
+def table_views(client, table: str) -> Set[str]:
+    """
+    Materialized views that run on inserts into the table.
+    """
+    result = client.query(
+        "SELECT dependencies_table FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+        parameters={"table": table},
+    )
+    return set(result.result_rows[0][0]) if result.result_rows else set()
+
+
+def select_columns(client, table: str, new_table: str) -> Tuple[str, str]:
+    """
+    Column list of the new table and the matching select on the old one.
+    INSERT ... SELECT matches columns by position, so both list them.
+    """
+    old_types = {row[0]: row[1] for row in client.query(f"DESCRIBE TABLE {table}").result_rows}
+    names, exprs = [], []
+    for row in client.query(f"DESCRIBE TABLE {new_table}").result_rows:
+        name, new_type, default_type = row[0], row[1], row[2]
+        if default_type in ("MATERIALIZED", "ALIAS"):
+            continue
+        names.append(name)
+        if "Nullable" in old_types[name] and "Nullable" not in new_type:
+            exprs.append(f"ifNull({name}, defaultValueOfTypeName('{new_type}')) AS {name}")
+        else:
+            exprs.append(name)
+    return ", ".join(names), ", ".join(exprs)
+
+
+def copy_rows(client, table: str, new_table: str, key: str, columns: str, select: str, chunk_hours: int):
+    result = client.query(
+        f"SELECT count(), toUnixTimestamp(min(start_time)), toUnixTimestamp(max(start_time)) FROM {table}"
+    )
+    rows, first, last = result.result_rows[0]
+    if not rows:
+        return
+    chunk = chunk_hours * 3600
+    start = first - first % chunk
+    chunks = (last - start) // chunk + 1
+    in_chunk = "start_time >= toDateTime({lo:UInt32}) AND start_time < toDateTime({hi:UInt32})"
+    for i in range(chunks):
+        lo = start + i * chunk
+        client.command(
+            f"""
+            INSERT INTO {new_table} ({columns})
+            SELECT {select} FROM {table}
+            WHERE {in_chunk}
+              AND {key} NOT IN (SELECT {key} FROM {new_table} WHERE {in_chunk})
+            """,
+            parameters={"lo": lo, "hi": lo + chunk},
+        )
+        print(f"[{i + 1}/{chunks}] {table}: copied rows starting before {time.strftime('%Y-%m-%d %H:%M', time.gmtime(lo + chunk))} UTC")
+
+
+def attach_late_rows(client, table: str, old_table: str, key: str, ddl, columns: str, select: str, since: int):
+    """
+    Move rows ingested into old_table since `since` (ns) that are missing
+    from table. They were counted by the views when first inserted, so they
+    go through a staging table and ATTACH PARTITION, which runs no views.
+    """
+    staging = f"{table}_late_rows"
+    client.command(f"DROP TABLE IF EXISTS {staging}")
+    client.command(ddl(staging))
+    try:
+        client.command(
+            f"""
+            INSERT INTO {staging} ({columns})
+            SELECT {select} FROM {old_table}
+            WHERE ingest_version >= {{since:UInt64}}
+              AND {key} NOT IN (SELECT {key} FROM {table} WHERE ingest_version >= {{since:UInt64}})
+            """,
+            parameters={"since": since},
+        )
+        partitions = client.query(
+            "SELECT DISTINCT partition_id FROM system.parts "
+            "WHERE database = currentDatabase() AND table = {table:String} AND active",
+            parameters={"table": staging},
+        ).result_rows
+        for (partition_id,) in partitions:
+            client.command(f"ALTER TABLE {table} ATTACH PARTITION ID '{partition_id}' FROM {staging}")
+        late = client.query(f"SELECT count() FROM {staging}").result_rows[0][0]
+        print(f"{table}: attached {late} rows ingested during the swap")
+    finally:
+        client.command(f"DROP TABLE IF EXISTS {staging}")
+
+
+def migrate_table(table: str, chunk_hours: int, swap: bool):
+    client = get_clickhouse_client()
+    if table_comment(client, table) == STORAGE_SCHEMA_COMMENT:
+        print(f"{table} already uses {STORAGE_SCHEMA_COMMENT}")
+        return
+
+    ddl, key = TABLES[table]
+    new_table = f"{table}_v{STORAGE_SCHEMA_VERSION}"
+    sync_view = f"{new_table}_sync_mv"
+    client.command(ddl(new_table))
+    enable_insert_deduplication(client, new_table)
+    columns, select = select_columns(client, table, new_table)
+    # Rows inserted from here on reach the new table through the view, so
+    # the copy below doesn't need to catch up with ingest
+    client.command(
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {sync_view} TO {new_table} "
+        f"AS SELECT {select} FROM {table}"
+    )
+    copy_rows(client, table, new_table, key, columns, select, chunk_hours)
+
+    old_count = client.query(f"SELECT count() FROM {table}").result_rows[0][0]
+    new_count = client.query(f"SELECT count() FROM {new_table}").result_rows[0][0]
+    print(f"{table}: {old_count} rows, {new_table}: {new_count} rows")
+    if not swap:
+        print(f"Not swapped; run again without --no-swap to finish {table}.")
+        return
+
+    views = table_views(client, table) - {sync_view}
+    # With a minute of margin for rows still being inserted when the view goes
+    since = client.query("SELECT toUnixTimestamp64Nano(now64(9))").result_rows[0][0] - 60 * 10**9
+    client.command(f"DROP VIEW IF EXISTS {sync_view}")
+    client.command(f"EXCHANGE TABLES {table} AND {new_table}")
+    missing = views - table_views(client, table)
+    if missing:
+        client.command(f"EXCHANGE TABLES {table} AND {new_table}")
+        raise SystemExit(
+            f"Views {', '.join(sorted(missing))} didn't follow the swap, which was undone; "
+            f"{table} still uses the old layout."
+        )
+    attach_late_rows(client, table, new_table, key, ddl, columns, select, since)
+    print(f"{table} now uses {STORAGE_SCHEMA_COMMENT}; the old rows are in {new_table}, drop it once verified.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--table", choices=list(TABLES), help="Only convert this table")
+    parser.add_argument("--chunk-hours", type=int, default=24, help="Hours of start_time copied per INSERT")
+    parser.add_argument("--no-swap", action="store_true", help="Copy the rows but keep serving the old table")
+    args = parser.parse_args()
+
+    # Adds the columns the old tables may still lack, so both sides match
+    init_clickhouse()
+    for table in [args.table] if args.table else TABLES:
+        migrate_table(table, args.chunk_hours, not args.no_swap)
@@ -0,0 +1,26 @@
+"""
+Write the typed token columns of observations to disk for the rows that
+were ingested before the columns existed.
+
+    uv run python migrate_token_columns.py
+
+Until then ClickHouse computes them from token_usage on every read (the
+column DEFAULT), which is correct but as slow as the JSON parsing they
+replace. MATERIALIZE COLUMN runs as a background mutation; progress shows
+up in system.mutations.
+"""
+from app.core.clickhouse import TOKEN_COLUMNS, get_clickhouse_client, init_clickhouse
+
+
+def materialize_token_columns():
+    client = get_clickhouse_client()
+    for column in TOKEN_COLUMNS:
+        client.command(f"ALTER TABLE observations MATERIALIZE COLUMN {column}")
+        print(f"Materializing observations.{column}")
+    print("Mutations queued, see system.mutations for progress.")
+
+
+if __name__ == "__main__":
+    # Adds the columns if this server hasn't started since they were introduced
+    init_clickhouse()
+    materialize_token_columns()
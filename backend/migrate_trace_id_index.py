@@ -0,0 +1,25 @@
+"""
+Build the trace_id skipping index for the traces and observations rows that
+were ingested before the index existed.
+
+    uv run python migrate_trace_id_index.py
+
+Parts written before that aren't covered by the index and are still scanned
+by trace detail reads. MATERIALIZE INDEX runs as a background mutation;
+progress shows up in system.mutations.
+"""
+from app.core.clickhouse import TRACE_ID_INDEX, get_clickhouse_client, init_clickhouse
+
+
+def materialize_trace_id_index():
+    client = get_clickhouse_client()
+    for table in ("traces", "observations"):
+        client.command(f"ALTER TABLE {table} MATERIALIZE INDEX {TRACE_ID_INDEX}")
+        print(f"Materializing {table}.{TRACE_ID_INDEX}")
+    print("Mutations queued, see system.mutations for progress.")
+
+
+if __name__ == "__main__":
+    # Adds the index if this server hasn't started since it was introduced
+    init_clickhouse()
+    materialize_trace_id_index()
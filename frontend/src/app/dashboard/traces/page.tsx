@@ -52,6 +52,12 @@ export default function TracesPage() {
       }
   }, [searchParams]);
 
+  // Start times come back as naive UTC; undefined when the trace isn't in the list
+  const selectedTrace = traces.find(t => t.trace_id === selectedTraceId);
+  const selectedTraceStartTs = selectedTrace
+      ? new Date(`${selectedTrace.start_time}Z`).getTime() / 1000
+      : undefined;
+
   const handleTraceClick = (traceId: string) => {
       const newParams = new URLSearchParams(searchParams.toString());
       newParams.set('trace_id', traceId);
@@ -439,6 +445,8 @@ export default function TracesPage() {
          isOpen={!!selectedTraceId} 
          onClose={handleCloseTrace}
          traceId={selectedTraceId}
+         projectId={selectedProject?.id}
+         startTs={selectedTraceStartTs}
        />
 
         {/* Evaluation Modal for Row Actions */}
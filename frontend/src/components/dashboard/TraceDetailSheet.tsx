@@ -26,6 +26,9 @@ interface TraceDetailSheetProps {
   isOpen: boolean;
   onClose: () => void;
   traceId: string | null;
+  // Narrow the lookup to the trace's project and time when the caller knows them
+  projectId?: string;
+  startTs?: number;
 }
 
 interface Node {
@@ -52,6 +55,8 @@ export default function TraceDetailSheet({
   isOpen,
   onClose,
   traceId,
+  projectId,
+  startTs,
 }: TraceDetailSheetProps) {
   const [selectedNodeId, setSelectedNodeId] = useState<string | null>(null);
   const [data, setData] = useState<{
@@ -67,7 +72,9 @@ export default function TraceDetailSheet({
       if (!traceId || !isOpen) return;
       try {
         setLoading(true);
-        const res = await api.get(`/analytics/traces/${traceId}`);
+        const res = await api.get(`/analytics/traces/${traceId}`, {
+          params: { project_id: projectId, start_ts: startTs },
+        });
         setData(res.data);
       } catch (err) {
         console.error("Failed to fetch trace details:", err);
@@ -81,7 +88,7 @@ export default function TraceDetailSheet({
     } else {
       setData(null); // Reset on close
     }
-  }, [traceId, isOpen]);
+  }, [traceId, isOpen, projectId, startTs]);
 
   // Build Tree
   const rootNodes = useMemo(() => {